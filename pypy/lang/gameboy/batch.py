@@ -0,0 +1,285 @@
+"""
+PyBoy GameBoy (TM) Emulator
+
+Headless Batch Runner
+"""
+
+import os
+import time
+from pypy.lang.gameboy import constants
+from pypy.lang.gameboy.gameboy import GameBoy
+from pypy.lang.gameboy.cartridge import Cartridge
+from pypy.lang.gameboy.video import VideoDriver
+from pypy.lang.gameboy.sound import SoundDriver, NullSoundDriver
+from pypy.lang.gameboy.joypad import JoypadDriver
+from pypy.lang.gameboy.timer import Clock
+from pypy.rlib.rmd5 import RMD5
+from pypy.rlib.rarithmetic import r_uint
+
+FNV_OFFSET = r_uint(0x811C9DC5)
+FNV_PRIME  = r_uint(0x01000193)
+HASH_MASK  = r_uint(0xFFFFFFFF)
+
+
+# headless video modes
+VIDEO_DISCARD = 0
+VIDEO_HASH    = 1
+VIDEO_DUMP    = 2
+
+# dump formats
+DUMP_RAW = 0
+DUMP_PPM = 1
+
+
+def hash_pixels(pixels):
+    # 32 bit FNV-1a over the pixels
+    hash = FNV_OFFSET
+    for pixel in pixels:
+        hash = ((hash ^ r_uint(pixel)) * FNV_PRIME) & HASH_MASK
+    return hash
+
+
+class HeadlessVideoDriver(VideoDriver):
+    """
+    Video driver without a display. Only every interval-th frame is drawn:
+    VIDEO_DISCARD draws no frames at all, VIDEO_HASH records the hash of
+    the drawn frames in frame_hashes and VIDEO_DUMP writes them to path.
+    A raw dump appends the RGB bytes of every frame to the file at path,
+    a PPM dump writes one image per frame to path % frame.
+    """
+    def __init__(self, mode=VIDEO_HASH, interval=1, path=None,
+                 format=DUMP_PPM):
+        VideoDriver.__init__(self)
+        assert interval > 0
+        assert mode != VIDEO_DUMP or path is not None
+        self.mode = mode
+        self.interval = interval
+        self.path = path
+        self.format = format
+        self.frame = 0
+        self.frame_hashes = []
+        self.rgb = ["\x00"] * (self.width * self.height * 3)
+        if mode == VIDEO_DUMP and format == DUMP_RAW:
+            # start a new raw stream
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             0644))
+
+    def clone(self):
+        # forks do not write into the dump of their parent
+        mode = self.mode
+        if mode == VIDEO_DUMP:
+            mode = VIDEO_HASH
+        driver = HeadlessVideoDriver(mode, self.interval)
+        driver.pixels = self.pixels[:]
+        driver.frame = self.frame
+        return driver
+
+    def is_frame_needed(self, frame):
+        if self.mode == VIDEO_DISCARD or frame % self.interval != 0:
+            return False
+        self.frame = frame
+        return True
+
+    def update_display(self):
+        pass
+
+    def update_display_lines(self, changed_lines):
+        # unchanged frames are checked too
+        if self.mode == VIDEO_HASH:
+            self.frame_hashes.append((self.frame, self.get_frame_hash()))
+        elif self.mode == VIDEO_DUMP:
+            self.dump_frame()
+
+    def get_frame_hash(self):
+        return hash_pixels(self.pixels)
+
+    def get_rgb_data(self):
+        index = 0
+        for pixel in self.pixels:
+            self.rgb[index]     = chr((pixel >> 16) & 0xFF)
+            self.rgb[index + 1] = chr((pixel >> 8) & 0xFF)
+            self.rgb[index + 2] = chr(pixel & 0xFF)
+            index += 3
+        return "".join(self.rgb)
+
+    def dump_frame(self):
+        if self.format == DUMP_PPM:
+            fd = os.open(self.path % self.frame,
+                         os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+            header = "P6\n%d %d\n255\n" % (self.width, self.height)
+            data = header + self.get_rgb_data()
+        else:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND, 0644)
+            data = self.get_rgb_data()
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def pack_int(value, size):
+    # little endian
+    data = []
+    for index in range(0, size):
+        data.append(chr((value >> (index * 8)) & 0xFF))
+    return "".join(data)
+
+
+class WaveSoundDriver(SoundDriver):
+    """
+    Streams the samples into a PCM WAV file at path, the sizes in the
+    header are written by stop. The samples are written once the ring is
+    half full.
+    """
+    def __init__(self, path, sample_rate=44100, bits_per_sample=16,
+                 output_rate=0, latency=100):
+        SoundDriver.__init__(self, sample_rate, latency, bits_per_sample)
+        if output_rate > 0:
+            self.set_output_rate(output_rate)
+        self.data_size = 0
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        os.write(self.fd, self.get_header())
+
+    def get_header(self):
+        block_align = self.channel_count * self.bits_per_sample / 8
+        return "RIFF" + pack_int(36 + self.data_size, 4) + "WAVE" + \
+               "fmt " + pack_int(16, 4) + pack_int(1, 2) + \
+               pack_int(self.channel_count, 2) + \
+               pack_int(self.output_rate, 4) + \
+               pack_int(self.output_rate * block_align, 4) + \
+               pack_int(block_align, 2) + \
+               pack_int(self.bits_per_sample, 2) + \
+               "data" + pack_int(self.data_size, 4)
+
+    def update(self):
+        if self.ring.get_available() >= self.ring.get_size() / 2:
+            self.write_samples()
+
+    def write_samples(self):
+        length = self.read_samples(self.ring.get_available())
+        data = self.encode_samples(length)
+        os.write(self.fd, data)
+        self.data_size += len(data)
+
+    def stop(self):
+        if self.fd < 0:
+            return
+        self.write_samples()
+        os.lseek(self.fd, 0, 0)
+        os.write(self.fd, self.get_header())
+        os.close(self.fd)
+        self.fd = -1
+
+
+class BatchGameBoy(GameBoy):
+    """
+    Without drivers given, the video is hashed and no sound is mixed.
+    """
+    def __init__(self, video_driver=None, sound_driver=None,
+                 joypad_driver=None, parent=None):
+        if video_driver is None:
+            video_driver = HeadlessVideoDriver()
+        if sound_driver is None:
+            sound_driver = NullSoundDriver()
+        if joypad_driver is None:
+            joypad_driver = JoypadDriver()
+        self.headless_video_driver = video_driver
+        self.headless_sound_driver = sound_driver
+        self.headless_joypad_driver = joypad_driver
+        GameBoy.__init__(self, parent)
+
+    def create_drivers(self):
+        self.clock = Clock()
+        self.video_driver = self.headless_video_driver
+        self.sound_driver = self.headless_sound_driver
+        self.joypad_driver = self.headless_joypad_driver
+
+    def create_fork(self):
+        return BatchGameBoy(self.video_driver.clone(),
+                            self.sound_driver.clone(),
+                            self.joypad_driver.clone(), self)
+
+    def get_frame_hash(self):
+        return self.video_driver.get_frame_hash()
+
+    def get_digest(self):
+        """
+        Hex MD5 of the register file and the frame buffer hash.
+        """
+        cpu = self.cpu
+        data = [chr(register) for register in cpu.registers]
+        data.append(chr(cpu.flags))
+        words = [cpu.stack_pointer, cpu.program_counter]
+        hash = self.get_frame_hash()
+        words.append(int(hash >> 16))
+        words.append(int(hash & 0xFFFF))
+        for word in words:
+            data.append(chr(word >> 8))
+            data.append(chr(word & 0xFF))
+        return RMD5("".join(data)).hexdigest()
+
+
+class BatchRunner(object):
+    """
+    Emulates a number of independent GameBoys running the same cartridge,
+    which is loaded only once. The GameBoys draw every frame_interval-th
+    frame in the given headless video mode, either per scanline or dot
+    accurate.
+    """
+    def __init__(self, cartridge_path, instances=1, video_mode=VIDEO_HASH,
+                 frame_interval=1, dot_accurate=False):
+        self.cartridge = Cartridge(cartridge_path)
+        self.gameboys = []
+        for index in range(instances):
+            driver = HeadlessVideoDriver(video_mode, frame_interval)
+            gameboy = BatchGameBoy(driver)
+            gameboy.load_cartridge(self.cartridge)
+            gameboy.set_dot_accurate_video(dot_accurate)
+            self.gameboys.append(gameboy)
+        self.cycles = 0
+        self.time = 0.0
+
+    def emulate(self, cycles):
+        start = time.time()
+        for gameboy in self.gameboys:
+            gameboy.emulate(cycles)
+        self.time += time.time() - start
+        self.cycles += cycles
+
+    def emulate_frames(self, frames):
+        self.emulate(frames * constants.FRAME_TICKS)
+
+    def get_frames(self):
+        return len(self.gameboys) * self.cycles / constants.FRAME_TICKS
+
+    def get_instructions(self):
+        instructions = 0
+        for gameboy in self.gameboys:
+            instructions += gameboy.cpu.instructions
+        return instructions
+
+    def get_frames_per_second(self):
+        if self.time <= 0.0:
+            return 0.0
+        return self.get_frames() / self.time
+
+    def get_instructions_per_second(self):
+        if self.time <= 0.0:
+            return 0.0
+        return self.get_instructions() / self.time
+
+    def get_report(self):
+        return "%d instances, %d frames, %d instructions in %f s\n" \
+               "%f frames/s, %f instructions/s\n" % (len(self.gameboys),
+                    self.get_frames(), self.get_instructions(), self.time,
+                    self.get_frames_per_second(),
+                    self.get_instructions_per_second())
+
+    def write_digests(self, path):
+        # one line per instance
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        try:
+            for gameboy in self.gameboys:
+                os.write(fd, gameboy.get_digest() + "\n")
+        finally:
+            os.close(fd)
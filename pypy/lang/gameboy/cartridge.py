@@ -5,7 +5,8 @@ from pypy.lang.gameboy import constants
 from pypy.lang.gameboy.timer import *
 from pypy.rlib.streamio import open_file_as_stream
 
-from pypy.lang.gameboy.ram import iMemory
+from pypy.lang.gameboy.ram import iMemory, ByteBuffer
+from pypy.lang.gameboy.savestate import InvalidStateError
 
 #from pypy.rlib.rstr import str_replace
 
@@ -37,6 +38,63 @@ def map_to_byte( string):
         mapped[i]  = ord(string[i]) & 0xFF
     return mapped
 
+def read_rom_file(path):
+    stream = open_file_as_stream(path)
+    try:
+        return stream.readall()
+    finally:
+        stream.close()
+
+
+class RomCache(object):
+    """
+    The contents of the last size ROM files read, as strings. An entry is
+    reread once the size or the modification time of its file changes.
+    The strings are the read-only ROM images of the cartridges, all loads
+    of a path through one cache share its image.
+    """
+    def __init__(self, size=16):
+        assert size > 0
+        self.size = size
+        self.entries = {}
+        # the paths, the least recently read first
+        self.paths = []
+
+    def contains(self, path):
+        return path in self.entries
+
+    def read(self, path):
+        stat = os.stat(path)
+        entry = self.entries.get(path, None)
+        if entry is not None and entry.size == stat.st_size and \
+           entry.mtime == stat.st_mtime:
+            self.paths.remove(path)
+            self.paths.append(path)
+            return entry.data
+        if entry is not None:
+            self.paths.remove(path)
+        self.entries[path] = RomCacheEntry(read_rom_file(path),
+                                           stat.st_size, stat.st_mtime)
+        self.paths.append(path)
+        while len(self.paths) > self.size:
+            del self.entries[self.paths.pop(0)]
+        return self.entries[path].data
+
+    def clear(self):
+        self.entries.clear()
+        self.paths = []
+
+
+class RomCacheEntry(object):
+
+    def __init__(self, data, size, mtime):
+        self.data = data
+        self.size = size
+        self.mtime = mtime
+
+# the cache of the cartridges loaded without one of their own
+ROM_CACHE = RomCache()
+
 def map_to_string(int_array):
     mapped = [0]*len(int_array)
     for i in range(len(int_array)):
@@ -56,7 +114,7 @@ class CartridgeManager(object):
         
     def reset(self):
         if not self.has_battery():
-            self.ram[0:len(self.ram):1] = 0xFF
+            self.ram.fill(0xFF)
         self.mbc.reset()
 
     def read(self, address):
@@ -64,6 +122,20 @@ class CartridgeManager(object):
     
     def write(self, address, data):
         self.mbc.write(address, data)
+
+    def save_state(self, state):
+        # identifies the cartridge, the ROM itself is not stored
+        state.write_int(len(self.rom))
+        state.write_int(self.get_checksum())
+        state.write_int(self.get_header_checksum())
+        self.mbc.save_state(state)
+
+    def load_state(self, state):
+        if state.read_int() != len(self.rom) or \
+           state.read_int() != self.get_checksum() or \
+           state.read_int() != self.get_header_checksum():
+            raise InvalidStateError("save state of another cartridge")
+        self.mbc.load_state(state)
     
     def load(self, cartridge):
         assert isinstance(cartridge, Cartridge)
@@ -75,6 +147,14 @@ class CartridgeManager(object):
         self.mbc = self.create_bank_controller(self.get_memory_bank_type(), \
                                                self.rom, self.ram, self.clock)
         
+    def load_fork(self, manager):
+        # shares the ROM, the RAM pages are shared until they are written
+        self.cartridge = manager.cartridge
+        self.rom = manager.rom
+        self.ram = manager.ram.fork()
+        self.mbc = self.create_bank_controller(self.get_memory_bank_type(), \
+                                               self.rom, self.ram, self.clock)
+        
     def check_rom(self):
         if not self.verify_header():
             raise Exception("Cartridge header is corrupted")
@@ -86,18 +166,20 @@ class CartridgeManager(object):
         if self.get_memory_bank_type() >= constants.TYPE_MBC2 \
                 and self.get_memory_bank_type() <= constants.TYPE_MBC2_BATTERY:
             ram_size = 512
-        self.ram = [0xFF]*ram_size
+        self.ram = ByteBuffer(ram_size, 0xFF)
         
     def load_battery(self):
         if self.cartridge.has_battery():
-            self.ram = self.cartridge.read_battery()
+            battery = self.cartridge.read_battery()
+            self.ram = ByteBuffer(len(battery))
+            self.ram.load_string(map_to_string(battery))
 
     def save(self, cartridge_name):
         if self.cartridge.has_battery():
-            self.cartridge.write_battery(self.ram)
+            self.cartridge.write_battery(map_to_byte(self.ram.to_string()))
             
     def get_memory_bank_type(self):
-        return self.rom[constants.CARTRIDGE_TYPE_ADDRESS] & 0xFF
+        return ord(self.rom[constants.CARTRIDGE_TYPE_ADDRESS])
     
     def get_memory_bank(self):
         return self.mbc
@@ -106,29 +188,30 @@ class CartridgeManager(object):
         return self.rom
         
     def get_rom_size(self):
-        rom_size = self.rom[constants.CARTRIDGE_ROM_SIZE_ADDRESS] & 0xFF
+        rom_size = ord(self.rom[constants.CARTRIDGE_ROM_SIZE_ADDRESS])
         if rom_size>=0x00 and rom_size<=0x07:
             return 32768 << rom_size
         return -1
         
     def get_ram_size(self):
-        return constants.CARTRIDGE_RAM_SIZE_MAPPING[self.rom[constants.CARTRIDGE_RAM_SIZE_ADDRESS]]
+        return constants.CARTRIDGE_RAM_SIZE_MAPPING[
+                    ord(self.rom[constants.CARTRIDGE_RAM_SIZE_ADDRESS])]
     
     def get_destination_code(self):
-        return self.rom[constants.DESTINATION_CODE_ADDRESS] & 0xFF
+        return ord(self.rom[constants.DESTINATION_CODE_ADDRESS])
     
     def get_licensee_code():
-        return self.rom[constants.LICENSEE_ADDRESS] & 0xFF
+        return ord(self.rom[constants.LICENSEE_ADDRESS])
 
     def get_rom_version(self):
-        return self.rom[constants.CARTRIDGE_ROM_VERSION_ADDRESS] & 0xFF
+        return ord(self.rom[constants.CARTRIDGE_ROM_VERSION_ADDRESS])
     
     def get_header_checksum(self):
-        return self.rom[constants.HEADER_CHECKSUM_ADDRESS] & 0xFF
+        return ord(self.rom[constants.HEADER_CHECKSUM_ADDRESS])
     
     def get_checksum(self):
-        return ((self.rom[constants.CHECKSUM_A_ADDRESS] & 0xFF) << 8) \
-                + (self.rom[constants.CHECKSUM_B_ADDRESS] & 0xFF)
+        return (ord(self.rom[constants.CHECKSUM_A_ADDRESS]) << 8) \
+                + ord(self.rom[constants.CHECKSUM_B_ADDRESS])
     
     def has_battery(self):
         return has_cartridge_battery(self.get_memory_bank_type())
@@ -137,7 +220,7 @@ class CartridgeManager(object):
         checksum = 0
         for address in range(len(self.rom)):
             if address is not 0x014E and address is not 0x014F:
-                checksum = (checksum + (self.rom[address] & 0xFF)) & 0xFFFF
+                checksum = (checksum + ord(self.rom[address])) & 0xFFFF
         return (checksum == self.get_checksum())
     
     def verify_header(self):
@@ -145,7 +228,7 @@ class CartridgeManager(object):
             return False
         checksum = 0xE7
         for address in range(0x0134, 0x014C):
-            checksum = (checksum - (self.rom[address] & 0xFF)) & 0xFF
+            checksum = (checksum - ord(self.rom[address])) & 0xFF
         return (checksum == self.get_header_checksum())
     
     def create_bank_controller(self, type, rom, ram, clock_driver):
@@ -159,10 +242,10 @@ class Cartridge(object):
     """
         File mapping. Holds the file contents
     """
-    def __init__(self, file=None):
+    def __init__(self, file=None, cache=None):
         self.reset()
         if file is not None:
-            self.load(file)
+            self.load(file, cache)
         
     def reset(self):
         self.cartridge_name = ""
@@ -175,14 +258,15 @@ class Cartridge(object):
         self.battery_file_contents = None
         
         
-    def load(self, cartridge_path):
+    def load(self, cartridge_path, cache=None):
         if cartridge_path is None:
             raise Exception("cartridge_path cannot be None!")
         cartridge_path = str(cartridge_path)
         self.cartridge_file_path = cartridge_path
-        self.cartridge_stream = open_file_as_stream(cartridge_path)
-        self.cartridge_file_contents = map_to_byte( \
-                                                self.cartridge_stream.readall())
+        if cache is None:
+            cache = ROM_CACHE
+        # the image is read-only, index it with ord()
+        self.cartridge_file_contents = cache.read(cartridge_path)
         self.load_battery(cartridge_path)
         
     def load_battery(self, cartridge_file_path):
@@ -257,8 +341,8 @@ class MBC(iMemory):
         self.rom_bank = constants.ROM_BANK_SIZE
         self.ram_bank = 0
         self.ram_enable = False
-        self.rom = []
-        self.ram = []
+        self.rom = ""
+        self.ram = ByteBuffer(0)
         self.rom_size = 0
         self.ram_size = 0
     
@@ -271,7 +355,7 @@ class MBC(iMemory):
 
 
     def set_ram(self, buffer):
-        banks = len(buffer) / constants.RAM_BANK_SIZE
+        banks = buffer.get_size() / constants.RAM_BANK_SIZE
         if banks < self.min_ram_bank_size or banks > self.max_ram_bank_size:
             raise Exception("Invalid constants.RAM size")
         self.ram = buffer
@@ -280,12 +364,31 @@ class MBC(iMemory):
         
     def read(self, address):    
         if address <= 0x3FFF: # 0000-3FFF
-            return self.rom[address] & 0xFF
+            return ord(self.rom[address])
         elif address <= 0x7FFF:# 4000-7FFF
-            return self.rom[self.rom_bank + (address & 0x3FFF)] & 0xFF
+            return ord(self.rom[self.rom_bank + (address & 0x3FFF)])
         elif address >= 0xA000 and address <= 0xBFFF and self.ram_enable: # A000-BFFF
-            return self.ram[self.ram_bank + (address & 0x1FFF)] & 0xFF
+            return self.ram.get(self.ram_bank + (address & 0x1FFF))
         raise Exception("MBC: Invalid address, out of range")
+
+    def get_ram_offset(self, address):
+        # offset of the RAM address A000-BFFF in the RAM buffer, -1 if reads
+        # do not go to the buffer
+        if self.ram_enable:
+            return self.ram_bank + (address & 0x1FFF)
+        return -1
+
+    def save_state(self, state):
+        state.write_int(self.rom_bank)
+        state.write_int(self.ram_bank)
+        state.write_bool(self.ram_enable)
+        state.write_buffer(self.ram)
+
+    def load_state(self, state):
+        self.rom_bank   = state.read_int()
+        self.ram_bank   = state.read_int()
+        self.ram_enable = state.read_bool()
+        state.read_buffer(self.ram)
     
     def write(self, address, data):
         pass
@@ -328,6 +431,14 @@ class MBC1(MBC):
         MBC.reset(self)
         self.memory_model = 0
 
+    def save_state(self, state):
+        MBC.save_state(self, state)
+        state.write_int(self.memory_model)
+
+    def load_state(self, state):
+        MBC.load_state(self, state)
+        self.memory_model = state.read_int()
+
     def write(self, address, data):
         if address <= 0x1FFF:  # 0000-1FFF
             self.write_ram_enable(address, data)
@@ -338,7 +449,7 @@ class MBC1(MBC):
         elif address <= 0x7FFF: # 6000-7FFF
             self.memory_model = data & 0x01
         elif address >= 0xA000 and address <= 0xBFFF and self.ram_enable: # A000-BFFF
-            self.ram[self.ram_bank + (address & 0x1FFF)] = data
+            self.ram.set(self.ram_bank + (address & 0x1FFF), data)
 
     def write_ram_enable(self, address, data):
         if self.ram_size > 0:
@@ -388,6 +499,11 @@ class MBC2(MBC):
             return 0xFF
         else:
             return MBC.read(self, address)
+
+    def get_ram_offset(self, address):
+        if address > 0xA1FF:
+            return -1
+        return MBC.get_ram_offset(self, address)
         
     def write(self, address, data):
         if address <= 0x1FFF:  # 0000-1FFF
@@ -410,7 +526,7 @@ class MBC2(MBC):
         
     def write_ram(self, address, data):
         if self.ram_enable:
-            self.ram[address & 0x01FF] = data & 0x0F
+            self.ram.set(address & 0x01FF, data & 0x0F)
 
 
 #-------------------------------------------------------------------------------
@@ -451,15 +567,49 @@ class MBC3(MBC):
         self.clockLDays     = 0
         self.clockLControl  = 0
 
+    def save_state(self, state):
+        MBC.save_state(self, state)
+        state.write_int(self.clock_time)
+        state.write_int(self.clock_latch)
+        state.write_int(self.clock_register)
+        state.write_ints([self.clockSeconds, self.clockMinutes,
+                          self.clockHours, self.clockDays, self.clockControl,
+                          self.clockLSeconds, self.clockLMinutes,
+                          self.clockLHours, self.clockLDays,
+                          self.clockLControl])
+
+    def load_state(self, state):
+        MBC.load_state(self, state)
+        self.clock_time     = state.read_int()
+        self.clock_latch    = state.read_int()
+        self.clock_register = state.read_int()
+        clock = [0] * 10
+        state.read_ints(clock)
+        self.clockSeconds   = clock[0]
+        self.clockMinutes   = clock[1]
+        self.clockHours     = clock[2]
+        self.clockDays      = clock[3]
+        self.clockControl   = clock[4]
+        self.clockLSeconds  = clock[5]
+        self.clockLMinutes  = clock[6]
+        self.clockLHours    = clock[7]
+        self.clockLDays     = clock[8]
+        self.clockLControl  = clock[9]
+
 
     def read(self, address):
         if address >= 0xA000 and address <= 0xBFFF:  # A000-BFFF
             if self.ram_bank >= 0:
-                return self.ram[self.ram_bank + (address & 0x1FFF)] & 0xFF
+                return self.ram.get(self.ram_bank + (address & 0x1FFF))
             else:
                 return self.read_clock_data(address)
         else:
             return MBC.read(self, address)
+
+    def get_ram_offset(self, address):
+        if self.ram_bank >= 0:
+            return self.ram_bank + (address & 0x1FFF)
+        return -1
         
     def read_clock_data(self, address):
         if self.clock_register == 0x08:
@@ -510,7 +660,7 @@ class MBC3(MBC):
             
     def write_clock_data(self, address, data):
         if self.ram_bank >= 0:
-            self.ram[self.ram_bank + (address & 0x1FFF)] = data
+            self.ram.set(self.ram_bank + (address & 0x1FFF), data)
         else:
             self.update_clock()
             if self.clock_register == 0x08:
@@ -586,6 +736,14 @@ class MBC5(MBC):
     def reset(self):
         MBC.reset(self)
         self.rumble = True
+
+    def save_state(self, state):
+        MBC.save_state(self, state)
+        state.write_bool(self.rumble)
+
+    def load_state(self, state):
+        MBC.load_state(self, state)
+        self.rumble = state.read_bool()
         
 
     def write(self, address, data):
@@ -601,7 +759,7 @@ class MBC5(MBC):
         elif address <= 0x4FFF:  # 4000-4FFF
             self.write_ram_bank(address, data)
         elif address >= 0xA000 and address <= 0xBFFF and self.ram_enable:  # A000-BFFF
-            self.ram[self.ram_bank + (address & 0x1FFF)] = data
+            self.ram.set(self.ram_bank + (address & 0x1FFF), data)
 
     def write_ram_enable(self, address, data):
         if self.ram_size > 0:
@@ -654,6 +812,22 @@ class HuC3(MBC):
         self.clock_shift = 0
         self.clock_time = self.clock.get_time()
 
+    def save_state(self, state):
+        MBC.save_state(self, state)
+        state.write_int(self.ram_flag)
+        state.write_int(self.ram_value)
+        state.write_int(self.clock_register)
+        state.write_int(self.clock_shift)
+        state.write_int(self.clock_time)
+
+    def load_state(self, state):
+        MBC.load_state(self, state)
+        self.ram_flag       = state.read_int()
+        self.ram_value      = state.read_int()
+        self.clock_register = state.read_int()
+        self.clock_shift    = state.read_int()
+        self.clock_time     = state.read_int()
+
 
     def read(self, address):
         address = int(address)
@@ -664,10 +838,16 @@ class HuC3(MBC):
                 return 0x01
             elif self.ram_flag == 0x0A or self.ram_flag == 0x00:
                 if self.ram_size > 0:
-                    return self.ram[self.ram_bank + (address & 0x1FFF)] & 0xFF
+                    return self.ram.get(self.ram_bank + (address & 0x1FFF))
             raise Exception("Huc3 read error")
         else:
             return MBC.read(self, address)
+
+    def get_ram_offset(self, address):
+        if (self.ram_flag == 0x0A or self.ram_flag == 0x00) and \
+           self.ram_size > 0:
+            return self.ram_bank + (address & 0x1FFF)
+        return -1
     
     def write(self, address, data):
         address = int(address)
@@ -691,7 +871,7 @@ class HuC3(MBC):
         elif self.ram_flag >= 0x0C and self.ram_flag <= 0x0E:
             pass
         elif self.ram_flag == 0x0A and self.ram_size > 0:
-            self.ram[self.ram_bank + (address & 0x1FFF)] = data
+            self.ram.set(self.ram_bank + (address & 0x1FFF), data)
                         
     def write_with_ram_flag_0x0B(self, address, data):
         if (data & 0xF0) == 0x10:
@@ -127,6 +127,10 @@ VRAM_SIZE = 0x2000
 VRAM_DATA_A = 0x0000 # 4KB Tile Data (8000..8FFF) */
 VRAM_DATA_B = 0x0800 # 4KB Tile Data (8800..97FF) */
 
+# 384 Tiles of 8 Rows in the Tile Data (8000..97FF)
+TILE_COUNT = 384
+TILE_DATA_SIZE = 0x1800
+
 VRAM_MAP_A = 0x1800 # 1KB BG Tile Map 0 (9800..9BFF) */
 VRAM_MAP_B = 0x1C00 # 1KB BG Tile Map 1 (9C00..9FFF) */
 
@@ -140,9 +144,18 @@ MODE_3_END_TICKS = 32 # Display */
  
 MODE_1_BEGIN_TICKS = 8 # V-Blank Line 144 */
 MODE_1_END_TICKS = 1 # V-Blank Line 153 */
+
+# 144 visible and 10 V-Blank lines
+FRAME_TICKS = 154 * MODE_1_TICKS
  
+# Registers a drawn Line depends on
+LINE_STATE_SIZE = 8
+
 # Objects per Line
 OBJECTS_PER_LINE = 10
+
+# OAM DMA Transfer Duration, about 160 us
+DMA_TICKS = 160
  
 # LCD Color Palette
 COLOR_MAP =[
@@ -230,6 +243,9 @@ NR52 = 0xFF26 # AUDENA */
 
 AUD3WAVERAM = 0xFF30
 
+# Sound Registers FF10-FF3F
+SOUND_REGISTER_COUNT = 0x30
+
 BUFFER_LOG_SIZE = 5;
 
 
@@ -2,6 +2,34 @@
 from pypy.lang.gameboy import constants
 from pypy.lang.gameboy.ram import *
 from pypy.lang.gameboy.interrupt import *
+from pypy.rlib.jit import hint
+
+# indices into CPU.registers, in the order the opcodes encode them. REG_HLI
+# is the (HL) memory operand and has no storage of its own
+REG_B   = 0
+REG_C   = 1
+REG_D   = 2
+REG_E   = 3
+REG_H   = 4
+REG_L   = 5
+REG_HLI = 6
+REG_A   = 7
+
+# a basic block ends after this many instructions
+BLOCK_MAX_INSTRUCTIONS = 16
+# longest instruction in bytes
+INSTRUCTION_MAX_LENGTH = 3
+
+# the RAM code tables of a CPU without cached RAM code, never written
+EMPTY_RAM_BLOCKS = [None] * 0x10000
+EMPTY_CODE_MAP   = [0] * 0x10000
+
+# double register indices as encoded by the 16 bit opcodes
+REG_BC = 0
+REG_DE = 1
+REG_HL = 2
+REG_SP = 3
+REG_AF = 4
 
 
 class iRegister(object):
@@ -92,6 +120,115 @@ class DoubleRegister(iRegister):
     
 # ------------------------------------------------------------------------------
 
+class RegisterView(Register):
+    """
+    Register API on top of one entry of the CPU register file. The opcodes
+    work on CPU.registers directly, the views are kept for the tests and
+    debugging tools.
+    """
+
+    def __init__(self, cpu, index, reset_value=0):
+        assert isinstance(cpu, CPU)
+        self.cpu = cpu
+        self.index = index
+        self.reset_value = reset_value
+
+    def reset(self):
+        self.cpu.registers[self.index] = self.reset_value
+
+    def set(self, value, use_cycles=True):
+        self.cpu.registers[self.index] = value & 0xFF
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def get(self, use_cycles=True):
+        return self.cpu.registers[self.index]
+
+# ------------------------------------------------------------------------------
+
+class WordRegister(iRegister):
+    """
+    DoubleRegister API on top of a 16 bit integer field of the CPU.
+    """
+
+    def __init__(self, cpu, reset_value=0):
+        assert isinstance(cpu, CPU)
+        self.cpu = cpu
+        self.reset_value = reset_value
+
+    def load(self):
+        return 0
+
+    def store(self, value):
+        pass
+
+    def set(self, value, use_cycles=True):
+        self.store(value & 0xFFFF)
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def set_hi_lo(self, hi, lo, use_cycles=True):
+        self.store(((hi & 0xFF) << 8) + (lo & 0xFF))
+        if use_cycles:
+            self.cpu.cycles -= 2
+
+    def reset(self):
+        self.set(self.reset_value, use_cycles=False)
+
+    def set_hi(self, hi=0, use_cycles=True):
+        self.store(((hi & 0xFF) << 8) + (self.load() & 0xFF))
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def set_lo(self, lo=0, use_cycles=True):
+        self.store((self.load() & 0xFF00) + (lo & 0xFF))
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def get(self, use_cycles=True):
+        return self.load()
+
+    def get_hi(self, use_cycles=True):
+        return self.load() >> 8
+
+    def get_lo(self, use_cycles=True):
+        return self.load() & 0xFF
+
+    def inc(self, use_cycles=True):
+        self.set(self.load() + 1, use_cycles=use_cycles)
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def dec(self, use_cycles=True):
+        self.set(self.load() - 1, use_cycles=use_cycles)
+        if use_cycles:
+            self.cpu.cycles -= 1
+
+    def add(self, n=2, use_cycles=True):
+        self.set(self.load() + n, use_cycles=use_cycles)
+        if use_cycles:
+            self.cpu.cycles -= 2
+
+
+class ProgramCounter(WordRegister):
+
+    def load(self):
+        return self.cpu.program_counter
+
+    def store(self, value):
+        self.cpu.program_counter = value
+
+
+class StackPointer(WordRegister):
+
+    def load(self):
+        return self.cpu.stack_pointer
+
+    def store(self, value):
+        self.cpu.stack_pointer = value
+
+# ------------------------------------------------------------------------------
+
 class ImmediatePseudoRegister(Register):
     
         def __init__(self, cpu, hl):
@@ -110,85 +247,78 @@ class ImmediatePseudoRegister(Register):
             return self.cpu.read(self.hl.get(use_cycles=use_cycles)) # 1
     
 # ------------------------------------------------------------------------------
-  
+
 class FlagRegister(Register):
-    
+    """
+    Register API on top of the flags packed into CPU.flags.
+    """
+
     def __init__(self, cpu):
         assert isinstance(cpu, CPU)
         self.cpu = cpu
-        self.reset()
-        #added for rpython type inference
-        self.z_flag = False
-        self.n_flag = False
-        self.h_flag = False
-        self.c_flag = False
-        self.p_flag = False
-        self.s_flag = False
-         
+        self.reset_value = 0
+
     def reset(self):
-        self.partial_reset()
-        
-    def partial_reset(self, keep_z=False, keep_n=False, keep_h=False, keep_c=False,\
-                keep_p=False, keep_s=False):
-        if not keep_z:
-            self.z_flag = False
-        if not keep_n:
-            self.n_flag = False
-        if not keep_h:
-            self.h_flag = False
-        if not keep_c:
-            self.c_flag = False
-        if not keep_p:
-            self.p_flag = False
-        if not keep_s:
-            self.s_flag = False
-        self.lower = 0x00
-            
+        self.cpu.flags = 0
+
     def get(self, use_cycles=True):
-        value = 0
-        value += (int(self.c_flag) << 4)
-        value += (int(self.h_flag) << 5)
-        value += (int(self.n_flag) << 6)
-        value += (int(self.z_flag) << 7)
-        return value + self.lower
-            
+        return self.cpu.flags
+
     def set(self, value, use_cycles=True):
-        self.c_flag = bool(value & (1 << 4))
-        self.h_flag = bool(value & (1 << 5))
-        self.n_flag = bool(value & (1 << 6))
-        self.z_flag = bool(value & (1 << 7))
-        self.lower = value & 0x0F
+        self.cpu.flags = value & 0xFF
         if use_cycles:
             self.cpu.cycles -= 1
-        
-    def z_flag_compare(self, a, reset=False):
-        if reset:
-             self.reset()
-        if isinstance(a, (Register)):
-            a = a.get()
-        self.z_flag = ((a & 0xFF) == 0)
-            
-    def c_flag_add(self, s, compare_and=0x01, reset=False):
-        if reset:
-             self.reset()
-        if (s & compare_and) != 0:
-            self.c_flag = True
 
-    def h_flag_compare(self, a, b):
-        if (a & 0x0F) < (b & 0x0F):
-            self.h_flag = True
-            
-    def c_flag_compare(self,  a, b):
-        if a < b:
-            self.c_flag = True
-        
+    def is_flag(self, flag):
+        return (self.cpu.flags & flag) != 0
+
+    def set_flag(self, flag, value=True):
+        if value:
+            self.cpu.flags |= flag
+        else:
+            self.cpu.flags &= ~flag & 0xFF
+
+# ------------------------------------------------------------------------------
+
+class BasicBlock(object):
+    """
+    A run of decoded instructions ending at the first jump, call, return or
+    interrupt related instruction. For every instruction the block keeps the
+    opcode handler, the address of its operands, the address of the
+    following instruction and the cycles of fetching the opcode bytes.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.end   = start
+        self.op_codes          = []
+        self.operand_addresses = []
+        self.next_addresses    = []
+        self.fetch_cycles      = []
+
+    def add(self, op_code, operand_address, next_address, fetch_cycles):
+        self.op_codes.append(op_code)
+        self.operand_addresses.append(operand_address)
+        self.next_addresses.append(next_address)
+        self.fetch_cycles.append(fetch_cycles)
+        self.end = next_address
+
+    def get_length(self):
+        return len(self.op_codes)
+
 # # ------------------------------------------------------------------------------
 
 class CPU(object):
     """
     PyBoy GameBoy (TM) Emulator
-    
+
     Central Unit ProcessOR (Sharp LR35902 CPU)
+
+    The register file is kept as plain integers: the 8 bit registers in
+    self.registers (indexed by REG_B..REG_A), the flags packed in self.flags
+    and the 16 bit program counter and stack pointer as fields. Every opcode
+    accesses memory without side effects on the cycle counter and subtracts
+    its full cost once.
     """
     def __init__(self, interrupt, memory):
         assert isinstance(interrupt, Interrupt)
@@ -197,88 +327,117 @@ class CPU(object):
         self.ime       = False
         self.halted    = False
         self.cycles    = 0
+        self.registers = [0] * 8
+        self.flags     = 0
+        self.stack_pointer   = 0
+        self.program_counter = 0
         self.ini_registers()
-        self.rom       = []
+        self.rom       = ""
+        self.owns_ram_blocks = False
+        self.cache_ram_code = False
+        self.use_jit_portal = False
+        self.clear_blocks()
         self.reset()
 
     def ini_registers(self):
-        self.b  = Register(self)
-        self.c  = Register(self)
+        # views on the register file, the opcodes do not use them
+        self.b  = RegisterView(self, REG_B)
+        self.c  = RegisterView(self, REG_C)
         self.bc = DoubleRegister(self, self.b, self.c, constants.RESET_BC)
-        
-        self.d  = Register(self)
-        self.e  = Register(self)
+
+        self.d  = RegisterView(self, REG_D)
+        self.e  = RegisterView(self, REG_E)
         self.de = DoubleRegister(self, self.d, self.e, constants.RESET_DE)
 
-        self.h  = Register(self)
-        self.l  = Register(self)
+        self.h  = RegisterView(self, REG_H)
+        self.l  = RegisterView(self, REG_L)
         self.hl = DoubleRegister(self, self.h, self.l, constants.RESET_HL)
-        
+
         self.hli = ImmediatePseudoRegister(self, self.hl)
-        self.pc  = DoubleRegister(self, Register(self), Register(self), reset_value=constants.RESET_PC)
-        self.sp  = DoubleRegister(self, Register(self), Register(self), reset_value=constants.RESET_SP)
-        
-        self.a  = Register(self, constants.RESET_A)
+        self.pc  = ProgramCounter(self, constants.RESET_PC)
+        self.sp  = StackPointer(self, constants.RESET_SP)
+
+        self.a  = RegisterView(self, REG_A, constants.RESET_A)
         self.f  = FlagRegister(self)
         self.af = DoubleRegister(self, self.a, self.f)
-        
 
     def reset(self):
         self.reset_registers()
-        self.f.reset()
-        self.f.z_flag = True
         self.ime     = False
         self.halted  = False
         self.cycles  = 0
-        
+        self.instructions = 0
+
     def reset_registers(self):
-        self.a.reset()
-        self.f.reset()
-        self.bc.reset()
-        self.de.reset()
-        self.hl.reset()
-        self.sp.reset()
-        self.pc.reset()
-        
+        self.registers[REG_A] = constants.RESET_A
+        self.flags = constants.RESET_F
+        self.set_double_register(REG_BC, constants.RESET_BC)
+        self.set_double_register(REG_DE, constants.RESET_DE)
+        self.set_double_register(REG_HL, constants.RESET_HL)
+        self.stack_pointer   = constants.RESET_SP
+        self.program_counter = constants.RESET_PC
+
+    def save_state(self, state):
+        state.write_ints(self.registers)
+        state.write_int(self.flags)
+        state.write_int(self.stack_pointer)
+        state.write_int(self.program_counter)
+        state.write_bool(self.ime)
+        state.write_bool(self.halted)
+        state.write_int(self.cycles)
+        state.write_int(self.instructions)
+
+    def load_state(self, state):
+        state.read_ints(self.registers)
+        self.flags           = state.read_int()
+        self.stack_pointer   = state.read_int()
+        self.program_counter = state.read_int()
+        self.ime             = state.read_bool()
+        self.halted          = state.read_bool()
+        self.cycles          = state.read_int()
+        self.instructions    = state.read_int()
+        # the cached RAM code belongs to the replaced RAM
+        self.clear_ram_blocks()
+
     def get_af(self):
         return self.af
-        
+
     def get_a(self):
         return self.a
-    
+
     def get_f(self):
         return self.f
-        
+
     def get_bc(self):
         return self.bc
-    
+
     def get_b(self):
         return self.b
-    
+
     def get_c(self):
         return self.c
-        
+
     def get_de(self):
         return self.de
-        
+
     def get_d(self):
         return self.d
-        
+
     def get_e(self):
         return self.e
-        
+
     def get_hl(self):
         return self.hl
-        
+
     def get_hli(self):
         return self.hli
-        
+
     def get_h(self):
         return self.h
-        
+
     def get_l(self):
         return self.l
-             
+
     def get_sp(self):
         return self.sp
 
@@ -292,32 +451,26 @@ class CPU(object):
 
     def is_z(self):
         """ zero flag"""
-        return self.f.z_flag
+        return (self.flags & constants.Z_FLAG) != 0
 
     def is_c(self):
         """ carry flag, true if the result did not fit in the register"""
-        return self.f.c_flag
+        return (self.flags & constants.C_FLAG) != 0
 
     def is_h(self):
         """ half carry, carry from bit 3 to 4"""
-        return self.f.h_flag
+        return (self.flags & constants.H_FLAG) != 0
 
     def is_n(self):
         """ subtract flag, true if the last operation was a subtraction"""
-        return self.f.n_flag
-    
-    def isS(self):
-        return self.f.s_flag
-    
-    def is_p(self):
-        return self.f.p_flag
-    
+        return (self.flags & constants.N_FLAG) != 0
+
     def is_not_z(self):
         return not self.is_z()
 
     def is_not_c(self):
         return not self.is_c()
-    
+
     def is_not_h(self):
         return not self.is_h()
 
@@ -325,14 +478,254 @@ class CPU(object):
         return not self.is_n()
 
     def set_rom(self, banks):
-        self.rom = banks       
-            
+        self.rom = banks
+        self.clear_blocks()
+
+    # basic block cache --------------------------------------------------------
+
+    def clear_blocks(self):
+        # bank 0 ROM, the switchable ROM bank and RAM code are cached apart
+        self.rom_blocks  = [None] * 0x4000
+        self.bank_blocks = None
+        self.rom_bank    = -1
+        self.rom_bank_blocks = {}
+        self.clear_ram_blocks()
+        self.code_changed = False
+
+    def share_rom_blocks(self, cpu):
+        # the blocks decoded from the ROM are the same for every CPU running
+        # the same ROM, forks keep decoding into the shared caches
+        self.rom = cpu.rom
+        self.rom_blocks = cpu.rom_blocks
+        self.rom_bank_blocks = cpu.rom_bank_blocks
+        self.bank_blocks = None
+        self.rom_bank = -1
+
+    def clear_ram_blocks(self):
+        # the tables are allocated with the first RAM block, afterwards only
+        # the cached blocks are removed
+        if not self.owns_ram_blocks:
+            self.ram_blocks = EMPTY_RAM_BLOCKS
+            self.code_map   = EMPTY_CODE_MAP
+            self.ram_block_starts = {}
+        for start in self.ram_block_starts.keys():
+            self.remove_ram_block(self.ram_blocks[start])
+        self.code_changed = True
+
+    def enable_ram_code_cache(self):
+        """
+        Cache code running from work and high RAM as well. The memory has
+        to call invalidate_code for every write to an address with a
+        non zero entry in the code_map.
+        """
+        self.cache_ram_code = True
+
+    def enable_jit_portal(self):
+        """
+        Run the opcodes through jit_portal instead of the basic block cache,
+        this is what the JIT targets translate.
+        """
+        self.use_jit_portal = True
+
+    def set_rom_bank(self, bank):
+        # called by the memory whenever 4000-7FFF is mapped to another bank
+        if bank == self.rom_bank:
+            return
+        self.rom_bank = bank
+        blocks = self.rom_bank_blocks.get(bank, None)
+        if blocks is None:
+            blocks = [None] * 0x4000
+            self.rom_bank_blocks[bank] = blocks
+        self.bank_blocks = blocks
+        self.code_changed = True
+
+    def get_block(self, address):
+        if address <= 0x3FFF:
+            block = self.rom_blocks[address]
+            if block is None:
+                block = self.decode_block(address, 0x4000)
+                self.rom_blocks[address] = block
+        elif address <= 0x7FFF:
+            if self.bank_blocks is None:
+                return None
+            block = self.bank_blocks[address - 0x4000]
+            if block is None:
+                block = self.decode_block(address, 0x8000)
+                self.bank_blocks[address - 0x4000] = block
+        elif self.cache_ram_code and \
+             ((0xC000 <= address <= 0xDFFF) or (0xFF80 <= address <= 0xFFFE)):
+            block = self.ram_blocks[address]
+            if block is None:
+                if address <= 0xDFFF:
+                    block = self.decode_block(address, 0xE000)
+                else:
+                    block = self.decode_block(address, 0xFFFF)
+                if block is not None:
+                    self.add_ram_block(block)
+        else:
+            return None
+        return block
+
+    def read_code(self, address):
+        # ROM blocks are decoded from the image, a read through the memory
+        # can be locked out while the blocks stay cached
+        if address <= 0x3FFF:
+            return ord(self.rom[address])
+        elif address <= 0x7FFF and self.rom_bank >= 0:
+            return ord(self.rom[self.rom_bank + (address & 0x3FFF)])
+        return self.memory.read(address)
+
+    def decode_block(self, address, limit):
+        block = BasicBlock(address)
+        for count in range(BLOCK_MAX_INSTRUCTIONS):
+            op_code = self.read_code(address)
+            if op_code == 0xCB:
+                if address + 1 >= limit:
+                    break
+                handler = FETCH_EXECUTE_OP_CODES[self.read_code(address + 1)]
+                op_code_length = 2
+            else:
+                handler = OP_CODES[op_code]
+                op_code_length = 1
+            length = op_code_length + OPERAND_LENGTHS[op_code]
+            if handler is None or address + length > limit:
+                break
+            block.add(handler, address + op_code_length, address + length,
+                      op_code_length)
+            address += length
+            if BLOCK_END_OP_CODES[op_code] != 0:
+                break
+        if block.get_length() == 0:
+            return None
+        return block
+
+    def add_ram_block(self, block):
+        if not self.owns_ram_blocks:
+            self.ram_blocks = [None] * 0x10000
+            self.code_map   = [0] * 0x10000
+            self.owns_ram_blocks = True
+        self.ram_blocks[block.start] = block
+        self.ram_block_starts[block.start] = True
+        for address in range(block.start, block.end):
+            self.code_map[address] += 1
+            if address <= 0xDDFF:
+                # echo RAM
+                self.code_map[address + 0x2000] += 1
+
+    def remove_ram_block(self, block):
+        self.ram_blocks[block.start] = None
+        del self.ram_block_starts[block.start]
+        for address in range(block.start, block.end):
+            self.code_map[address] -= 1
+            if address <= 0xDDFF:
+                self.code_map[address + 0x2000] -= 1
+
+    def invalidate_code(self, address):
+        """
+        Drops the cached RAM blocks containing the written address.
+        """
+        if 0xE000 <= address <= 0xFDFF:
+            address -= 0x2000
+        start = address - (BLOCK_MAX_INSTRUCTIONS * INSTRUCTION_MAX_LENGTH)
+        if start < 0:
+            start = 0
+        for block_start in range(start, address + 1):
+            block = self.ram_blocks[block_start]
+            if block is not None and block.end > address:
+                self.remove_ram_block(block)
+        self.code_changed = True
+
+    def execute_block(self, block):
+        # stops early when the cycles run out, the control flow leaves the
+        # block or the cached code has been changed
+        self.code_changed = False
+        index = 0
+        length = block.get_length()
+        while index < length and self.cycles > 0:
+            self.program_counter = block.operand_addresses[index]
+            self.cycles -= block.fetch_cycles[index]
+            self.instructions += 1
+            block.op_codes[index](self)
+            if self.code_changed or \
+               self.program_counter != block.next_addresses[index]:
+                return
+            index += 1
+
+    # register file access -----------------------------------------------------
+
+    def load_register(self, index):
+        if index == REG_HLI:
+            return self.memory.read(self.double_register(REG_HL))
+        return self.registers[index]
+
+    def store_register(self, index, value):
+        if index == REG_HLI:
+            self.memory.write(self.double_register(REG_HL), value & 0xFF)
+        else:
+            self.registers[index] = value & 0xFF
+
+    def double_register(self, index):
+        if index == REG_SP:
+            return self.stack_pointer
+        if index == REG_AF:
+            return (self.registers[REG_A] << 8) + self.flags
+        return (self.registers[2*index] << 8) + self.registers[2*index + 1]
+
+    def set_double_register(self, index, value):
+        value &= 0xFFFF
+        if index == REG_SP:
+            self.stack_pointer = value
+        elif index == REG_AF:
+            self.registers[REG_A] = value >> 8
+            self.flags = value & 0xFF
+        else:
+            self.registers[2*index]     = value >> 8
+            self.registers[2*index + 1] = value & 0xFF
+
+    # emulation ----------------------------------------------------------------
+
     def emulate(self, ticks):
         ticks = int(ticks)
         self.cycles += ticks
         self.handle_pending_interrupt()
+        if self.use_jit_portal:
+            self.jit_portal()
+            return
+        while self.cycles > 0:
+            block = self.get_block(self.program_counter)
+            if block is None:
+                self.instructions += 1
+                self.execute(self.fetch())
+            else:
+                self.execute_block(block)
+
+    def jit_portal(self):
+        """
+        The portal of the JIT. Code running from ROM is interpreted with the
+        program counter, the ROM bank and the opcode as green variables, so
+        the timeshifter can specialize the loop for every ROM address. Code
+        in RAM can change at any time and is interpreted without hints.
+        """
+        hint(None, global_merge_point=True)
+        rom = hint(self.rom, promote=True)
+        rom = hint(rom, deepfreeze=True)
         while self.cycles > 0:
-            self.execute(self.fetch())
+            hint(None, global_merge_point=True)
+            pc = hint(self.program_counter, promote=True)
+            rom_bank = hint(self.rom_bank, promote=True)
+            if pc <= 0x3FFF:
+                op_code = ord(rom[pc])
+            elif pc <= 0x7FFF and rom_bank >= 0:
+                op_code = ord(rom[rom_bank + (pc & 0x3FFF)])
+            else:
+                self.instructions += 1
+                self.execute(self.fetch())
+                continue
+            hint(op_code, concrete=True)
+            self.program_counter = pc + 1
+            self.cycles -= 1
+            self.instructions += 1
+            OP_CODES[op_code](self)
 
     def handle_pending_interrupt(self):
         # Interrupts
@@ -344,22 +737,23 @@ class CPU(object):
                 self.cycles = 0
         if self.ime and self.interrupt.is_pending():
             self.lower_pending_interrupt()
-            
+
     def lower_pending_interrupt(self):
         for flag in self.interrupt.interrupt_flags:
             if flag.is_pending():
                 self.ime = False
-                self.call(flag.call_code, use_cycles=False)
+                self.call(flag.call_code)
                 flag.set_pending(False)
                 return
 
     def fetch_execute(self):
-        # Execution
-        FETCH_EXECUTE_OP_CODES[self.fetch()](self)
-        
+        # CB prefix, 1 cycle + second order opcode
+        self.cycles -= 1
+        FETCH_EXECUTE_OP_CODES[self.fetch_byte()](self)
+
     def execute(self, opCode):
         OP_CODES[opCode](self)
-        
+
     def read(self, hi, lo=None):
         # memory Access, 1 cycle
         address = hi
@@ -375,426 +769,441 @@ class CPU(object):
 
     def fetch(self, use_cycles=True):
         # Fetching  1 cycle
-        self.cycles += 1
-        if self.pc.get(use_cycles) <= 0x3FFF:
-            data =  self.rom[self.pc.get(use_cycles)]
+        if use_cycles:
+            self.cycles -= 1
+        return self.fetch_byte()
+
+    def fetch_byte(self):
+        # instructions in ROM are fetched like they are decoded, from the
+        # image, the DMA lockout of the memory only applies to data reads
+        pc = self.program_counter
+        if pc <= 0x3FFF:
+            data = ord(self.rom[pc])
+        elif pc <= 0x7FFF and self.rom_bank >= 0:
+            data = ord(self.rom[self.rom_bank + (pc & 0x3FFF)])
         else:
-            data = self.memory.read(self.pc.get(use_cycles))
-        self.pc.inc(use_cycles) # 2 cycles
+            data = self.memory.read(pc)
+        self.program_counter = (pc + 1) & 0xFFFF
         return data
-    
+
     def fetch_double_address(self):
-        lo = self.fetch() # 1 cycle
-        hi = self.fetch() # 1 cycle
+        lo = self.fetch_byte()
+        hi = self.fetch_byte()
         return (hi << 8) + lo
-        
-    def fetch_double_register(self, register):
-        self.double_register_inverse_call(CPUFetchCaller(self), register)
 
-    def push(self, data, use_cycles=True):
-        # Stack, 2 cycles
-        self.sp.dec(use_cycles) # 2 cycles
-        self.memory.write(self.sp.get(use_cycles), data)
-        
-    def push_double_register(self, register, use_cycles=True):
-        # PUSH rr 4 cycles
-        self.push(register.get_hi(), use_cycles) # 2 cycles
-        self.push(register.get_lo(), use_cycles) # 2 cycles
+    def fetch_double_register(self, index):
+        # LD rr,nnnn 3 cycles
+        self.set_double_register(index, self.fetch_double_address())
+        self.cycles -= 3
 
-    def pop(self, use_cycles=True):
-        # 1 cycle
-        data = self.memory.read(self.sp.get())
-        self.sp.inc() # 2 cycles
-        self.cycles += 1
+    def push(self, data):
+        # Stack
+        self.stack_pointer = (self.stack_pointer - 1) & 0xFFFF
+        self.memory.write(self.stack_pointer, data)
+
+    def push_double_register(self, index):
+        # PUSH rr 4 cycles
+        value = self.double_register(index)
+        self.push(value >> 8)
+        self.push(value & 0xFF)
+        self.cycles -= 4
+
+    def pop(self):
+        data = self.memory.read(self.stack_pointer)
+        self.stack_pointer = (self.stack_pointer + 1) & 0xFFFF
         return data
-    
-    def pop_double_register(self, register):
-        # 3 cycles
-        self.double_register_inverse_call(CPUPopCaller(self), register)
-        
-    def double_register_inverse_call(self, getCaller, register):
-        b = getCaller.get() # 1 cycle
-        a = getCaller.get() # 1 cycle
-        register.set_hi_lo(a, b) # 2 cycles
-        self.cycles += 1
-        
-    def call(self, address, use_cycles=True):
-        # 4 cycles
-        self.push(self.pc.get_hi(use_cycles), use_cycles) # 2 cycles
-        self.push(self.pc.get_lo(use_cycles), use_cycles) # 2 cycles
-        self.pc.set(address, use_cycles=use_cycles)       # 1 cycle
-        if use_cycles:
-            self.cycles += 1
-        
-    def ld(self, getCaller, setCaller):
-        # 1 cycle
-        setCaller.set(getCaller.get()) # 1 cycle
-        
-    def load_fetch_register(self, register):
-        self.ld(CPUFetchCaller(self), RegisterCallWrapper(register))
-        
+
+    def pop_double_register(self, index):
+        # POP rr 3 cycles
+        lo = self.pop()
+        hi = self.pop()
+        self.set_double_register(index, (hi << 8) + lo)
+        self.cycles -= 3
+
+    def call(self, address):
+        pc = self.program_counter
+        self.push(pc >> 8)
+        self.push(pc & 0xFF)
+        self.program_counter = address & 0xFFFF
+
+    def fetch_load(self):
+        # LD r,nn 2 cycles, (HL),nn 3 cycles
+        return self.fetch_byte()
+
     def store_hl_in_pc(self):
         # LD PC,HL, 1 cycle
-        self.ld(DoubleRegisterCallWrapper(self.hl), \
-                DoubleRegisterCallWrapper(self.pc))
-        
-    def fetch_load(self, getCaller, setCaller):
-        self.ld(CPUFetchCaller(self), setCaller)
-
-    def add_a(self, getCaller, setCaller=None):
-        # ALU, 1 cycle
-        added = (self.a.get() + getCaller.get()) & 0xFF
-        self.f.z_flag_compare(added, reset=True)
-        self.f.h_flag_compare(added, self.a.get())
-        self.f.c_flag_compare(added, self.a.get())
-        self.a.set(added) # 1 cycle
-        
-    def add_hl(self, register):
-        # 2 cycles
-        a=1
-        added = (self.hl.get() + register.get()) & 0xFFFF # 1 cycle
-        self.f.partial_reset(keep_z=True)
-        self.f.h_flag_compare((added >> 8), self.hl.get())
-        self.f.c_flag_compare(added,        self.hl.get())
-        self.hl.set(added)
+        self.program_counter = self.double_register(REG_HL)
         self.cycles -= 1
-        
-    def add_with_carry(self, getCaller, setCaller=None):
-        # 1 cycle
-        data = getCaller.get()
-        s = self.a.get() + data
-        if self.f.c_flag:
+
+    def add_a(self, data):
+        # ALU
+        a = self.registers[REG_A]
+        added = (a + data) & 0xFF
+        flags = 0
+        if added == 0:
+            flags |= constants.Z_FLAG
+        if (added & 0x0F) < (a & 0x0F):
+            flags |= constants.H_FLAG
+        if added < a:
+            flags |= constants.C_FLAG
+        self.flags = flags
+        self.registers[REG_A] = added
+
+    def add_hl(self, index):
+        # ADD HL,rr 2 cycles
+        hl = self.double_register(REG_HL)
+        added = (hl + self.double_register(index)) & 0xFFFF
+        flags = self.flags & constants.Z_FLAG
+        if ((added >> 8) & 0x0F) < (hl & 0x0F):
+            flags |= constants.H_FLAG
+        if added < hl:
+            flags |= constants.C_FLAG
+        self.flags = flags
+        self.set_double_register(REG_HL, added)
+        self.cycles -= 2
+
+    def add_with_carry(self, data):
+        s = self.registers[REG_A] + data
+        if self.is_c():
             s +=1
-        self.carry_flag_finish(s,data)
+        self.carry_flag_finish(s, data)
 
-    def subtract_with_carry(self, getCaller, setCaller=None):
-        # 1 cycle
-        data = getCaller.get()
-        s = self.a.get() - data
-        if self.f.c_flag:
+    def subtract_with_carry(self, data):
+        s = self.registers[REG_A] - data
+        if self.is_c():
             s -= 1
         self.carry_flag_finish(s, data)
-        self.f.n_flag = True
-        
+        self.flags |= constants.N_FLAG
+
     def carry_flag_finish(self, s, data):
-        self.f.reset()
+        flags = 0
         # set the hflag if the 0x10 bit was affected
-        if ((s ^ self.a.get() ^ data) & 0x10) != 0:
-            self.f.h_flag = True
+        if ((s ^ self.registers[REG_A] ^ data) & 0x10) != 0:
+            flags |= constants.H_FLAG
         if s >= 0x100:
-            self.f.c_flag= True
-        self.f.z_flag_compare(s)
-        self.a.set(s)  # 1 cycle
-        
-    def subtract_a(self, getCaller, setCaller=None):
-        # 1 cycle
-        self.compare_a(getCaller) # 1 cycle
-        self.a.sub(getCaller.get(use_cycles=False), False)
+            flags |= constants.C_FLAG
+        if (s & 0xFF) == 0:
+            flags |= constants.Z_FLAG
+        self.flags = flags
+        self.registers[REG_A] = s & 0xFF
+
+    def subtract_a(self, data):
+        self.compare_a(data)
+        self.registers[REG_A] = (self.registers[REG_A] - data) & 0xFF
 
     def fetch_subtract_a(self):
-        data = self.fetch()
-        # 1 cycle
-        self.compare_a_simple(data) # 1 cycle
-        self.a.sub(data, False)
-
-    def compare_a(self, getCaller, setCaller=None):
-        # 1 cycle
-        self.compare_a_simple(int(self.a.get() - getCaller.get()))
-        
+        # SUB A,nn 2 cycles
+        data = self.fetch_byte()
+        self.compare_a_simple(data)
+        self.registers[REG_A] = (self.registers[REG_A] - data) & 0xFF
+        self.cycles -= 2
+
+    def compare_a(self, data):
+        self.compare_a_simple(self.registers[REG_A] - data)
+
     def compare_a_simple(self, s):
         s = s & 0xFF
-        self.f.reset()
-        self.f.n_flag = True
-        self.f.z_flag_compare(s)
-        self.hc_flag_finish(s)
-        self.cycles -= 1
-            
-    def hc_flag_finish(self, data):
-        if data > self.a.get():
-            self.f.c_flag = True
-        self.f.h_flag_compare(self.a.get(), data)
-        
-    def AND(self, getCaller, setCaller=None):
-        # 1 cycle
-        self.a.set(self.a.get() & getCaller.get())  # 1 cycle
-        self.f.z_flag_compare(self.a.get(), reset=True)
-
-    def XOR(self, getCaller, setCaller=None):
-        # 1 cycle
-        self.a.set( self.a.get() ^ getCaller.get())  # 1 cycle
-        self.f.z_flag_compare(self.a.get(), reset=True)
-
-    def OR(self, getCaller, setCaller=None):
-        # 1 cycle
-        self.a.set(self.a.get() | getCaller.get())  # 1 cycle
-        self.f.z_flag_compare(self.a.get(), reset=True)
-
-    def inc_double_register(self, doubleRegister):
-        doubleRegister.inc()
-        
-    def dec_double_register(self, doubleRegister):
-        doubleRegister.dec()
-        
-    def inc(self, getCaller, setCaller):
-        # 1 cycle
-        data = (getCaller.get() + 1) & 0xFF
-        self.dec_inc_flag_finish(data, setCaller, 0x00)
-        
-    def dec(self, getCaller, setCaller):
-        # 1 cycle
-        data = (getCaller.get() - 1) & 0xFF
-        self.dec_inc_flag_finish(data, setCaller, 0x0F)
-        self.f.n_flag = True
-     
-    def dec_inc_flag_finish(self, data, setCaller, compare):
-        self.f.partial_reset(keep_c=True)
-        self.f.z_flag_compare(data)
+        a = self.registers[REG_A]
+        flags = constants.N_FLAG
+        if s == 0:
+            flags |= constants.Z_FLAG
+        if s > a:
+            flags |= constants.C_FLAG
+        if (a & 0x0F) < (s & 0x0F):
+            flags |= constants.H_FLAG
+        self.flags = flags
+
+    def AND(self, data):
+        self.registers[REG_A] &= data
+        self.z_flag_finish(self.registers[REG_A])
+
+    def XOR(self, data):
+        self.registers[REG_A] ^= data
+        self.z_flag_finish(self.registers[REG_A])
+
+    def OR(self, data):
+        self.registers[REG_A] |= data
+        self.z_flag_finish(self.registers[REG_A])
+
+    def z_flag_finish(self, s):
+        if s == 0:
+            self.flags = constants.Z_FLAG
+        else:
+            self.flags = 0
+
+    def inc_double_register(self, index):
+        # INC rr 2 cycles
+        self.set_double_register(index, self.double_register(index) + 1)
+        self.cycles -= 2
+
+    def dec_double_register(self, index):
+        # DEC rr 2 cycles
+        self.set_double_register(index, self.double_register(index) - 1)
+        self.cycles -= 2
+
+    def inc(self, data):
+        data = (data + 1) & 0xFF
+        self.dec_inc_flag_finish(data, 0x00)
+        return data
+
+    def dec(self, data):
+        data = (data - 1) & 0xFF
+        self.dec_inc_flag_finish(data, 0x0F)
+        self.flags |= constants.N_FLAG
+        return data
+
+    def dec_inc_flag_finish(self, data, compare):
+        flags = self.flags & constants.C_FLAG
+        if data == 0:
+            flags |= constants.Z_FLAG
         if (data & 0x0F) == compare:
-            self.f.h_flag = True
-        setCaller.set(data) # 1 cycle
+            flags |= constants.H_FLAG
+        self.flags = flags
 
-    def rotate_left_circular(self, getCaller, setCaller):
-        # RLC 1 cycle
-        data = getCaller.get()
-        s = (data  << 1) + (data >> 7)
-        self.flags_and_setter_finish(s, setCaller, 0x80)
-        #self.cycles -= 1
+    def rotate_left_circular(self, data):
+        # RLC
+        return self.flags_and_result_finish((data  << 1) + (data >> 7), 0x80)
 
     def rotate_left_circular_a(self):
-        # RLCA rotate_left_circular_a 1 cycle
-        self.rotate_left_circular(RegisterCallWrapper(self.a), \
-                                  RegisterCallWrapper(self.a))
-
-    def rotate_left(self, getCaller, setCaller):
-        # 1 cycle
-        s = (getCaller.get() << 1) & 0xFF
-        if self.f.c_flag:
+        # RLCA 1 cycle
+        self.registers[REG_A] = self.rotate_left_circular(self.registers[REG_A])
+        self.cycles -= 1
+
+    def rotate_left(self, data):
+        # RL
+        s = (data << 1) & 0xFF
+        if self.is_c():
             s += 0x01
-        self.flags_and_setter_finish(s, setCaller, 0x80) # 1 cycle
+        return self.flags_and_result_finish(s, 0x80)
 
     def rotate_left_a(self):
         # RLA  1 cycle
-        self.rotate_left(RegisterCallWrapper(self.a), \
-                         RegisterCallWrapper(self.a))
-        
-    def rotate_right_circular(self, getCaller, setCaller):
-        data = getCaller.get()
-        # RRC 1 cycle
-        s = (data >> 1) + ((data & 0x01) << 7)
-        self.flags_and_setter_finish(s, setCaller) # 1 cycle
-   
+        self.registers[REG_A] = self.rotate_left(self.registers[REG_A])
+        self.cycles -= 1
+
+    def rotate_right_circular(self, data):
+        # RRC
+        return self.flags_and_result_finish((data >> 1) + ((data & 0x01) << 7))
+
     def rotate_right_circular_a(self):
         # RRCA 1 cycle
-        self.rotate_right_circular(RegisterCallWrapper(self.a), \
-                                   RegisterCallWrapper(self.a))
+        self.registers[REG_A] = self.rotate_right_circular(self.registers[REG_A])
+        self.cycles -= 1
 
-    def rotate_right(self, getCaller, setCaller):
-        # 1 cycle
-        s = (getCaller.get() >> 1)
-        if self.f.c_flag:
+    def rotate_right(self, data):
+        # RR
+        s = (data >> 1)
+        if self.is_c():
             s +=  0x08
-        self.flags_and_setter_finish(s, setCaller) # 1 cycle
+        return self.flags_and_result_finish(s)
 
     def rotate_right_a(self):
         # RRA 1 cycle
-        self.rotate_right(RegisterCallWrapper(self.a), \
-                          RegisterCallWrapper(self.a))
+        self.registers[REG_A] = self.rotate_right(self.registers[REG_A])
+        self.cycles -= 1
 
-    def shift_left_arithmetic(self, getCaller, setCaller):
-        # 2 cycles
-        s = (getCaller.get() << 1) & 0xFF
-        self.flags_and_setter_finish(s, setCaller, 0x80) # 1 cycle
+    def shift_left_arithmetic(self, data):
+        # SLA
+        return self.flags_and_result_finish((data << 1) & 0xFF, 0x80)
 
-    def shift_right_arithmetic(self, getCaller, setCaller):
-        data = getCaller.get()
-        # 1 cycle
-        s = (data >> 1) + (data & 0x80)
-        self.flags_and_setter_finish(s, setCaller) # 1 cycle
+    def shift_right_arithmetic(self, data):
+        # SRA
+        return self.flags_and_result_finish((data >> 1) + (data & 0x80))
 
-    def shift_word_right_logical(self, getCaller, setCaller):
-        # 2 cycles
-        s = (getCaller.get() >> 1)
-        self.flags_and_setter_finish(s, setCaller) # 2 cycles
-        
-    def flags_and_setter_finish(self, s, setCaller, compare_and=0x01):
-        # 2 cycles
+    def shift_word_right_logical(self, data):
+        # SRL
+        return self.flags_and_result_finish(data >> 1)
+
+    def flags_and_result_finish(self, s, compare_and=0x01):
         s &= 0xFF
-        self.f.z_flag_compare(s,  reset=True)
-        self.f.c_flag_add(s, compare_and)
-        setCaller.set(s) # 1 cycle
+        flags = 0
+        if s == 0:
+            flags |= constants.Z_FLAG
+        if (s & compare_and) != 0:
+            flags |= constants.C_FLAG
+        self.flags = flags
+        return s
 
-    def swap(self, getCaller, setCaller):
-        data = getCaller.get()
-        # 1 cycle
+    def swap(self, data):
+        # SWAP
         s = ((data << 4) + (data >> 4)) & 0xFF
-        self.f.z_flag_compare(s, reset=True)
-        setCaller.set(s)
+        self.z_flag_finish(s)
+        return s
 
-    def test_bit(self, getCaller, setCaller, n):
-        # 2 cycles
-        self.f.partial_reset(keep_c=True)
-        self.f.h_flag = True
-        self.f.z_flag = False
-        if (getCaller.get() & (1 << n)) == 0:
-            self.f.z_flag = True
-        self.cycles -= 1
+    def test_bit(self, data, n):
+        # BIT
+        flags = (self.flags & constants.C_FLAG) | constants.H_FLAG
+        if (data & (1 << n)) == 0:
+            flags |= constants.Z_FLAG
+        self.flags = flags
+
+    def set_bit(self, data, n):
+        # SET
+        return data | (1 << n)
+
+    def reset_bit(self, data, n):
+        # RES
+        return data & (~(1 << n))
 
-    def set_bit(self, getCaller, setCaller, n):
-        # 1 cycle
-        setCaller.set(getCaller.get() | (1 << n)) # 1 cycle
-        
-    def reset_bit(self, getCaller, setCaller, n):
-        # 1 cycle
-        setCaller.set(getCaller.get() & (~(1 << n))) # 1 cycle
-        
     def store_fetched_memory_in_a(self):
         # LD A,(nnnn), 4 cycles
-        self.a.set(self.read(self.fetch_double_address()))  # 1+1 + 2 cycles
+        self.registers[REG_A] = self.memory.read(self.fetch_double_address())
+        self.cycles -= 4
 
     def write_a_at_bc_address(self):
-        # 2 cycles
-        self.write(self.bc.get(), self.a.get())
-        
+        # LD (BC),A 2 cycles
+        self.memory.write(self.double_register(REG_BC), self.registers[REG_A])
+        self.cycles -= 2
+
     def write_a_at_de_address(self):
-        self.write(self.de.get(), self.a.get())
-           
+        # LD (DE),A 2 cycles
+        self.memory.write(self.double_register(REG_DE), self.registers[REG_A])
+        self.cycles -= 2
+
     def store_memory_at_bc_in_a(self):
-        self.a.set(self.read(self.bc.get()))
+        # LD A,(BC) 2 cycles
+        self.registers[REG_A] = self.memory.read(self.double_register(REG_BC))
+        self.cycles -= 2
 
     def store_memory_at_de_in_a(self):
-        self.a.set(self.read(self.de.get()))
-
-    def ld_dbRegisteri_A(self, register):
-        # LD (rr),A  2 cycles
-        self.write(register.get(), self.a.get()) # 2 cycles
+        # LD A,(DE) 2 cycles
+        self.registers[REG_A] = self.memory.read(self.double_register(REG_DE))
+        self.cycles -= 2
 
     def load_mem_sp(self):
         # LD (nnnn),SP  5 cycles
-        address = self.fetch_double_address() # 2 cycles
-        self.write(address,       self.sp.get_lo())  # 2 cycles
-        self.write((address + 1), self.sp.get_hi()) # 2 cycles
-        self.cycles += 1
+        address = self.fetch_double_address()
+        self.memory.write(address, self.stack_pointer & 0xFF)
+        self.memory.write((address + 1) & 0xFFFF, self.stack_pointer >> 8)
+        self.cycles -= 5
 
     def store_a_at_fetched_address(self):
         # LD (nnnn),A  4 cycles
-        self.write(self.fetch_double_address(), self.a.get()) # 2 cycles
+        self.memory.write(self.fetch_double_address(), self.registers[REG_A])
+        self.cycles -= 4
 
     def store_memory_at_axpanded_fetch_address_in_a(self):
         # LDH A,(nn) 3 cycles
-        self.a.set(self.read(0xFF00 + self.fetch())) # 1+1+1 cycles
-        
+        self.registers[REG_A] = self.memory.read(0xFF00 + self.fetch_byte())
+        self.cycles -= 3
+
     def store_expanded_c_in_a(self):
         # LDH A,(C) 2 cycles
-        self.a.set(self.read(0xFF00 + self.bc.get_lo())) # 1+2 cycles
-        
+        self.registers[REG_A] = self.memory.read(0xFF00 + self.registers[REG_C])
+        self.cycles -= 2
+
     def load_and_increment_a_hli(self):
         # loadAndIncrement A,(HL) 2 cycles
-        self.a.set(self.read(self.hl.get())) # 2 cycles
-        self.hl.inc()# 2 cycles
-        self.cycles += 2
-        
+        hl = self.double_register(REG_HL)
+        self.registers[REG_A] = self.memory.read(hl)
+        self.set_double_register(REG_HL, hl + 1)
+        self.cycles -= 2
+
     def load_and_decrement_a_hli(self):
         # loadAndDecrement A,(HL)  2 cycles
-        self.a.set(self.read(self.hl.get())) # 2 cycles
-        self.hl.dec() # 2 cycles
-        self.cycles += 2
-        
+        hl = self.double_register(REG_HL)
+        self.registers[REG_A] = self.memory.read(hl)
+        self.set_double_register(REG_HL, hl - 1)
+        self.cycles -= 2
+
     def write_a_at_expanded_fetch_address(self):
         # LDH (nn),A 3 cycles
-        self.write(0xFF00 + self.fetch(), self.a.get()) # 2 + 1 cycles
+        self.memory.write(0xFF00 + self.fetch_byte(), self.registers[REG_A])
+        self.cycles -= 3
 
     def write_a_at_expaded_c_address(self):
         # LDH (C),A 2 cycles
-        self.write(0xFF00 + self.bc.get_lo(), self.a.get()) # 2 cycles
-        
+        self.memory.write(0xFF00 + self.registers[REG_C], self.registers[REG_A])
+        self.cycles -= 2
+
     def load_and_increment_hli_a(self):
         # loadAndIncrement (HL),A 2 cycles
-        self.write(self.hl.get(), self.a.get()) # 2 cycles
-        self.hl.inc() # 2 cycles
-        self.cycles += 2
+        hl = self.double_register(REG_HL)
+        self.memory.write(hl, self.registers[REG_A])
+        self.set_double_register(REG_HL, hl + 1)
+        self.cycles -= 2
 
     def load_and_decrement_hli_a(self):
         # loadAndDecrement (HL),A  2 cycles
-        self.write(self.hl.get(), self.a.get()) # 2 cycles
-        self.hl.dec() # 2 cycles
-        self.cycles += 2
+        hl = self.double_register(REG_HL)
+        self.memory.write(hl, self.registers[REG_A])
+        self.set_double_register(REG_HL, hl - 1)
+        self.cycles -= 2
 
     def store_hl_in_sp(self):
         # LD SP,HL 2 cycles
-        self.sp.set(self.hl.get()) # 1 cycle
-        self.cycles -= 1
+        self.stack_pointer = self.double_register(REG_HL)
+        self.cycles -= 2
 
     def complement_a(self):
-        # CPA
-        self.a.set(self.a.get() ^ 0xFF)
-        self.f.n_flag = True
-        self.f.h_flag = True
+        # CPL 1 cycle
+        self.registers[REG_A] ^= 0xFF
+        self.flags |= constants.N_FLAG | constants.H_FLAG
+        self.cycles -= 1
 
     def decimal_adjust_accumulator(self):
         # DAA 1 cycle
+        a = self.registers[REG_A]
         delta = 0
-        if self.is_h(): 
+        if self.is_h():
             delta |= 0x06
         if self.is_c():
             delta |= 0x60
-        if (self.a.get() & 0x0F) > 0x09:
+        if (a & 0x0F) > 0x09:
             delta |= 0x06
-            if (self.a.get() & 0xF0) > 0x80:
+            if (a & 0xF0) > 0x80:
                 delta |= 0x60
-        if (self.a.get() & 0xF0) > 0x90:
+        if (a & 0xF0) > 0x90:
             delta |= 0x60
         if not self.is_n():
-            self.a.set((self.a.get() + delta) & 0xFF) # 1 cycle
+            a = (a + delta) & 0xFF
         else:
-            self.a.set((self.a.get() - delta) & 0xFF) # 1 cycle
-        self.f.partial_reset(keep_n=True)
+            a = (a - delta) & 0xFF
+        flags = self.flags & constants.N_FLAG
         if delta >= 0x60:
-            self.f.c_flag = True
-        self.f.z_flag_compare(self.a.get())
-
-    def inc_double_register(self, register):
-        # INC rr
-        register.inc()
-
-    def dec_double_register(self, register):
-        # DEC rr
-        register.dec()
+            flags |= constants.C_FLAG
+        if a == 0:
+            flags |= constants.Z_FLAG
+        self.flags = flags
+        self.registers[REG_A] = a
+        self.cycles -= 1
 
     def increment_sp_by_fetch(self):
         # ADD SP,nn 4 cycles
-        self.sp.set(self.get_fetchadded_sp()) # 1+1 cycle
-        self.cycles -= 2
+        self.stack_pointer = self.get_fetchadded_sp()
+        self.cycles -= 4
 
     def store_fetch_added_sp_in_hl(self):
         # LD HL,SP+nn   3  cycles
-        self.hl.set(self.get_fetchadded_sp()) # 1+1 cycle
-        self.cycles -= 1
+        self.set_double_register(REG_HL, self.get_fetchadded_sp())
+        self.cycles -= 3
 
     def get_fetchadded_sp(self):
-        # 1 cycle
-        offset = self.fetch() # 1 cycle
-        s = (self.sp.get() + offset) & 0xFFFF
-        self.f.reset()
+        offset = self.fetch_byte()
+        sp = self.stack_pointer
+        s = (sp + offset) & 0xFFFF
+        flags = 0
         if (offset >= 0):
-            if s < self.sp.get():
-                self.f.c_flag = True
-            if (s & 0x0F00) < (self.sp.get() & 0x0F00):
-                self.f.h_flag = True
+            if s < sp:
+                flags |= constants.C_FLAG
+            if (s & 0x0F00) < (sp & 0x0F00):
+                flags |= constants.H_FLAG
         else:
-            if s > self.sp.get():
-                self.f.c_flag = True
-            if (s & 0x0F00) > (self.sp.get() & 0x0F00):
-                self.f.h_flag = True
+            if s > sp:
+                flags |= constants.C_FLAG
+            if (s & 0x0F00) > (sp & 0x0F00):
+                flags |= constants.H_FLAG
+        self.flags = flags
         return s
 
     def complement_carry_flag(self):
-        # CCF/SCF
-        self.f.partial_reset(keep_z=True, keep_c=True)
-        self.f.c_flag = not self.f.c_flag
+        # CCF 0 cycles
+        self.flags = (self.flags & (constants.Z_FLAG | constants.C_FLAG)) \
+                        ^ constants.C_FLAG
 
     def set_carry_flag(self):
-        self.f.partial_reset(keep_z=True)
-        self.f.c_flag = True
+        # SCF 0 cycles
+        self.flags = (self.flags & constants.Z_FLAG) | constants.C_FLAG
 
     def nop(self):
         # NOP 1 cycle
@@ -802,44 +1211,50 @@ class CPU(object):
 
     def unconditional_jump(self):
         # JP nnnn, 4 cycles
-        self.pc.set(self.fetch_double_address()) # 1+2 cycles
-        self.cycles -= 1
+        self.program_counter = self.fetch_double_address()
+        self.cycles -= 4
 
     def conditional_jump(self, cc):
         # JP cc,nnnn 3,4 cycles
         if cc:
             self.unconditional_jump() # 4 cycles
         else:
-            self.pc.add(2) # 3 cycles
+            self.program_counter = (self.program_counter + 2) & 0xFFFF
+            self.cycles -= 3
 
     def relative_unconditional_jump(self):
         # JR +nn, 3 cycles
-        self.pc.add(self.fetch()) # 3 + 1 cycles
-        self.cycles += 1
+        offset = self.fetch_byte()
+        self.program_counter = (self.program_counter + offset) & 0xFFFF
+        self.cycles -= 3
 
     def relative_conditional_jump(self, cc):
         # JR cc,+nn, 2,3 cycles
         if cc:
             self.relative_unconditional_jump() # 3 cycles
         else:
-            self.pc.inc() # 2 cycles
-    
+            self.program_counter = (self.program_counter + 1) & 0xFFFF
+            self.cycles -= 2
+
     def unconditional_call(self):
         # CALL nnnn, 6 cycles
-        self.call(self.fetch_double_address())  # 4+2 cycles
+        self.call(self.fetch_double_address())
+        self.cycles -= 6
 
     def conditional_call(self, cc):
         # CALL cc,nnnn, 3,6 cycles
         if cc:
             self.unconditional_call() # 6 cycles
         else:
-            self.pc.add(2) # 3 cycles
+            self.program_counter = (self.program_counter + 2) & 0xFFFF
+            self.cycles -= 3
 
     def ret(self):
         # RET 4 cycles
-        lo = self.pop() # 1 cycle
-        hi = self.pop() # 1 cycle
-        self.pc.set_hi_lo(hi, lo) # 2 cycles
+        lo = self.pop()
+        hi = self.pop()
+        self.program_counter = (hi << 8) + lo
+        self.cycles -= 4
 
     def conditional_return(self, cc):
         # RET cc 2,5 cycles
@@ -858,17 +1273,19 @@ class CPU(object):
 
     def restart(self, nn):
         # RST nn 4 cycles
-        self.call(nn) # 4 cycles
+        self.call(nn)
+        self.cycles -= 4
 
     def disable_interrups(self):
-        # DI/EI 1 cycle
+        # DI 1 cycle
         self.ime = False
         self.cycles -= 1
 
     def enable_interrupts(self):
-        # 1 cycle
+        # EI 1 cycle + the following opcode
         self.ime = True
-        self.execute(self.fetch()) #  1
+        self.cycles -= 1
+        self.execute(self.fetch_byte())
         self.handle_pending_interrupt()
 
     def halt(self):
@@ -876,124 +1293,112 @@ class CPU(object):
         self.halted = True
         # emulate bug when interrupts are pending
         if not self.ime and self.interrupt.is_pending():
-            self.execute(self.memory.read(self.pc.get()))
+            self.execute(self.memory.read(self.program_counter))
         self.handle_pending_interrupt()
 
     def stop(self):
         # 0 cycles
-        self.cycles += 1
-        self.fetch()
-
-# ------------------------------------------------------------------------------
-
-class CallWrapper(object):   
-    
-    def get(self, use_cycles=True):
-        raise Exception("called CalLWrapper.get")
-        return 0
-    
-    def set(self, value, use_cycles=True):
-        raise Exception("called CalLWrapper.set")
-        pass
-        
-class RegisterCallWrapper(CallWrapper): 
-    def __init__(self, register):
-        self.register = register
-        
-    def get(self,  use_cycles=True):
-        return self.register.get(use_cycles)
-    
-    def set(self, value, use_cycles=True):
-        return self.register.set(value, use_cycles)
-
-
-class DoubleRegisterCallWrapper(CallWrapper):
-    def __init__(self, register):
-        self.register = register
-        
-    def get(self,  use_cycles=True):
-        return self.register.get(use_cycles)
-    
-    def set(self, value, use_cycles=True):
-        return self.register.set(value, use_cycles) 
-    
-    
-class CPUPopCaller(CallWrapper):
-    def __init__(self, cpu):
-        self.cpu = cpu
-        
-    def get(self,  use_cycles=True):
-        return self.cpu.pop(use_cycles)
-    
-    
-class CPUFetchCaller(CallWrapper):
-    def __init__(self, cpu):
-        self.cpu = cpu
-        
-    def get(self,  use_cycles=True):
-        return self.cpu.fetch(use_cycles)
+        self.fetch_byte()
 
 # ------------------------------------------------------------------------------
 # OPCODE LOOKUP TABLE GENERATION -----------------------------------------------
 
 
-GROUPED_REGISTERS = [CPU.get_b, 
-                     CPU.get_c, 
-                     CPU.get_d, 
+GROUPED_REGISTERS = [CPU.get_b,
+                     CPU.get_c,
+                     CPU.get_d,
                      CPU.get_e,
                      CPU.get_h,
-                     CPU.get_l, 
-                     CPU.get_hli, 
+                     CPU.get_l,
+                     CPU.get_hli,
                      CPU.get_a]
 
-def create_group_op_codes(table):
+def create_group_op_codes(table, create_lambda):
+    # entries: (opCode, step, function, cycles, (HL) cycles
+    #           [, values, value step])
     opCodes =[]
     for entry in table:
         opCode   = entry[0]
         step     = entry[1]
         function = entry[2]
-        if len(entry) == 4:
-            for registerGetter in GROUPED_REGISTERS:
-                for n in entry[3]:
-                    opCodes.append((opCode, group_lambda(function, registerGetter, n)))
-                    opCode += step
-        if len(entry) == 5:
-            entryStep = entry[4]
-            for registerGetter in GROUPED_REGISTERS:
+        if len(entry) == 7:
+            entryStep = entry[6]
+            for registerIndex in range(len(GROUPED_REGISTERS)):
+                cycles = group_cycles(entry, registerIndex)
                 stepOpCode = opCode
-                for n in entry[3]:
-                    opCodes.append((stepOpCode, group_lambda(function, registerGetter, n)))
+                for n in entry[5]:
+                    opCodes.append((stepOpCode, create_lambda(function, \
+                                                registerIndex, cycles, n)))
                     stepOpCode += entryStep
                 opCode+=step
         else:
-            for registerGetter in GROUPED_REGISTERS:
-                opCodes.append((opCode,group_lambda(function, registerGetter)))
+            for registerIndex in range(len(GROUPED_REGISTERS)):
+                cycles = group_cycles(entry, registerIndex)
+                opCodes.append((opCode, create_lambda(function, \
+                                                registerIndex, cycles)))
                 opCode += step
     return opCodes
 
-def group_lambda(function, register_getter, value=None):
+def group_cycles(entry, register_index):
+    if register_index == REG_HLI:
+        return entry[4]
+    return entry[3]
+
+def group_lambda(function, register_index, cycles, value=None):
+    # the operand is only read, the result goes to A or the flags
     if value is None:
-        return lambda s: function(s, RegisterCallWrapper(register_getter(s)), \
-                               RegisterCallWrapper(register_getter(s)))
+        def op_code(s):
+            s.cycles -= cycles
+            function(s, s.load_register(register_index))
     else:
-        return lambda s: function(s, RegisterCallWrapper(register_getter(s)), \
-                               RegisterCallWrapper(register_getter(s)), value)
-    
+        def op_code(s):
+            s.cycles -= cycles
+            function(s, s.load_register(register_index), value)
+    return op_code
+
+def modify_group_lambda(function, register_index, cycles, value=None):
+    # the result of function is written back to the operand
+    if value is None:
+        def op_code(s):
+            s.cycles -= cycles
+            s.store_register(register_index, \
+                             function(s, s.load_register(register_index)))
+    else:
+        def op_code(s):
+            s.cycles -= cycles
+            s.store_register(register_index, \
+                             function(s, s.load_register(register_index), value))
+    return op_code
+
+def store_group_lambda(function, register_index, cycles, value=None):
+    # the result of function is written to the operand
+    def op_code(s):
+        s.cycles -= cycles
+        s.store_register(register_index, function(s))
+    return op_code
+
 def create_load_group_op_codes():
     opCodes = []
     opCode  = 0x40
-    for storeRegister in GROUPED_REGISTERS:
-        for loadRegister in GROUPED_REGISTERS:
-            if loadRegister != CPU.get_hli or storeRegister != CPU.get_hli:
-                opCodes.append((opCode, load_group_lambda(storeRegister, loadRegister)))
+    for storeIndex in range(len(GROUPED_REGISTERS)):
+        for loadIndex in range(len(GROUPED_REGISTERS)):
+            if loadIndex != REG_HLI or storeIndex != REG_HLI:
+                cycles = 1
+                if loadIndex == REG_HLI or storeIndex == REG_HLI:
+                    cycles = 2
+                opCodes.append((opCode, load_group_lambda(storeIndex, \
+                                                    loadIndex, cycles)))
             opCode += 1
     return opCodes
-            
-def load_group_lambda(store_register, load_register):
-        return lambda s: CPU.ld(s, RegisterCallWrapper(load_register(s)), \
-                                   RegisterCallWrapper(store_register(s)))
-    
-    
+
+def load_group_lambda(store_index, load_index, cycles):
+    # LD r,r' 1 cycle, LD r,(HL) and LD (HL),r 2 cycles
+    def op_code(s):
+        s.cycles -= cycles
+        s.store_register(store_index, s.load_register(load_index))
+    return op_code
+
+
 def create_register_op_codes(table):
     opCodes = []
     for entry in table:
@@ -1010,8 +1415,14 @@ def register_lambda(function, registerOrGetter):
         return lambda s: function(s, registerOrGetter(s))
     else:
         return lambda s: function(s, registerOrGetter)
-        
-        
+
+def fetch_lambda(function):
+    # ALU A,nn 2 cycles
+    def op_code(s):
+        s.cycles -= 2
+        function(s, s.fetch_byte())
+    return op_code
+
 def initialize_op_code_table(table):
     result = [None] * (0xFF+1)
     for entry in  table:
@@ -1026,7 +1437,7 @@ def initialize_op_code_table(table):
     return result
 
 # OPCODE TABLES ---------------------------------------------------------------
-                        
+
 FIRST_ORDER_OP_CODES = [
     (0x00, CPU.nop),
     (0x08, CPU.load_mem_sp),
@@ -1066,14 +1477,14 @@ FIRST_ORDER_OP_CODES = [
     (0xF8, CPU.store_fetch_added_sp_in_hl),
     (0xCB, CPU.fetch_execute),
     (0xCD, CPU.unconditional_call),
-    (0xC6, lambda s: CPU.add_a(s,               CPUFetchCaller(s))),
-    (0xCE, lambda s: CPU.add_with_carry(s,      CPUFetchCaller(s))),
+    (0xC6, fetch_lambda(CPU.add_a)),
+    (0xCE, fetch_lambda(CPU.add_with_carry)),
     (0xD6, CPU.fetch_subtract_a),
-    (0xDE, lambda s: CPU.subtract_with_carry(s, CPUFetchCaller(s))),
-    (0xE6, lambda s: CPU.AND(s,                 CPUFetchCaller(s))),
-    (0xEE, lambda s: CPU.XOR(s,                 CPUFetchCaller(s))),
-    (0xF6, lambda s: CPU.OR(s,                  CPUFetchCaller(s))),
-    (0xFE, lambda s: CPU.compare_a(s,           CPUFetchCaller(s))),
+    (0xDE, fetch_lambda(CPU.subtract_with_carry)),
+    (0xE6, fetch_lambda(CPU.AND)),
+    (0xEE, fetch_lambda(CPU.XOR)),
+    (0xF6, fetch_lambda(CPU.OR)),
+    (0xFE, fetch_lambda(CPU.compare_a)),
     (0xC7, lambda s: CPU.restart(s, 0x00)),
     (0xCF, lambda s: CPU.restart(s, 0x08)),
     (0xD7, lambda s: CPU.restart(s, 0x10)),
@@ -1084,38 +1495,44 @@ FIRST_ORDER_OP_CODES = [
     (0xFF, lambda s: CPU.restart(s, 0x38))
 ]
 
+# (opCode, step, function, cycles, (HL) cycles)
 REGISTER_GROUP_OP_CODES = [
-    (0x04, 0x08, CPU.inc),
-    (0x05, 0x08, CPU.dec),    
-    (0x06, 0x08, CPU.load_fetch_register),
-    (0x80, 0x01, CPU.add_a),    
-    (0x88, 0x01, CPU.add_with_carry),    
-    (0x90, 0x01, CPU.subtract_a),    
-    (0x98, 0x01, CPU.subtract_with_carry),    
-    (0xA0, 0x01, CPU.AND),    
-    (0xA8, 0x01, CPU.XOR),    
-    (0xB0, 0x01, CPU.OR),
-    (0xB8, 0x01, CPU.compare_a),
-    (0x06, 0x08, CPU.fetch_load)
-]    
-        
+    (0x04, 0x08, CPU.inc, 1, 3),
+    (0x05, 0x08, CPU.dec, 1, 3),
+]
+
+REGISTER_STORE_GROUP_OP_CODES = [
+    (0x06, 0x08, CPU.fetch_load, 2, 3)
+]
+
+REGISTER_A_GROUP_OP_CODES = [
+    (0x80, 0x01, CPU.add_a, 1, 2),
+    (0x88, 0x01, CPU.add_with_carry, 1, 2),
+    (0x90, 0x01, CPU.subtract_a, 1, 2),
+    (0x98, 0x01, CPU.subtract_with_carry, 1, 2),
+    (0xA0, 0x01, CPU.AND, 1, 2),
+    (0xA8, 0x01, CPU.XOR, 1, 2),
+    (0xB0, 0x01, CPU.OR, 1, 2),
+    (0xB8, 0x01, CPU.compare_a, 1, 2)
+]
+
 
-REGISTER_SET_A =    [CPU.get_bc, 
-                     CPU.get_de, 
-                     CPU.get_hl, 
-                     CPU.get_sp]
+REGISTER_SET_A =    [REG_BC,
+                     REG_DE,
+                     REG_HL,
+                     REG_SP]
 
-REGISTER_SET_B =    [CPU.get_bc, 
-                     CPU.get_de, 
-                     CPU.get_hl, 
-                     CPU.get_af]
+REGISTER_SET_B =    [REG_BC,
+                     REG_DE,
+                     REG_HL,
+                     REG_AF]
 
-FLAG_REGISTER_SET = [CPU.is_not_z, 
-                     CPU.is_z, 
-                     CPU.is_not_c, 
+FLAG_REGISTER_SET = [CPU.is_not_z,
+                     CPU.is_z,
+                     CPU.is_not_c,
                      CPU.is_c]
 
-REGISTER_OP_CODES = [ 
+REGISTER_OP_CODES = [
     (0x01, 0x10, CPU.fetch_double_register,     REGISTER_SET_A),
     (0x09, 0x10, CPU.add_hl,                    REGISTER_SET_A),
     (0x03, 0x10, CPU.inc_double_register,       REGISTER_SET_A),
@@ -1128,26 +1545,66 @@ REGISTER_OP_CODES = [
     (0xC5, 0x10, CPU.push_double_register,      REGISTER_SET_B)
 ]
 
+# the cycles of the second order opcodes exclude the 0xCB prefix
 SECOND_ORDER_REGISTER_GROUP_OP_CODES = [
-    (0x00, 0x01, CPU.rotate_left_circular),    
-    (0x08, 0x01, CPU.rotate_right_circular),    
-    (0x10, 0x01, CPU.rotate_left),    
-    (0x18, 0x01, CPU.rotate_right),    
-    (0x20, 0x01, CPU.shift_left_arithmetic),    
-    (0x28, 0x01, CPU.shift_right_arithmetic),    
-    (0x30, 0x01, CPU.swap),    
-    (0x38, 0x01, CPU.shift_word_right_logical),
-    (0x40, 0x01, CPU.test_bit,  range(0, 8), 0x08),    
-    (0xC0, 0x01, CPU.set_bit,   range(0, 8), 0x08),
-    (0x80, 0x01, CPU.reset_bit, range(0, 8), 0x08)         
+    (0x00, 0x01, CPU.rotate_left_circular, 1, 3),
+    (0x08, 0x01, CPU.rotate_right_circular, 1, 3),
+    (0x10, 0x01, CPU.rotate_left, 1, 3),
+    (0x18, 0x01, CPU.rotate_right, 1, 3),
+    (0x20, 0x01, CPU.shift_left_arithmetic, 1, 3),
+    (0x28, 0x01, CPU.shift_right_arithmetic, 1, 3),
+    (0x30, 0x01, CPU.swap, 1, 3),
+    (0x38, 0x01, CPU.shift_word_right_logical, 1, 3),
+    (0xC0, 0x01, CPU.set_bit,   1, 3, range(0, 8), 0x08),
+    (0x80, 0x01, CPU.reset_bit, 1, 3, range(0, 8), 0x08)
 ]
 
+SECOND_ORDER_REGISTER_A_GROUP_OP_CODES = [
+    (0x40, 0x01, CPU.test_bit,  1, 2, range(0, 8), 0x08),
+]
+
+def create_op_code_flags(op_codes, value, table=None):
+    if table is None:
+        table = [0] * (0xFF+1)
+    for op_code in op_codes:
+        table[op_code] = value
+    return table
+
+# operand bytes following each first order opcode
+OPERAND_LENGTHS = create_op_code_flags([0x06, 0x0E, 0x16, 0x1E, 0x26, 0x2E,
+                                        0x36, 0x3E, 0x10, 0x18, 0x20, 0x28,
+                                        0x30, 0x38, 0xC6, 0xCE, 0xD6, 0xDE,
+                                        0xE6, 0xEE, 0xF6, 0xFE, 0xE0, 0xF0,
+                                        0xE8, 0xF8], 1)
+OPERAND_LENGTHS = create_op_code_flags([0x01, 0x11, 0x21, 0x31, 0x08, 0xC2,
+                                        0xCA, 0xD2, 0xDA, 0xC3, 0xC4, 0xCC,
+                                        0xD4, 0xDC, 0xCD, 0xEA, 0xFA], 2,
+                                        OPERAND_LENGTHS)
+
+# opcodes changing the control flow or the interrupt state end a basic block
+BLOCK_END_OP_CODES = create_op_code_flags([0x10, 0x18, 0x20, 0x28, 0x30, 0x38,
+                                           0x76, 0xC0, 0xC8, 0xD0, 0xD8, 0xC9,
+                                           0xD9, 0xC2, 0xCA, 0xD2, 0xDA, 0xC3,
+                                           0xE9, 0xC4, 0xCC, 0xD4, 0xDC, 0xCD,
+                                           0xC7, 0xCF, 0xD7, 0xDF, 0xE7, 0xEF,
+                                           0xF7, 0xFF, 0xF3, 0xFB], 1)
+
 # RAW OPCODE TABLE INITIALIZATION ----------------------------------------------
 
 FIRST_ORDER_OP_CODES += create_register_op_codes(REGISTER_OP_CODES)
-FIRST_ORDER_OP_CODES += create_group_op_codes(REGISTER_GROUP_OP_CODES)
+FIRST_ORDER_OP_CODES += create_group_op_codes(REGISTER_GROUP_OP_CODES,
+                                              modify_group_lambda)
+FIRST_ORDER_OP_CODES += create_group_op_codes(REGISTER_STORE_GROUP_OP_CODES,
+                                              store_group_lambda)
+FIRST_ORDER_OP_CODES += create_group_op_codes(REGISTER_A_GROUP_OP_CODES,
+                                              group_lambda)
 FIRST_ORDER_OP_CODES += create_load_group_op_codes()
-SECOND_ORDER_OP_CODES = create_group_op_codes(SECOND_ORDER_REGISTER_GROUP_OP_CODES)
+SECOND_ORDER_OP_CODES = create_group_op_codes(
+                                        SECOND_ORDER_REGISTER_GROUP_OP_CODES,
+                                        modify_group_lambda)
+SECOND_ORDER_OP_CODES += create_group_op_codes(
+                                        SECOND_ORDER_REGISTER_A_GROUP_OP_CODES,
+                                        group_lambda)
 
 
 OP_CODES = initialize_op_code_table(FIRST_ORDER_OP_CODES)
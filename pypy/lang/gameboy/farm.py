@@ -0,0 +1,420 @@
+"""
+PyBoy GameBoy (TM) Emulator
+
+ROM Test Farm
+
+Runs jobs, each a ROM, an input script and a cycle budget, on a pool of
+worker processes forked up front. Every worker has a job pipe and a result
+pipe, the parent polls the result pipes of the busy workers and hands every
+idle worker its next job. Every record on a pipe is its length followed by
+the fields encoded like a save state. A worker that dies closes its result
+pipe, its job fails and the remaining jobs run on the other workers.
+
+Every worker keeps a booted GameBoy per ROM and runs each job on a fork of
+it, so a ROM is loaded only once per worker as long as its file does not
+change and it is one of the last ROM_CACHE_SIZE ROMs the worker ran.
+"""
+
+import os
+import time
+from pypy.rlib import rpoll
+from pypy.lang.gameboy import constants
+from pypy.lang.gameboy.batch import BatchGameBoy, HeadlessVideoDriver, \
+                                    VIDEO_HASH, pack_int
+from pypy.lang.gameboy.cartridge import Cartridge, RomCache
+from pypy.lang.gameboy.savestate import StateWriter, StateReader
+
+# the limits keep a result record small
+SERIAL_OUTPUT_LIMIT = 1024
+ERROR_LIMIT         = 256
+
+RECORD_HEADER_SIZE = 4
+
+# ROMs a worker keeps booted
+ROM_CACHE_SIZE = 16
+
+
+class FarmError(Exception):
+    pass
+
+
+class FarmJob(object):
+    """
+    Runs the ROM at path for cycles cycles. The script is a list of
+    (frame, button mask) pairs sorted by frame, the mask is set on the
+    joypad at the start of the frame, see JoypadDriver.get_button_mask.
+    """
+    def __init__(self, path, cycles, script=None):
+        if script is None:
+            script = []
+        self.path = path
+        self.cycles = cycles
+        self.script = script
+
+    def save_state(self, state):
+        state.write_chars(self.path)
+        state.write_int(self.cycles)
+        state.write_int(len(self.script))
+        for frame, mask in self.script:
+            state.write_int(frame)
+            state.write_int(mask)
+
+    def load_state(self, state):
+        self.path = state.read_chars()
+        self.cycles = state.read_int()
+        self.script = []
+        for index in range(state.read_int()):
+            frame = state.read_int()
+            mask = state.read_int()
+            self.script.append((frame, mask))
+
+
+class FarmResult(object):
+    """
+    The final registers, the hash of the last drawn frame and the bytes
+    sent over the serial link of a job, the serial output is cut after
+    SERIAL_OUTPUT_LIMIT bytes. A failed job has an error message and no
+    other fields. The time is the time the worker took in microseconds.
+    """
+    def __init__(self, index=-1, worker=-1):
+        self.index = index
+        self.worker = worker
+        self.error = ""
+        self.registers = [0] * 8
+        self.flags = 0
+        self.stack_pointer = 0
+        self.program_counter = 0
+        self.frame_hash = 0
+        self.serial = ""
+        self.cycles = 0
+        self.instructions = 0
+        self.time = 0
+
+    def is_failed(self):
+        return self.error != ""
+
+    def set_error(self, message):
+        self.error = message[:ERROR_LIMIT]
+        if self.error == "":
+            self.error = "failed"
+
+    def save_state(self, state):
+        state.write_int(self.index)
+        state.write_int(self.worker)
+        state.write_chars(self.error)
+        state.write_ints(self.registers)
+        state.write_int(self.flags)
+        state.write_int(self.stack_pointer)
+        state.write_int(self.program_counter)
+        state.write_int(self.frame_hash)
+        state.write_chars(self.serial)
+        state.write_int(self.cycles)
+        state.write_int(self.instructions)
+        state.write_int(self.time)
+
+    def load_state(self, state):
+        self.index           = state.read_int()
+        self.worker          = state.read_int()
+        self.error           = state.read_chars()
+        state.read_ints(self.registers)
+        self.flags           = state.read_int()
+        self.stack_pointer   = state.read_int()
+        self.program_counter = state.read_int()
+        self.frame_hash      = state.read_int()
+        self.serial          = state.read_chars()
+        self.cycles          = state.read_int()
+        self.instructions    = state.read_int()
+        self.time            = state.read_int()
+
+    def get_line(self, path):
+        if self.is_failed():
+            return "%s FAILED %s" % (path, self.error)
+        return "%s pc=%04X sp=%04X frame=%08X cycles=%d instructions=%d " \
+               "time=%dus serial=%r" % (path, self.program_counter,
+                    self.stack_pointer, self.frame_hash, self.cycles,
+                    self.instructions, self.time, self.serial)
+
+
+# PIPES ------------------------------------------------------------------------
+
+def unpack_int(data):
+    # little endian
+    value = 0
+    for index in range(len(data) - 1, -1, -1):
+        value = (value << 8) | ord(data[index])
+    return value
+
+def read_exactly(fd, length):
+    # returns "" at the end of the pipe
+    chunks = []
+    count = 0
+    while count < length:
+        data = os.read(fd, length - count)
+        if data == "":
+            if count == 0:
+                return ""
+            raise FarmError("truncated record")
+        chunks.append(data)
+        count += len(data)
+    return "".join(chunks)
+
+def write_record(fd, state):
+    data = state.get_data()
+    data = pack_int(len(data), RECORD_HEADER_SIZE) + data
+    while data != "":
+        count = os.write(fd, data)
+        data = data[count:]
+
+def read_record(fd):
+    # returns None at the end of the pipe
+    header = read_exactly(fd, RECORD_HEADER_SIZE)
+    if header == "":
+        return None
+    data = read_exactly(fd, unpack_int(header))
+    return StateReader(data)
+
+
+# ------------------------------------------------------------------------------
+
+class FarmWorker(object):
+    """
+    Runs jobs, in a worker process or in the process of the farm.
+    """
+    def __init__(self, number):
+        self.number = number
+        self.roms = RomCache(ROM_CACHE_SIZE)
+        self.gameboys = {}
+        # the ROM contents each GameBoy was booted from
+        self.contents = {}
+
+    def get_gameboy(self, path):
+        # a booted GameBoy per ROM in the cache, the jobs run on forks
+        data = self.roms.read(path)
+        if path not in self.gameboys or self.contents[path] is not data:
+            gameboy = BatchGameBoy(HeadlessVideoDriver(VIDEO_HASH))
+            gameboy.load_cartridge(Cartridge(path, self.roms))
+            self.gameboys[path] = gameboy
+            self.contents[path] = data
+            self.drop_old_gameboys()
+        return self.gameboys[path]
+
+    def drop_old_gameboys(self):
+        for path in self.gameboys.keys():
+            if not self.roms.contains(path):
+                del self.gameboys[path]
+                del self.contents[path]
+
+    def run_job(self, index, job):
+        result = FarmResult(index, self.number)
+        start = time.time()
+        try:
+            self.emulate_job(job, result)
+        except Exception, error:
+            result = FarmResult(index, self.number)
+            result.set_error(str(error))
+        result.time = int((time.time() - start) * 1000000)
+        return result
+
+    def emulate_job(self, job, result):
+        gameboy = self.get_gameboy(job.path).fork()
+        gameboy.serial.record_transfers()
+        start = gameboy.cycles
+        for frame, mask in job.script:
+            cycles = min(frame * constants.FRAME_TICKS, job.cycles)
+            if cycles > gameboy.cycles - start:
+                gameboy.emulate(cycles - (gameboy.cycles - start))
+            gameboy.joypad_driver.set_button_mask(mask)
+        if job.cycles > gameboy.cycles - start:
+            gameboy.emulate(job.cycles - (gameboy.cycles - start))
+        cpu = gameboy.cpu
+        for register in range(len(result.registers)):
+            result.registers[register] = cpu.registers[register]
+        result.flags = cpu.flags
+        result.stack_pointer = cpu.stack_pointer
+        result.program_counter = cpu.program_counter
+        result.frame_hash = int(gameboy.get_frame_hash())
+        result.serial = gameboy.serial.get_transfers()[:SERIAL_OUTPUT_LIMIT]
+        result.cycles = gameboy.cycles - start
+        result.instructions = cpu.instructions
+
+    def serve(self, job_fd, result_fd):
+        # until the farm closes the job pipe
+        while True:
+            state = read_record(job_fd)
+            if state is None:
+                return
+            index = state.read_int()
+            job = FarmJob("", 0)
+            job.load_state(state)
+            result = self.run_job(index, job)
+            state = StateWriter()
+            result.save_state(state)
+            write_record(result_fd, state)
+
+
+class Farm(object):
+    """
+    Pool of worker processes, without workers the jobs run in this
+    process. start forks the workers, which live until stop.
+    """
+    def __init__(self, workers=0):
+        self.workers = workers
+        # per worker, the pid is -1 once the worker died
+        self.pids = []
+        self.job_fds = []
+        self.result_fds = []
+        self.time = 0.0
+
+    def is_started(self):
+        return len(self.pids) > 0
+
+    def is_alive(self, number):
+        return self.pids[number] >= 0
+
+    def start(self):
+        if self.is_started() or self.workers <= 0:
+            return
+        for number in range(self.workers):
+            job_read, job_write = os.pipe()
+            result_read, result_write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                self.job_fds.append(job_write)
+                self.result_fds.append(result_read)
+                self.run_worker(number, job_read, result_write)
+            os.close(job_read)
+            os.close(result_write)
+            self.pids.append(pid)
+            self.job_fds.append(job_write)
+            self.result_fds.append(result_read)
+
+    def run_worker(self, number, job_fd, result_fd):
+        # the child, never returns, closes the pipe ends of the farm so the
+        # workers see the end of their job pipe when the farm closes it
+        status = 0
+        try:
+            for fd in self.job_fds + self.result_fds:
+                os.close(fd)
+            FarmWorker(number).serve(job_fd, result_fd)
+        except Exception:
+            status = 1
+        os._exit(status)
+
+    def drop_worker(self, number):
+        # reaps a worker which closed its result pipe
+        os.waitpid(self.pids[number], 0)
+        os.close(self.job_fds[number])
+        os.close(self.result_fds[number])
+        self.pids[number] = -1
+        self.job_fds[number] = -1
+        self.result_fds[number] = -1
+
+    def stop(self):
+        for fd in self.job_fds:
+            if fd >= 0:
+                os.close(fd)
+        failed = 0
+        for pid in self.pids:
+            if pid >= 0:
+                pid, status = os.waitpid(pid, 0)
+                if status != 0:
+                    failed += 1
+        for fd in self.result_fds:
+            if fd >= 0:
+                os.close(fd)
+        self.pids = []
+        self.job_fds = []
+        self.result_fds = []
+        if failed > 0:
+            raise FarmError("%d workers failed" % failed)
+
+    def run(self, jobs):
+        """
+        Returns the results of the jobs in the order of the jobs.
+        """
+        start = time.time()
+        if self.workers <= 0:
+            worker = FarmWorker(0)
+            results = [worker.run_job(index, jobs[index])
+                       for index in range(len(jobs))]
+        else:
+            self.start()
+            results = self.dispatch(jobs)
+        self.time += time.time() - start
+        return results
+
+    def dispatch(self, jobs):
+        results = [None] * len(jobs)
+        # the index of the job each worker runs, -1 for an idle worker
+        running = [-1] * len(self.pids)
+        next = 0
+        for number in range(len(self.pids)):
+            if next < len(jobs) and self.is_alive(number):
+                self.send_job(number, next, jobs[next])
+                running[number] = next
+                next += 1
+        while True:
+            fds = {}
+            for number in range(len(running)):
+                if running[number] >= 0:
+                    fds[self.result_fds[number]] = rpoll.POLLIN
+            if len(fds) == 0:
+                break
+            for fd, events in rpoll.poll(fds, -1):
+                number = self.result_fds.index(fd)
+                index = running[number]
+                running[number] = -1
+                result = self.read_result(number)
+                if result is None:
+                    result = FarmResult(index, number)
+                    result.set_error("worker %d died" % number)
+                    self.drop_worker(number)
+                results[index] = result
+                if next < len(jobs) and self.is_alive(number):
+                    self.send_job(number, next, jobs[next])
+                    running[number] = next
+                    next += 1
+        if next < len(jobs):
+            raise FarmError("all workers died")
+        return results
+
+    def read_result(self, number):
+        # returns None when the worker died
+        try:
+            state = read_record(self.result_fds[number])
+        except FarmError:
+            return None
+        if state is None:
+            return None
+        result = FarmResult()
+        result.load_state(state)
+        state.check_finished()
+        return result
+
+    def send_job(self, number, index, job):
+        state = StateWriter()
+        state.write_int(index)
+        job.save_state(state)
+        try:
+            write_record(self.job_fds[number], state)
+        except OSError:
+            # the worker died, its result pipe is closed as well
+            pass
+
+    def get_report(self, jobs, results):
+        """
+        One line per job and a summary.
+        """
+        lines = []
+        failed = 0
+        job_time = 0
+        for index in range(len(jobs)):
+            result = results[index]
+            if result.is_failed():
+                failed += 1
+            job_time += result.time
+            lines.append(result.get_line(jobs[index].path))
+        lines.append("%d jobs, %d failed, %d workers, %f s, %f s in jobs" % (
+                     len(jobs), failed, self.workers, self.time,
+                     job_time / 1000000.0))
+        return "\n".join(lines) + "\n"
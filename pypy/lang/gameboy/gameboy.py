@@ -14,14 +14,25 @@ from pypy.lang.gameboy.serial import *
 from pypy.lang.gameboy.sound import *
 from pypy.lang.gameboy.timer import *
 from pypy.lang.gameboy.video import *
+from pypy.lang.gameboy.savestate import *
+from pypy.lang.gameboy.rewind import Rewind
 from pypy.lang.gameboy.cartridge import *
 
 
 class GameBoy(object):
 
-    def __init__(self):
+    def __init__(self, parent=None):
+        # a fork is built from its parent, see fork
+        self.set_dma_timing(False)
+        self.rewind_buffer = None
+        self.rewind_cycles = 0
         self.create_drivers()
-        self.create_gamboy_elements()
+        if parent is None:
+            self.create_gamboy_elements()
+        else:
+            self.create_forked_elements(parent)
+        self.create_memory_map()
+        self.create_scheduler(parent)
 
     def create_drivers(self):
         self.clock = Clock()
@@ -34,12 +45,23 @@ class GameBoy(object):
         self.cartridge_manager = CartridgeManager(self.clock)
         self.interrupt = Interrupt()
         self.cpu    = CPU(self.interrupt, self)
+        self.cpu.enable_ram_code_cache()
         self.serial = Serial(self.interrupt)
         self.timer  = Timer(self.interrupt)
         self.joypad = Joypad(self.joypad_driver, self.interrupt)
         self.video  = Video(self.video_driver, self.interrupt, self)
-        #self.sound  = Sound(self.sound_driver)  
-        self.sound = BogusSound()
+        self.sound  = Sound(self.sound_driver)
+
+    def create_forked_elements(self, parent):
+        # the elements of a fork before its state is read: the cartridge and
+        # the decoded ROM code are shared, the memories are filled with
+        # shared pages and are replaced by the pages of the parent
+        self.create_gamboy_elements()
+        self.cartridge_manager.load_fork(parent.cartridge_manager)
+        self.cpu.share_rom_blocks(parent.cpu)
+        self.set_dma_timing(parent.dma_timing)
+        self.set_frame_skip(parent.get_frame_skip())
+        self.set_dot_accurate_video(parent.video.is_dot_accurate())
         
     def get_cartridge_manager(self):
         return self.cartridge_manager
@@ -47,6 +69,7 @@ class GameBoy(object):
     def load_cartridge(self, cartridge):
         self.cartridge_manager.load(cartridge)
         self.cpu.set_rom(self.cartridge_manager.get_rom())
+        self.create_memory_map()
         
     def load_cartridge_file(self, path):
         self.load_cartridge(Cartridge(path))
@@ -57,6 +80,9 @@ class GameBoy(object):
     def set_frame_skip(self, frameSkip):
         self.video.set_frame_skip(frameSkip)
 
+    def set_dot_accurate_video(self, dot_accurate):
+        self.video.set_dot_accurate(dot_accurate)
+
     def save(self, cartridgeName):
         self.cartridge.save(cartridgeName)
 
@@ -77,37 +103,371 @@ class GameBoy(object):
         self.video.reset()
         self.sound.reset()
         self.cpu.set_rom(self.cartridge_manager.get_rom())
+        self.create_memory_map()
+        self.create_scheduler()
+        self.dma_end = -1
         self.draw_logo()
 
+    # SAVE STATES --------------------------------------------------------------
+
+    def save_state(self):
+        """
+        Returns the state of the emulated hardware as a string. The
+        cartridge ROM, the drivers and the settings are not stored.
+        """
+        state = StateWriter()
+        self.write_state(state)
+        return state.get_data()
+
+    def load_state(self, data):
+        """
+        Restores a state of save_state for the loaded cartridge, raises an
+        InvalidStateError for a broken state or one of another cartridge.
+        A state of another cartridge is rejected before anything is changed.
+        """
+        self.read_state(StateReader(data))
+
+    def write_state(self, state):
+        self.cartridge_manager.save_state(state)
+        self.cpu.save_state(state)
+        self.interrupt.save_state(state)
+        self.ram.save_state(state)
+        self.serial.save_state(state)
+        self.timer.save_state(state)
+        self.joypad.save_state(state)
+        self.video.save_state(state)
+        self.sound.save_state(state)
+        state.write_int(self.cycles)
+        state.write_int(self.slice_end)
+        state.write_int(self.next_event)
+        state.write_ints(self.component_cycles)
+        state.write_ints(self.event_cycles)
+        state.write_int(self.dma_end)
+
+    def read_state(self, state):
+        self.cartridge_manager.load_state(state)
+        self.cpu.load_state(state)
+        self.interrupt.load_state(state)
+        self.ram.load_state(state)
+        self.serial.load_state(state)
+        self.timer.load_state(state)
+        self.joypad.load_state(state)
+        self.video.load_state(state)
+        self.sound.load_state(state)
+        self.cycles     = state.read_int()
+        self.slice_end  = state.read_int()
+        self.next_event = state.read_int()
+        state.read_ints(self.component_cycles)
+        state.read_ints(self.event_cycles)
+        self.dma_end    = state.read_int()
+        state.check_finished()
+        # the elements and their memories are the same, only the restored
+        # ROM bank has to be mapped
+        self.map_rom()
+
+    # FORKS --------------------------------------------------------------------
+
+    def fork(self):
+        """
+        Returns a GameBoy in the state of this one. The cartridge ROM and
+        the decoded ROM code are shared, the memories are shared page by
+        page until either GameBoy writes a page. The drivers are cloned,
+        the rewind buffer is not.
+        """
+        child = self.create_fork()
+        state = ForkWriter()
+        self.write_state(state)
+        child.read_state(ForkReader(state.get_data(), state.buffers))
+        return child
+
+    def create_fork(self):
+        return ForkedGameBoy(self, self.joypad_driver.clone(),
+                             self.video_driver.clone(),
+                             self.sound_driver.clone())
+
+    # REWIND -------------------------------------------------------------------
+
+    def enable_rewind(self, interval=30, budget=16 << 20, compress=False):
+        """
+        Records the state of every frame, see Rewind.
+        """
+        self.rewind_buffer = Rewind(self, interval, budget, compress)
+        self.rewind_cycles = self.cycles
+
+    def disable_rewind(self):
+        self.rewind_buffer = None
+
+    def rewind(self, frames):
+        """
+        Returns to the state of frames frames ago, at most to the oldest
+        recorded one. Returns the number of frames rewound.
+        """
+        if self.rewind_buffer is None:
+            raise Exception("rewind is not enabled")
+        rewound = self.rewind_buffer.rewind(frames)
+        if rewound < 0:
+            return 0
+        self.rewind_cycles = self.cycles + constants.FRAME_TICKS
+        return rewound
+
+    def record_frame(self):
+        # the state is taken at the first slice end of the frame
+        self.rewind_buffer.record()
+        self.rewind_cycles += constants.FRAME_TICKS
+        if self.rewind_cycles <= self.cycles:
+            self.rewind_cycles = self.cycles + constants.FRAME_TICKS
+
+    # SCHEDULER ----------------------------------------------------------------
+
+    def create_scheduler(self, parent=None):
+        # the timed components, due components are emulated in this order.
+        # Every component is emulated up to component_cycles[index] and has
+        # its next event at the absolute cycle event_cycles[index].
+        self.components = [self.serial, self.timer, self.video, self.sound,
+                           self.joypad]
+        self.cycles = 0
+        self.slice_end = 0
+        self.next_event = 0
+        self.component_cycles = [0] * len(self.components)
+        self.event_cycles = [0] * len(self.components)
+        if parent is not None:
+            # the table is never written, the state of the fork is read next
+            self.io_components = parent.io_components
+            return
+        # index of the component behind every IO register, -1 for none
+        self.io_components = [-1] * 256
+        for index in range(0, 256):
+            receiver = self.get_receiver(0xFF00 + index)
+            for component in range(len(self.components)):
+                if receiver is self.components[component]:
+                    self.io_components[index] = component
+        for index in range(len(self.components)):
+            self.schedule(index)
+
+    def schedule(self, index):
+        self.event_cycles[index] = self.component_cycles[index] + \
+                                   self.components[index].get_cycles()
+        self.next_event = self.event_cycles[0]
+        for event in self.event_cycles:
+            if event < self.next_event:
+                self.next_event = event
+
+    def reschedule(self, index):
+        # a register write changed the timing of the component, the running
+        # CPU slice ends at its new event
+        self.schedule(index)
+        if self.cycles <= self.next_event and \
+           self.next_event < self.slice_end:
+            self.cpu.cycles -= self.slice_end - self.next_event
+            self.slice_end = self.next_event
+
+    def synchronize(self, index, cycles):
+        ticks = cycles - self.component_cycles[index]
+        if ticks > 0:
+            self.components[index].emulate(ticks)
+            self.component_cycles[index] = cycles
+
+    def get_current_cycles(self):
+        # the CPU is somewhere within the running slice
+        return self.slice_end - self.cpu.cycles
+
     def get_cycles(self):
-        return min(min(min(min( self.video.get_cycles(), self.serial.get_cycles()),
-                    self.timer.get_cycles()), self.sound.get_cycles()),
-                    self.joypad.get_cycles())
+        # an event can not be due in the past, run at least one cycle
+        return max(self.next_event - self.cycles, 1)
+
+    def set_dma_timing(self, enabled):
+        # with DMA timing the CPU can only access HRAM and the IO registers
+        # while an OAM DMA transfer is running
+        self.dma_timing = enabled
+        self.dma_end = -1
+
+    def start_dma(self):
+        if self.dma_timing:
+            self.dma_end = self.get_current_cycles() + constants.DMA_TICKS
+
+    def is_dma_running(self):
+        if self.dma_end < 0:
+            return False
+        if self.get_current_cycles() >= self.dma_end:
+            self.dma_end = -1
+            return False
+        return True
 
     def emulate(self, ticks):
         while ticks > 0:
-            count = self.get_cycles()
-            self.cpu.emulate(count)
-            self.serial.emulate(count)
-            self.timer.emulate(count)
-            self.video.emulate(count)
-            self.sound.emulate(count)
-            self.joypad.emulate(count)
-            ticks -= count
+            start = self.cycles
+            self.slice_end = start + self.get_cycles()
+            self.cpu.emulate(self.slice_end - start)
+            self.cycles = self.slice_end
+            self.emulate_due_components()
+            if self.rewind_buffer is not None and \
+               self.cycles >= self.rewind_cycles:
+                self.record_frame()
+            ticks -= self.cycles - start
         return 0
 
+    def emulate_due_components(self):
+        for index in range(len(self.components)):
+            if self.event_cycles[index] <= self.cycles:
+                self.synchronize(index, self.cycles)
+                self.schedule(index)
+
     def write(self, address, data):
-        receiver = self.get_receiver(address)
+        if self.dma_end >= 0 and address < 0xFF00 and self.is_dma_running():
+            return
+        page = address >> 8
+        memory = self.write_pages[page]
+        if memory is not None:
+            memory.set(self.write_offsets[page] + (address & 0xFF), data)
+            if self.cpu.code_map[address] != 0:
+                self.cpu.invalidate_code(address)
+        elif page == 0xFF:
+            self.write_io(address, data)
+        elif 0x80 <= page <= 0x9F:
+            self.video.write_vram(address, data)
+            if self.cpu.code_map[address] != 0:
+                self.cpu.invalidate_code(address)
+        elif page == 0xFE:
+            self.video.write_oam(address, data)
+        else:
+            receiver = self.page_receivers[page]
+            if receiver is None:
+                raise Exception("invalid write address given")
+            receiver.write(address, data)
+            if address <= 0x7FFF:
+                # writes to the ROM area are MBC bank switches
+                self.map_rom_bank()
+
+    def read(self, address):
+        if self.dma_end >= 0 and address < 0xFF00 and self.is_dma_running():
+            return 0xFF
+        page = address >> 8
+        if page <= 0x7F and self.rom_image is not None:
+            return ord(self.rom_image[self.read_offsets[page] + (address & 0xFF)])
+        memory = self.read_pages[page]
+        if memory is not None:
+            return memory.get(self.read_offsets[page] + (address & 0xFF))
+        elif page == 0xFF:
+            return self.read_io(address)
+        elif page == 0xFE:
+            return self.video.read_oam(address)
+        receiver = self.page_receivers[page]
         if receiver is None:
             raise Exception("invalid read address given")
-        receiver.write(address, data)
+        return receiver.read(address)
 
-    def read(self, address):
-        receiver = self.get_receiver(address)
+    def read_block(self, address, target, index, length):
+        # copies a block within one page into the byte buffer target, the
+        # source is resolved once instead of per byte
+        page = address >> 8
+        offset = self.read_offsets[page] + (address & 0xFF)
+        if page <= 0x7F and self.rom_image is not None:
+            for i in range(length):
+                target.set(index + i, ord(self.rom_image[offset + i]))
+            return
+        memory = self.read_pages[page]
+        if memory is not None:
+            target.copy_from(memory, offset, index, length)
+            return
+        if 0xA0 <= page <= 0xBF:
+            mbc = self.cartridge_manager.get_memory_bank()
+            offset = mbc.get_ram_offset(address)
+            if offset >= 0:
+                target.copy_from(mbc.ram, offset, index, length)
+                return
+        for i in range(length):
+            target.set(index + i, self.read(address + i))
+
+    def write_io(self, address, data):
+        if 0xFF80 <= address <= 0xFFFE:
+            self.ram.h_ram.set(address & 0x7F, data)
+            if self.cpu.code_map[address] != 0:
+                self.cpu.invalidate_code(address)
+            return
+        receiver = self.io_receivers[address & 0xFF]
+        if receiver is None:
+            raise Exception("invalid write address given")
+        component = self.io_components[address & 0xFF]
+        if component == -1:
+            receiver.write(address, data)
+        else:
+            # catch up the component before its registers are accessed
+            self.synchronize(component, self.get_current_cycles())
+            receiver.write(address, data)
+            self.reschedule(component)
+        if address == constants.DMA:
+            self.start_dma()
+
+    def read_io(self, address):
+        if 0xFF80 <= address <= 0xFFFE:
+            return self.ram.h_ram.get(address & 0x7F)
+        receiver = self.io_receivers[address & 0xFF]
         if receiver is None:
             raise Exception("invalid read address given")
+        component = self.io_components[address & 0xFF]
+        if component != -1:
+            self.synchronize(component, self.get_current_cycles())
         return receiver.read(address)
 
+    # MEMORY MAP ---------------------------------------------------------------
+
+    def create_memory_map(self):
+        # every 256 byte page is resolved once: either to a byte buffer plus
+        # offset accessed directly, or to the component handling the page.
+        # The shared ROM image is a read-only string and is read through
+        # rom_image with the offsets of the pages 0x00-0x7F.
+        # The OAM page 0xFE is partially unusable and goes to the video, the
+        # IO page 0xFF is resolved per register.
+        self.rom_image      = None
+        self.read_pages     = [None] * 256
+        self.read_offsets   = [0] * 256
+        self.write_pages    = [None] * 256
+        self.write_offsets  = [0] * 256
+        self.page_receivers = [None] * 256
+        self.io_receivers   = [None] * 256
+        for page in range(0, 0xFF):
+            self.page_receivers[page] = self.get_receiver(page << 8)
+        for index in range(0, 256):
+            self.io_receivers[index] = self.get_receiver(0xFF00 + index)
+        # C000-DFFF Work RAM, E000-FDFF Echo RAM
+        self.map_pages(0xC0, 0xDF, self.ram.w_ram, 0x0000)
+        self.map_pages(0xE0, 0xFD, self.ram.w_ram, 0x0000)
+        # 8000-9FFF Video RAM, writes go to the video for the tile cache
+        self.map_pages(0x80, 0x9F, self.video.vram, 0x0000, read_only=True)
+        self.map_rom()
+
+    def map_pages(self, first, last, memory, offset, read_only=False):
+        for page in range(first, last + 1):
+            self.read_pages[page] = memory
+            self.read_offsets[page] = offset + ((page - first) << 8)
+            if not read_only:
+                self.write_pages[page] = memory
+                self.write_offsets[page] = offset + ((page - first) << 8)
+
+    def map_rom_pages(self, first, last, offset):
+        for page in range(first, last + 1):
+            self.read_offsets[page] = offset + ((page - first) << 8)
+
+    def map_rom(self):
+        self.mapped_rom_bank = -1
+        mbc = self.cartridge_manager.get_memory_bank()
+        if mbc is None:
+            self.rom_image = None
+            return
+        # 0000-3FFF ROM Bank 0, writes go to the MBC
+        self.rom_image = mbc.rom
+        self.map_rom_pages(0x00, 0x3F, 0x0000)
+        self.map_rom_bank()
+
+    def map_rom_bank(self):
+        mbc = self.cartridge_manager.get_memory_bank()
+        if mbc.rom_bank == self.mapped_rom_bank:
+            return
+        # 4000-7FFF switchable ROM Bank
+        self.mapped_rom_bank = mbc.rom_bank
+        self.map_rom_pages(0x40, 0x7F, mbc.rom_bank)
+        self.cpu.set_rom_bank(mbc.rom_bank)
+
     def get_receiver(self, address):
         if 0x0000 <= address <= 0x7FFF:
             return self.cartridge_manager.get_memory_bank()
@@ -161,3 +521,20 @@ class GameBoy(object):
             self.video.write(0x9924 + tile, tile + 13)
 
         self.video.write(0x9905 + 12, 25)
+
+
+class ForkedGameBoy(GameBoy):
+    """
+    GameBoy created by fork, running on the cloned drivers of its parent.
+    """
+    def __init__(self, parent, joypad_driver, video_driver, sound_driver):
+        self.forked_joypad_driver = joypad_driver
+        self.forked_video_driver = video_driver
+        self.forked_sound_driver = sound_driver
+        GameBoy.__init__(self, parent)
+
+    def create_drivers(self):
+        self.clock = Clock()
+        self.joypad_driver = self.forked_joypad_driver
+        self.video_driver = self.forked_video_driver
+        self.sound_driver = self.forked_sound_driver
@@ -4,15 +4,22 @@ import time
 from pypy.lang.gameboy.gameboy import GameBoy
 from pypy.lang.gameboy.joypad import JoypadDriver
 from pypy.lang.gameboy.video import VideoDriver
-from pypy.lang.gameboy.sound import SoundDriver
+from pypy.lang.gameboy.sound import NullSoundDriver
+from pypy.lang.gameboy.scaledrow import ScaledRow
 from pypy.rlib.rsdl import RSDL, RSDL_helper
+from pypy.rpython.lltypesystem import lltype, rffi
+
+c_memcpy = rffi.llexternal('memcpy', [rffi.VOIDP, rffi.VOIDP, rffi.SIZE_T],
+                           lltype.Void)
 
 
 # GAMEBOY ----------------------------------------------------------------------
 
 class GameBoyImplementation(GameBoy):
     
-    def __init__(self):
+    def __init__(self, scale=1):
+        # create_drivers runs within GameBoy.__init__
+        self.scale = scale
         GameBoy.__init__(self)
         self.init_sdl()
         #self.mainLoop()
@@ -30,8 +37,9 @@ class GameBoyImplementation(GameBoy):
     def create_drivers(self):
         self.clock = Clock()
         self.joypad_driver = JoypadDriverImplementation()
-        self.video_driver  = VideoDriverImplementation()
-        self.sound_driver  = SoundDriverImplementation()
+        self.video_driver  = VideoDriverImplementation(self.scale)
+        # no audio output yet, the APU mixes nothing until there is one
+        self.sound_driver  = NullSoundDriver()
         
     def mainLoop(self):
         try:
@@ -40,30 +48,58 @@ class GameBoyImplementation(GameBoy):
                 self.emulate(5)
                 time.sleep(0.01)
         finally:
-            lltype.free(event, flavor='raw')
+            self.free()
         return 0
+
+    def free(self):
+        lltype.free(self.event, flavor='raw')
+        self.video_driver.free()
         
 # VIDEO DRIVER -----------------------------------------------------------------
 
 class VideoDriverImplementation(VideoDriver):
     
-    def __init__(self):
+    def __init__(self, scale=1):
         VideoDriver.__init__(self)
+        self.scale = scale
         self.map = []
+        # one scaled surface row, converted from the pixels and copied into
+        # the surface once per scaled line
+        self.row = ScaledRow(self.width, scale)
     
     def set_window_size(self):
-        self.screen = RSDL.SetVideoMode(self.width, self.height, 32, 0)
+        self.screen = RSDL.SetVideoMode(self.width * self.scale,
+                                        self.height * self.scale, 32, 0)
         
     def update_display(self):
-        RSDL.LockSurface(screen)
-        self.draw_pixels()
-        RSDL.UnlockSurface(screen)
-        RSDL.Flip(screen)
+        self.update_display_lines([(0, self.height)])
+
+    def update_display_lines(self, changed_lines):
+        if len(changed_lines) == 0:
+            return
+        RSDL.LockSurface(self.screen)
+        for first, last in changed_lines:
+            self.draw_lines(first, last)
+        RSDL.UnlockSurface(self.screen)
+        RSDL.Flip(self.screen)
         
     def draw_pixels(self):
-        for x in range(self.width):
-            for y in range(self.height):
-                RSDL_helper.set_pixel(screen, x, y, self.get_pixel_color(x, y))
+        self.draw_lines(0, self.height)
+
+    def draw_lines(self, first, last):
+        pitch = rffi.getintfield(self.screen, 'c_pitch')
+        surface = rffi.cast(lltype.Signed, self.screen.c_pixels)
+        source = rffi.cast(rffi.VOIDP, self.row.data)
+        size = rffi.cast(rffi.SIZE_T, self.row.size)
+        for y in range(first, last):
+            self.row.convert(self.pixels, y * self.width)
+            line = y * self.scale
+            for i in range(self.scale):
+                dest = rffi.cast(rffi.VOIDP, surface + (line + i) * pitch)
+                c_memcpy(dest, source, size)
+
+    def free(self):
+        self.row.free()
                 
     def get_pixel_color(self, x, y):
         return self.pixels[x+self.width*y]
@@ -134,31 +170,6 @@ class JoypadDriverImplementation(JoypadDriver):
         return None
         
         
-# SOUND DRIVER -----------------------------------------------------------------
-
-class SoundDriverImplementation(SoundDriver):
-    
-    def __init__(self):
-        SoundDriver.__init__(self)
-        self.create_sound_driver()
-        self.enabled = True
-        self.sampleRate = 44100
-        self.channelCount = 2
-        self.bitsPerSample = 8
-
-    def create_sound_driver(self):
-        pass
-    
-    def start(self):
-        pass
-        
-    def stop(self):
-        pass
-    
-    def write(self, buffer, length):
-        pass
-    
-    
 # ==============================================================================
 
 def entry_point(args=None):
@@ -57,6 +57,14 @@ class Interrupt(iMemory):
         for flag in self.interrupt_flags:
             flag.reset()
 
+    def save_state(self, state):
+        state.write_bool(self.enable)
+        state.write_int(self.get_interrupt_flag())
+
+    def load_state(self, state):
+        self.enable = state.read_bool()
+        self.set_fnterrupt_flag(state.read_int())
+
     def is_pending(self, mask=None):
         if not self.enable:
             return False
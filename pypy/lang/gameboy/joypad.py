@@ -22,6 +22,17 @@ class Joypad(iMemory):
         self.button_code = 0xF
         self.cycles = constants.JOYPAD_CLOCK
 
+    def save_state(self, state):
+        # the pressed buttons belong to the driver
+        state.write_int(self.joyp)
+        state.write_int(self.button_code)
+        state.write_int(self.cycles)
+
+    def load_state(self, state):
+        self.joyp        = state.read_int()
+        self.button_code = state.read_int()
+        self.cycles      = state.read_int()
+
     def get_cycles(self):
         return self.cycles
 
@@ -109,6 +120,30 @@ class JoypadDriver(object):
             code |= button.get_code()
         return code
     
+    def get_button_mask(self):
+        """
+        The pressed buttons in the high and the pressed directions in the
+        low nibble.
+        """
+        return (self.get_button_code() << 4) | self.get_direction_code()
+
+    def set_button_mask(self, mask):
+        if mask == self.get_button_mask():
+            return
+        for button in self.buttons:
+            button.pressed = ((mask >> 4) & button.code_value) != 0
+        for button in self.directions:
+            button.pressed = (mask & button.code_value) != 0
+        self.raised = True
+
+    def clone(self):
+        driver = JoypadDriver()
+        driver.raised = self.raised
+        for index in range(len(self.buttons)):
+            driver.buttons[index].pressed = self.buttons[index].pressed
+            driver.directions[index].pressed = self.directions[index].pressed
+        return driver
+
     def is_raised(self):
         raised = self.raised
         self.raised = False
@@ -0,0 +1,198 @@
+"""
+PyBoy GameBoy (TM) Emulator
+
+Input Movies
+
+A movie is the joypad input of a run, stored as the frames in which the
+pressed buttons change together with the new button mask (see
+JoypadDriver.get_button_mask). The input only changes at the start of a
+frame and a frame always ends at the first slice end after its last
+cycle, so replaying a movie on the same cartridge and start state repeats
+the run exactly. Neither recording nor replay depends on the wall clock,
+only the paced replay sleeps between the frames.
+
+The stream holds the magic, the version, the checksums of the cartridge,
+the save state the movie starts from, or nothing for a movie starting at
+power on, the frame count and the changes as pairs of the frames since
+the previous change and the new mask.
+"""
+
+import time
+from pypy.lang.gameboy import constants
+from pypy.lang.gameboy.savestate import StateWriter, StateReader, \
+                                        InvalidStateError
+
+MOVIE_MAGIC   = "GBMV"
+MOVIE_VERSION = 1
+
+# the frame time of a paced replay
+FRAME_TIME = float(constants.FRAME_TICKS) / constants.GAMEBOY_CLOCK
+
+
+class InputMovie(object):
+    """
+    The changes are (frame, mask) pairs sorted by frame.
+    """
+    def __init__(self, checksum=0, header_checksum=0, start_state=""):
+        self.checksum = checksum
+        self.header_checksum = header_checksum
+        self.start_state = start_state
+        self.frames = 0
+        self.changes = []
+
+    def is_power_on(self):
+        return self.start_state == ""
+
+    def add_change(self, frame, mask):
+        self.changes.append((frame, mask))
+
+    def get_data(self):
+        state = StateWriter(MOVIE_MAGIC, MOVIE_VERSION)
+        state.write_int(self.checksum)
+        state.write_int(self.header_checksum)
+        state.write_chars(self.start_state)
+        state.write_int(self.frames)
+        state.write_int(len(self.changes))
+        last = 0
+        for frame, mask in self.changes:
+            state.write_int(frame - last)
+            state.write_int(mask)
+            last = frame
+        return state.get_data()
+
+
+def load_movie(data):
+    """
+    Returns the InputMovie of data, raises an InvalidStateError for a
+    broken stream.
+    """
+    state = StateReader(data, MOVIE_MAGIC, MOVIE_VERSION)
+    movie = InputMovie(state.read_int(), state.read_int(), state.read_chars())
+    movie.frames = state.read_int()
+    frame = 0
+    for index in range(state.read_int()):
+        delta = state.read_int()
+        if delta < 0:
+            raise InvalidStateError("movie changes out of order")
+        frame += delta
+        movie.add_change(frame, state.read_int())
+    if frame > movie.frames:
+        raise InvalidStateError("movie change after the last frame")
+    state.check_finished()
+    return movie
+
+
+# ------------------------------------------------------------------------------
+
+class MovieRunner(object):
+    """
+    Emulates a GameBoy frame by frame, counting from the cycle it is
+    created at.
+    """
+    def __init__(self, gameboy):
+        self.gameboy = gameboy
+        self.start_cycles = gameboy.cycles
+        self.frame = 0
+
+    def emulate_frame(self):
+        end = self.start_cycles + (self.frame + 1) * constants.FRAME_TICKS
+        if end > self.gameboy.cycles:
+            self.gameboy.emulate(end - self.gameboy.cycles)
+        self.frame += 1
+
+
+class MovieRecorder(MovieRunner):
+    """
+    Records the input of source, a joypad driver fed by the front end.
+    The pressed buttons of source are copied to the joypad driver of the
+    GameBoy at the start of every frame. A GameBoy which has not run yet
+    starts the movie at power on, otherwise at its current state.
+    """
+    def __init__(self, gameboy, source):
+        assert source is not gameboy.joypad_driver
+        self.source = source
+        manager = gameboy.get_cartridge_manager()
+        start_state = ""
+        if gameboy.cycles != 0:
+            start_state = gameboy.save_state()
+        self.movie = InputMovie(manager.get_checksum(),
+                                manager.get_header_checksum(), start_state)
+        # a pending raise of the driver is not part of the movie
+        self.mask = gameboy.joypad_driver.get_button_mask()
+        gameboy.joypad_driver.is_raised()
+        if self.mask != 0:
+            self.movie.add_change(0, self.mask)
+        MovieRunner.__init__(self, gameboy)
+
+    def emulate_frame(self):
+        mask = self.source.get_button_mask()
+        if mask != self.mask:
+            self.movie.add_change(self.frame, mask)
+            self.mask = mask
+        self.gameboy.joypad_driver.set_button_mask(mask)
+        MovieRunner.emulate_frame(self)
+        self.movie.frames = self.frame
+
+    def emulate_frames(self, frames):
+        for index in range(frames):
+            self.emulate_frame()
+
+    def get_movie(self):
+        return self.movie
+
+
+class MoviePlayer(MovieRunner):
+    """
+    Replays a movie on a GameBoy with the cartridge of the movie. A power
+    on movie needs a GameBoy which has not run yet, any other one is
+    restored to the start state of the movie. The replay runs as fast as
+    possible, or paced to the frame rate of the GameBoy.
+    """
+    def __init__(self, gameboy, movie, paced=False):
+        manager = gameboy.get_cartridge_manager()
+        if manager.get_checksum() != movie.checksum or \
+           manager.get_header_checksum() != movie.header_checksum:
+            raise InvalidStateError("movie of another cartridge")
+        if movie.is_power_on():
+            if gameboy.cycles != 0:
+                raise InvalidStateError("power on movie on a running GameBoy")
+        else:
+            gameboy.load_state(movie.start_state)
+        self.movie = movie
+        self.paced = paced
+        self.change = 0
+        self.start_time = time.time()
+        # the buttons pressed when the recording started
+        mask = 0
+        if len(movie.changes) > 0 and movie.changes[0][0] == 0:
+            mask = movie.changes[0][1]
+        gameboy.joypad_driver.set_button_mask(mask)
+        gameboy.joypad_driver.is_raised()
+        MovieRunner.__init__(self, gameboy)
+
+    def is_finished(self):
+        return self.frame >= self.movie.frames
+
+    def emulate_frame(self):
+        changes = self.movie.changes
+        while self.change < len(changes) and \
+              changes[self.change][0] <= self.frame:
+            self.gameboy.joypad_driver.set_button_mask(changes[self.change][1])
+            self.change += 1
+        MovieRunner.emulate_frame(self)
+        if self.paced:
+            self.wait_frame()
+
+    def wait_frame(self):
+        delay = self.start_time + self.frame * FRAME_TIME - time.time()
+        if delay > 0.0:
+            time.sleep(delay)
+
+    def play(self):
+        """
+        Replays the rest of the movie, returns the number of frames.
+        """
+        start = self.frame
+        while not self.is_finished():
+            self.emulate_frame()
+        return self.frame - start
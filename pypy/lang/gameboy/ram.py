@@ -14,20 +14,162 @@ class iMemory(object):
      def read(self, address):
          return 0xFF
 
+     # timed components return the cycles until their next event, idle
+     # ones report a second
+     def get_cycles(self):
+         return constants.GAMEBOY_CLOCK
+
+     def emulate(self, ticks):
+         pass
+
+# ByteBuffer pages
+BUFFER_PAGE_BITS = 8
+BUFFER_PAGE_SIZE = 1 << BUFFER_PAGE_BITS
+BUFFER_PAGE_MASK = BUFFER_PAGE_SIZE - 1
+
+
+class ByteBuffer(object):
+    """
+    Memory primitive of the components, one char per byte in pages of 256
+    bytes. Translated, a page is a flat char array and ord a plain cast.
+    The stored values are masked on writes only. A forked buffer shares the
+    pages with its source until either of them writes a page, the whole
+    pages of a fill share one page the same way. The block operations work
+    page by page with slices.
+    """
+    def __init__(self, size, value=0):
+        self.size = size
+        count = (size + BUFFER_PAGE_SIZE - 1) >> BUFFER_PAGE_BITS
+        self.pages = [None] * count
+        self.owned = [False] * count
+        self.fill(value)
+
+    def get_page_size(self, page):
+        return min(BUFFER_PAGE_SIZE, self.size - (page << BUFFER_PAGE_BITS))
+
+    def get_size(self):
+        return self.size
+
+    def get(self, index):
+        return ord(self.pages[index >> BUFFER_PAGE_BITS]
+                             [index & BUFFER_PAGE_MASK])
+
+    def set(self, index, value):
+        page = index >> BUFFER_PAGE_BITS
+        if not self.owned[page]:
+            self.copy_page(page)
+        self.pages[page][index & BUFFER_PAGE_MASK] = chr(value & 0xFF)
+
+    def copy_page(self, page):
+        # the first write to a shared page
+        self.pages[page] = self.pages[page][:]
+        self.owned[page] = True
+
+    def get_chunk_length(self, index, end):
+        # the bytes from index to end within the page of index
+        page = index >> BUFFER_PAGE_BITS
+        return min(self.get_page_size(page) - (index & BUFFER_PAGE_MASK),
+                   end - index)
+
+    def write_chars(self, index, chars):
+        # chars lies within the page of index
+        page = index >> BUFFER_PAGE_BITS
+        offset = index & BUFFER_PAGE_MASK
+        if len(chars) == self.get_page_size(page):
+            self.pages[page] = chars
+            self.owned[page] = True
+            return
+        if not self.owned[page]:
+            self.copy_page(page)
+        self.pages[page][offset:offset + len(chars)] = chars
+
+    def read_chars(self, index, length):
+        chars = []
+        end = index + length
+        while index < end:
+            count = self.get_chunk_length(index, end)
+            offset = index & BUFFER_PAGE_MASK
+            chars += self.pages[index >> BUFFER_PAGE_BITS] \
+                               [offset:offset + count]
+            index += count
+        return chars
+
+    def fill(self, value, start=0, length=-1):
+        if length < 0:
+            length = self.size - start
+        char = chr(value & 0xFF)
+        chars = None
+        index = start
+        end = start + length
+        while index < end:
+            count = self.get_chunk_length(index, end)
+            if count == BUFFER_PAGE_SIZE:
+                if chars is None:
+                    chars = [char] * BUFFER_PAGE_SIZE
+                page = index >> BUFFER_PAGE_BITS
+                self.pages[page] = chars
+                self.owned[page] = False
+            else:
+                self.write_chars(index, [char] * count)
+            index += count
+
+    def copy_from(self, source, source_index, index, length):
+        # DMA and snapshot transfers between buffers
+        end = index + length
+        while index < end:
+            count = self.get_chunk_length(index, end)
+            self.write_chars(index, source.read_chars(source_index, count))
+            index += count
+            source_index += count
+
+    def to_string(self):
+        return "".join(["".join(page) for page in self.pages])
+
+    def load_string(self, string, index=0):
+        position = 0
+        end = index + len(string)
+        while index < end:
+            count = self.get_chunk_length(index, end)
+            self.write_chars(index, [char for char in
+                                     string[position:position + count]])
+            index += count
+            position += count
+
+    def share(self, source):
+        # takes the pages of the source buffer of the same size, both copy
+        # a page before writing it
+        assert source.size == self.size
+        self.pages = source.pages[:]
+        self.owned = [False] * len(self.pages)
+        source.owned = [False] * len(source.pages)
+
+    def fork(self):
+        buffer = ByteBuffer(0)
+        buffer.size = self.size
+        buffer.share(self)
+        return buffer
+
+
 class RAM(iMemory):
 
     def __init__(self):
         # Work RAM
-        self.w_ram =  [0]*8192
+        self.w_ram =  ByteBuffer(8192)
         # High RAM
-        self.h_ram =  [0]*128
+        self.h_ram =  ByteBuffer(128)
         self.reset()
 
     def reset(self):
-        # Work RAM
-        self.w_ram =  [0]*8192
-        # High RAM
-        self.h_ram =  [0]*128
+        self.w_ram.fill(0)
+        self.h_ram.fill(0)
+
+    def save_state(self, state):
+        state.write_buffer(self.w_ram)
+        state.write_buffer(self.h_ram)
+
+    def load_state(self, state):
+        state.read_buffer(self.w_ram)
+        state.read_buffer(self.h_ram)
 
     def write(self, address, data):
         address = int(address)
@@ -35,18 +177,18 @@ class RAM(iMemory):
         if address >= 0xC000 and address <= 0xFDFF:
             # C000-DFFF Work RAM (8KB)
             # E000-FDFF Echo RAM
-            self.w_ram[address & 0x1FFF] = data
+            self.w_ram.set(address & 0x1FFF, data)
         elif address >= 0xFF80 and address <= 0xFFFE:
             # FF80-FFFE High RAM
-            self.h_ram[address & 0x7F] = data
+            self.h_ram.set(address & 0x7F, data)
 
     def read(self, address):
         address = int(address)
         if address >= 0xC000 and address <= 0xFDFF:
             # C000-DFFF Work RAM
             # E000-FDFF Echo RAM
-            return self.w_ram[address & 0x1FFF] & 0xFF
+            return self.w_ram.get(address & 0x1FFF)
         elif address >= 0xFF80 and address <= 0xFFFE:
             # FF80-FFFE High RAM
-            return self.h_ram[address & 0x7F] & 0xFF
+            return self.h_ram.get(address & 0x7F)
         raise Exception("Invalid Memory access, address out of range")
\ No newline at end of file
@@ -0,0 +1,259 @@
+"""
+PyBoy GameBoy (TM) Emulator
+
+Rewind Buffer
+
+The states of the last frames are kept in memory. Every interval-th state
+is a keyframe holding the full byte buffers (work, high and video RAM, OAM
+and the cartridge RAM), the states in between hold the XOR of their
+buffers with the buffers of the keyframe, run length encoded in blocks.
+The other fields of a state are small and stored in full.
+"""
+
+from pypy.lang.gameboy.savestate import StateWriter, StateReader, \
+                                        InvalidStateError
+
+try:
+    from pypy.rlib import rzlib
+except ImportError:
+    rzlib = None
+
+# granularity of the unchanged runs of a delta
+DELTA_BLOCK_SIZE = 32
+
+
+class SnapshotWriter(StateWriter):
+    """
+    State writer keeping the byte buffers apart from the other fields.
+    """
+    def __init__(self):
+        StateWriter.__init__(self)
+        self.buffers = []
+
+    def write_buffer(self, buffer):
+        self.write_int(buffer.get_size())
+        self.buffers.append(buffer.to_string())
+
+
+class SnapshotReader(StateReader):
+
+    def __init__(self, data, buffers):
+        StateReader.__init__(self, data)
+        self.buffers = buffers
+        self.buffer_index = 0
+
+    def read_buffer(self, buffer):
+        length = self.read_int()
+        if self.buffer_index >= len(self.buffers) or \
+           length != buffer.get_size() or \
+           length != len(self.buffers[self.buffer_index]):
+            raise InvalidStateError("buffer size mismatch")
+        buffer.load_string(self.buffers[self.buffer_index])
+        self.buffer_index += 1
+
+
+# DELTAS -----------------------------------------------------------------------
+
+def append_count(chunks, count):
+    data = []
+    while count >= 0x80:
+        data.append(chr((count & 0x7F) | 0x80))
+        count >>= 7
+    data.append(chr(count))
+    chunks.append("".join(data))
+
+def read_count(data, index):
+    # returns the count and the index after it
+    count = 0
+    shift = 0
+    while True:
+        byte = ord(data[index])
+        index += 1
+        count |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return count, index
+
+def xor_string(data, base):
+    result = [chr(0)] * len(data)
+    for index in range(len(data)):
+        result[index] = chr(ord(data[index]) ^ ord(base[index]))
+    return "".join(result)
+
+def encode_delta(data, base):
+    # pairs of runs of unchanged and changed bytes, each run a multiple of
+    # DELTA_BLOCK_SIZE, the changed runs are followed by their XOR with base
+    chunks = []
+    length = len(data)
+    position = 0
+    while position < length:
+        start = position
+        while position < length and \
+              data[position:position + DELTA_BLOCK_SIZE] == \
+              base[position:position + DELTA_BLOCK_SIZE]:
+            position = min(position + DELTA_BLOCK_SIZE, length)
+        append_count(chunks, position - start)
+        start = position
+        while position < length and \
+              data[position:position + DELTA_BLOCK_SIZE] != \
+              base[position:position + DELTA_BLOCK_SIZE]:
+            position = min(position + DELTA_BLOCK_SIZE, length)
+        append_count(chunks, position - start)
+        chunks.append(xor_string(data[start:position], base[start:position]))
+    return "".join(chunks)
+
+def decode_delta(delta, base):
+    chunks = []
+    position = 0
+    index = 0
+    while index < len(delta):
+        count, index = read_count(delta, index)
+        chunks.append(base[position:position + count])
+        position += count
+        count, index = read_count(delta, index)
+        chunks.append(xor_string(delta[index:index + count],
+                                 base[position:position + count]))
+        index += count
+        position += count
+    return "".join(chunks)
+
+
+# COMPRESSION ------------------------------------------------------------------
+
+def compress_string(data):
+    stream = rzlib.deflateInit()
+    try:
+        result = rzlib.compress(stream, data)
+        result += rzlib.compress(stream, "", rzlib.Z_FINISH)
+    finally:
+        rzlib.deflateEnd(stream)
+    return result
+
+def decompress_string(data):
+    stream = rzlib.inflateInit()
+    try:
+        result, finished, unused = rzlib.decompress(stream, data,
+                                                    rzlib.Z_FINISH)
+    finally:
+        rzlib.inflateEnd(stream)
+    return result
+
+
+# ------------------------------------------------------------------------------
+
+class Snapshot(object):
+    """
+    The state of one frame. position counts the frames since the keyframe,
+    which is 0 for the keyframes themselves.
+    """
+    def __init__(self, data, buffers, keyframe, position):
+        self.data = data
+        self.buffers = buffers
+        self.keyframe = keyframe
+        self.position = position
+
+    def is_keyframe(self):
+        return self.position == 0
+
+    def get_size(self):
+        size = len(self.data)
+        for buffer in self.buffers:
+            size += len(buffer)
+        return size
+
+
+class Rewind(object):
+    """
+    Ring of the states of the last frames of a GameBoy. The oldest states
+    are dropped, a keyframe together with its deltas, when the states take
+    more than budget bytes. With compress the buffers are compressed with
+    zlib if it is available.
+    """
+    def __init__(self, gameboy, interval=30, budget=16 << 20,
+                 compress=False):
+        assert interval > 0
+        self.gameboy = gameboy
+        self.interval = interval
+        self.budget = budget
+        self.compress = compress and rzlib is not None
+        self.clear()
+
+    def clear(self):
+        self.snapshots = []
+        self.size = 0
+        # uncompressed buffers of the latest keyframe
+        self.key_buffers = []
+
+    def get_frame_count(self):
+        return len(self.snapshots)
+
+    def get_size(self):
+        return self.size
+
+    def record(self):
+        state = SnapshotWriter()
+        self.gameboy.write_state(state)
+        position = 0
+        keyframe = None
+        if len(self.snapshots) > 0:
+            last = self.snapshots[-1]
+            if last.position + 1 < self.interval:
+                position = last.position + 1
+                keyframe = last.keyframe
+        if keyframe is None:
+            self.key_buffers = state.buffers
+            buffers = state.buffers
+        else:
+            buffers = [encode_delta(state.buffers[index],
+                                    self.key_buffers[index])
+                       for index in range(len(state.buffers))]
+        if self.compress:
+            buffers = [compress_string(buffer) for buffer in buffers]
+        snapshot = Snapshot(state.get_data(), buffers, keyframe, position)
+        if keyframe is None:
+            snapshot.keyframe = snapshot
+        self.snapshots.append(snapshot)
+        self.size += snapshot.get_size()
+        self.drop_old_snapshots()
+
+    def drop_old_snapshots(self):
+        # the keyframe of the latest state is always kept
+        while self.size > self.budget and \
+              self.snapshots[0].keyframe is not self.snapshots[-1].keyframe:
+            count = 1
+            while not self.snapshots[count].is_keyframe():
+                count += 1
+            for index in range(count):
+                self.size -= self.snapshots[index].get_size()
+            del self.snapshots[:count]
+
+    def get_buffers(self, snapshot):
+        buffers = snapshot.buffers
+        if self.compress:
+            buffers = [decompress_string(buffer) for buffer in buffers]
+        return buffers
+
+    def rewind(self, frames):
+        """
+        Restores the state recorded frames frames before the latest one, or
+        the oldest one, and drops the newer states. Returns the number of
+        frames rewound, -1 without any states.
+        """
+        if len(self.snapshots) == 0:
+            return -1
+        index = max(len(self.snapshots) - 1 - frames, 0)
+        snapshot = self.snapshots[index]
+        key_buffers = self.get_buffers(snapshot.keyframe)
+        if snapshot.is_keyframe():
+            buffers = key_buffers
+        else:
+            deltas = self.get_buffers(snapshot)
+            buffers = [decode_delta(deltas[i], key_buffers[i])
+                       for i in range(len(deltas))]
+        self.gameboy.read_state(SnapshotReader(snapshot.data, buffers))
+        rewound = len(self.snapshots) - 1 - index
+        for dropped in self.snapshots[index + 1:]:
+            self.size -= dropped.get_size()
+        del self.snapshots[index + 1:]
+        self.key_buffers = key_buffers
+        return rewound
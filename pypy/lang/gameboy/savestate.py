@@ -0,0 +1,159 @@
+"""
+PyBoy GameBoy (TM) Emulator
+
+Save States
+
+A save state is the magic, the format version and the state of every
+component in a fixed order. Integers are stored as zigzag varints, so the
+format is the same for 32 and 64 bit builds, byte buffers are copied as
+one string. Other formats use the same encoding with their own magic and
+version.
+"""
+
+STATE_MAGIC   = "GBSS"
+STATE_VERSION = 1
+
+
+class InvalidStateError(Exception):
+    pass
+
+
+class StateWriter(object):
+
+    def __init__(self, magic=STATE_MAGIC, version=STATE_VERSION):
+        self.chunks = []
+        self.chunks.append(magic)
+        self.write_int(version)
+
+    def write_int(self, value):
+        # zigzag, the sign goes to the lowest bit
+        if value < 0:
+            value = ((-value) << 1) - 1
+        else:
+            value = value << 1
+        data = []
+        while value >= 0x80:
+            data.append(chr((value & 0x7F) | 0x80))
+            value >>= 7
+        data.append(chr(value))
+        self.chunks.append("".join(data))
+
+    def write_bool(self, value):
+        if value:
+            self.chunks.append("\x01")
+        else:
+            self.chunks.append("\x00")
+
+    def write_ints(self, values):
+        self.write_int(len(values))
+        for value in values:
+            self.write_int(value)
+
+    def write_buffer(self, buffer):
+        self.write_int(buffer.get_size())
+        self.chunks.append(buffer.to_string())
+
+    def write_chars(self, value):
+        self.write_int(len(value))
+        self.chunks.append(value)
+
+    def get_data(self):
+        return "".join(self.chunks)
+
+
+class ForkWriter(StateWriter):
+    """
+    State writer keeping the byte buffers themselves, which the ForkReader
+    shares with the buffers of the fork.
+    """
+    def __init__(self):
+        StateWriter.__init__(self)
+        self.buffers = []
+
+    def write_buffer(self, buffer):
+        self.write_int(buffer.get_size())
+        self.buffers.append(buffer)
+
+
+class StateReader(object):
+
+    def __init__(self, data, magic=STATE_MAGIC, version=STATE_VERSION):
+        self.data = data
+        self.position = 0
+        if self.read_string(len(magic)) != magic:
+            raise InvalidStateError("not a %s file" % magic)
+        stored_version = self.read_int()
+        if stored_version != version:
+            raise InvalidStateError("unsupported %s version %d" % (magic,
+                                    stored_version))
+
+    def read_char(self):
+        if self.position >= len(self.data):
+            raise InvalidStateError("truncated save state")
+        char = self.data[self.position]
+        self.position += 1
+        return char
+
+    def read_string(self, length):
+        start = self.position
+        end = start + length
+        if end > len(self.data):
+            raise InvalidStateError("truncated save state")
+        self.position = end
+        return self.data[start:end]
+
+    def read_int(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = ord(self.read_char())
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        if value & 0x01:
+            return -((value + 1) >> 1)
+        return value >> 1
+
+    def read_bool(self):
+        return self.read_char() != "\x00"
+
+    def read_ints(self, values):
+        # fills the list values, which has the stored length
+        if self.read_int() != len(values):
+            raise InvalidStateError("list size mismatch")
+        for index in range(len(values)):
+            values[index] = self.read_int()
+
+    def read_buffer(self, buffer):
+        length = self.read_int()
+        if length != buffer.get_size():
+            raise InvalidStateError("buffer size mismatch")
+        buffer.load_string(self.read_string(length))
+
+    def read_chars(self):
+        length = self.read_int()
+        if length < 0:
+            raise InvalidStateError("negative string length")
+        return self.read_string(length)
+
+    def check_finished(self):
+        if self.position != len(self.data):
+            raise InvalidStateError("trailing data in save state")
+
+
+class ForkReader(StateReader):
+
+    def __init__(self, data, buffers):
+        StateReader.__init__(self, data)
+        self.buffers = buffers
+        self.buffer_index = 0
+
+    def read_buffer(self, buffer):
+        length = self.read_int()
+        if self.buffer_index >= len(self.buffers) or \
+           length != buffer.get_size() or \
+           length != self.buffers[self.buffer_index].get_size():
+            raise InvalidStateError("buffer size mismatch")
+        buffer.share(self.buffers[self.buffer_index])
+        self.buffer_index += 1
@@ -0,0 +1,41 @@
+"""
+PyBoy GameBoy (TM) Emulator
+
+Scaled Surface Rows
+"""
+
+from pypy.rpython.lltypesystem import lltype, rffi
+
+
+class ScaledRow(object):
+    """
+    One surface row of 32 bit pixels in raw memory, every pixel of a video
+    line repeated scale times. The front end converts a line once and
+    copies the row into each of the scale surface lines of the video line.
+    The row has to be freed.
+    """
+    def __init__(self, width, scale):
+        assert 1 <= scale <= 4
+        self.width = width
+        self.scale = scale
+        self.length = width * scale
+        self.size = self.length * 4
+        self.data = lltype.malloc(rffi.UINTP.TO, self.length, flavor='raw')
+
+    def convert(self, pixels, offset):
+        # the pixels of the line starting at offset
+        scale = self.scale
+        index = 0
+        for x in range(self.width):
+            color = rffi.cast(rffi.UINT, pixels[offset + x])
+            for i in range(scale):
+                self.data[index + i] = color
+            index += scale
+
+    def get(self, index):
+        return rffi.cast(lltype.Signed, self.data[index])
+
+    def free(self):
+        if self.data:
+            lltype.free(self.data, flavor='raw')
+            self.data = lltype.nullptr(rffi.UINTP.TO)
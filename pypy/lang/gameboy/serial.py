@@ -12,6 +12,8 @@ class Serial(iMemory):
     def __init__(self, interrupt):
         assert isinstance(interrupt, Interrupt)
         self.interrupt = interrupt
+        # the bytes sent, only kept after record_transfers
+        self.transfers = None
         self.reset()
 
     def reset(self):
@@ -19,7 +21,19 @@ class Serial(iMemory):
         self.sb = 0x00
         self.sc = 0x00
 
+    def save_state(self, state):
+        state.write_int(self.cycles)
+        state.write_int(self.sb)
+        state.write_int(self.sc)
+
+    def load_state(self, state):
+        self.cycles = state.read_int()
+        self.sb     = state.read_int()
+        self.sc     = state.read_int()
+
     def get_cycles(self):
+        if (self.sc & 0x81) != 0x81:
+            return constants.GAMEBOY_CLOCK
         return self.cycles
 
     def emulate(self, ticks):
@@ -36,8 +50,18 @@ class Serial(iMemory):
     def set_serial_data(self, data):
         self.sb = data
 
+    def record_transfers(self):
+        self.transfers = []
+
+    def get_transfers(self):
+        if self.transfers is None:
+            return ""
+        return "".join(self.transfers)
+
     def set_serial_control(self, data):
         self.sc = data
+        if self.transfers is not None and (data & 0x81) == 0x81:
+            self.transfers.append(chr(self.sb))
         # HACK: delay the serial interrupt (Shin Nihon Pro Wrestling)
         self.cycles = constants.SERIAL_IDLE_CLOCK + constants.SERIAL_CLOCK
 
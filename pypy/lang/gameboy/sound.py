@@ -7,6 +7,51 @@ Audio Processor Unit (Sharp LR35902 APU)
 from pypy.lang.gameboy import constants
 from pypy.lang.gameboy.ram import iMemory
 
+
+def create_duty_table():
+    # the 4 square wave duty cycles 12.5%, 25%, 50% and 75% as 32 steps
+    # of -1 (low) and +1 (high)
+    table = [0] * (4 * 32)
+    lengths = [0x04, 0x08, 0x10, 0x18]
+    for duty in range(0, 4):
+        for step in range(0, 32):
+            if step >= lengths[duty]:
+                table[(duty << 5) + step] = 1
+            else:
+                table[(duty << 5) + step] = -1
+    return table
+
+DUTY_TABLE = create_duty_table()
+
+
+def get_output_volume(output_terminal, left_bit, right_bit, volume):
+    # amplitude of a channel on the left and the right output terminal,
+    # packed as left << 8 + right
+    left = 0
+    right = 0
+    if (output_terminal & left_bit) != 0:
+        left = volume
+    if (output_terminal & right_bit) != 0:
+        right = volume
+    return (left << 8) + right
+
+
+def mix_square_wave(buffer, start, count, index, frequency, duty, volume):
+    # mixes count stereo samples of a square wave into the ring buffer,
+    # returns the new wave index
+    mask = len(buffer) - 1
+    left = volume >> 8
+    right = volume & 0xFF
+    position = start
+    for i in range(0, count):
+        index += frequency
+        sample = DUTY_TABLE[duty + ((index >> 22) & 0x1F)]
+        buffer[position] += sample * left
+        buffer[position + 1] += sample * right
+        position = (position + 2) & mask
+    return index & 0x7FFFFFF
+
+
 class Channel(object):
 
     audio_index = 0
@@ -29,8 +74,6 @@ class Channel(object):
         self.audio_length    = 0
         self.audio_frequency = 0
         self.enabled         = False
-        #XXX need to push this up into the Sound class
-        self.output_enable  = False
         
     def reset(self):
         self.audio_index = 0
@@ -63,6 +106,23 @@ class Channel1(Channel):
         self.audio_1_envelope_length = 0
         self.sample_sweep_length     = 0
         self.audio_1_frequency       = 0
+
+    def save_state(self, state):
+        # the counters, the registers are stored by the sound
+        state.write_int(self.audio_1_index)
+        state.write_int(self.audio_1_length)
+        state.write_int(self.audio_volume)
+        state.write_int(self.audio_1_envelope_length)
+        state.write_int(self.sample_sweep_length)
+        state.write_int(self.audio_1_frequency)
+
+    def load_state(self, state):
+        self.audio_1_index           = state.read_int()
+        self.audio_1_length          = state.read_int()
+        self.audio_volume            = state.read_int()
+        self.audio_1_envelope_length = state.read_int()
+        self.sample_sweep_length     = state.read_int()
+        self.audio_1_frequency       = state.read_int()
     
      # Audio Channel 1
     def get_audio_sweep(self):
@@ -155,34 +215,23 @@ class Channel1(Channel):
                                      ((frequency >> 8) & 0x07)
             else:
                 self.audio_1_frequency = 0
-                self.output_enable &= ~0x01
+                self.enabled = False
         self.sample_sweep_length += (constants.SOUND_CLOCK / 128) * \
                                  ((self.sample_sweep >> 4) & 0x07)
                                          
-    def mix_audio(self, buffer, length, output_terminal):
-        wave_pattern = self.get_current_wave_pattern()
-        for index in range(0, length, 3):
-            self.audio_1_index += self.audio_1_frequency
-            if (self.audio_1_index & (0x1F << 22)) >= wave_pattern:
-                if (output_terminal & 0x10) != 0:
-                    buffer[index + 0] -= self.audio_volume
-                if (output_terminal & 0x01) != 0:
-                    buffer[index + 1] -= self.audio_volume
-            else:
-                if (output_terminal & 0x10) != 0:
-                    buffer[index + 0] += self.audio_volume
-                if (output_terminal & 0x01) != 0:
-                    buffer[index + 1] += self.audio_volume
-                    
-    def get_current_wave_pattern(self):
-        wave_pattern = 0x18
-        if (self.audio_length & 0xC0) == 0x00:
-            wave_pattern = 0x04
-        elif (self.audio_length & 0xC0) == 0x40:
-            wave_pattern = 0x08
-        elif (self.audio_length & 0xC0) == 0x80:
-            wave_pattern = 0x10
-        return wave_pattern << 22
+    def mix_audio(self, buffer, start, count, output_terminal):
+        volume = get_output_volume(output_terminal, 0x10, 0x01,
+                                   self.audio_volume)
+        if volume == 0 or self.audio_1_frequency == 0:
+            self.audio_1_index = (self.audio_1_index + \
+                                  self.audio_1_frequency * count) & 0x7FFFFFF
+            return
+        self.audio_1_index = mix_square_wave(buffer, start, count,
+                                    self.audio_1_index, self.audio_1_frequency,
+                                    self.get_duty_offset(), volume)
+
+    def get_duty_offset(self):
+        return ((self.audio_length >> 6) & 0x03) << 5
         
                     
     
@@ -197,6 +246,20 @@ class Channel2(Channel):
         self.audio_volume            = 0
         self.audio_2_envelope_length = 0
         self.audio_2_frequency       = 0
+
+    def save_state(self, state):
+        state.write_int(self.audio_2_index)
+        state.write_int(self.audio_2_length)
+        state.write_int(self.audio_volume)
+        state.write_int(self.audio_2_envelope_length)
+        state.write_int(self.audio_2_frequency)
+
+    def load_state(self, state):
+        self.audio_2_index           = state.read_int()
+        self.audio_2_length          = state.read_int()
+        self.audio_volume            = state.read_int()
+        self.audio_2_envelope_length = state.read_int()
+        self.audio_2_frequency       = state.read_int()
       
     # Audio Channel 2
     def set_audio_length(self, data):
@@ -257,30 +320,19 @@ class Channel2(Channel):
         self.audio_2_envelope_length += (constants.SOUND_CLOCK / 64) *\
                                      (self.audio_envelope & 0x07)
         
-    def mix_audio(self, buffer, length, output_terminal):
-        wave_pattern = self.get_current_wave_pattern()
-        for index in range(0, length):
-            self.audio_2_index += self.audio_2_frequency
-            if (self.audio_2_index & (0x1F << 22)) >= wave_pattern:
-                if (output_terminal & 0x20) != 0:
-                    buffer[index + 0] -= self.audio_volume
-                if (output_terminal & 0x02) != 0:
-                    buffer[index + 1] -= self.audio_volume
-            else:
-                if (output_terminal & 0x20) != 0:
-                    buffer[index + 0] += self.audio_volume
-                if (output_terminal & 0x02) != 0:
-                    buffer[index + 1] += self.audio_volume
-
-    def get_current_wave_pattern(self):
-        wave_pattern = 0x18
-        if (self.audio_length & 0xC0) == 0x00:
-            wave_pattern = 0x04
-        elif (self.audio_length & 0xC0) == 0x40:
-            wave_pattern = 0x08
-        elif (self.audio_length & 0xC0) == 0x80:
-            wave_pattern = 0x10
-        return wave_pattern << 22
+    def mix_audio(self, buffer, start, count, output_terminal):
+        volume = get_output_volume(output_terminal, 0x20, 0x02,
+                                   self.audio_volume)
+        if volume == 0 or self.audio_2_frequency == 0:
+            self.audio_2_index = (self.audio_2_index + \
+                                  self.audio_2_frequency * count) & 0x7FFFFFF
+            return
+        self.audio_2_index = mix_square_wave(buffer, start, count,
+                                    self.audio_2_index, self.audio_2_frequency,
+                                    self.get_duty_offset(), volume)
+
+    def get_duty_offset(self):
+        return ((self.audio_length >> 6) & 0x03) << 5
 
     
     
@@ -295,6 +347,18 @@ class Channel3(Channel):
         self.audio_3_length     = 0
         self.audio_3_frequency  = 0
         self.audio_wave_pattern = [0]*16
+        # the 32 4 bit samples of the wave pattern, centered around 0
+        self.audio_wave_samples = [-16]*32
+
+    def save_state(self, state):
+        state.write_int(self.audio_3_index)
+        state.write_int(self.audio_3_length)
+        state.write_int(self.audio_3_frequency)
+
+    def load_state(self, state):
+        self.audio_3_index     = state.read_int()
+        self.audio_3_length    = state.read_int()
+        self.audio_3_frequency = state.read_int()
     
     def get_audio_enable(self):
         return self.audio_enable
@@ -302,10 +366,6 @@ class Channel3(Channel):
     def get_audio_level(self):
         return self.audio_level
     
-    #FIXME strange number here
-    def get_audio_4_frequency(self):
-        return self.audio_frequency
-
     def set_audio_enable(self, data):
         self.audio_enable = data & 0x80
         if (self.audio_enable & 0x80) == 0:
@@ -336,6 +396,9 @@ class Channel3(Channel):
     
     def set_audio_wave_pattern(self, address, data):
         self.audio_wave_pattern[address & 0x0F] = data
+        index = (address & 0x0F) << 1
+        self.audio_wave_samples[index] = (((data >> 4) & 0x0F) - 8) << 1
+        self.audio_wave_samples[index + 1] = ((data & 0x0F) - 8) << 1
 
     def get_audio_wave_pattern(self, address):
         return self.audio_wave_pattern[address & 0x0F] & 0xFF
@@ -344,34 +407,57 @@ class Channel3(Channel):
         if (self.audio_playback & 0x40) != 0 and self.audio_3_length > 0:
             self.audio_3_length-=1
             if self.audio_3_length <= 0:
-                self.output_enable &= ~0x04
-
-    def mix_audio(self, buffer, length, output_terminal):
-        wave_pattern = self.get_current_wave_pattern()
-        for index in range(0, length, 2):
-            self.audio_3_index += self.audio_3_frequency
-            sample = self.audio_wave_pattern[(self.audio_3_index >> 23) & 0x0F]
-            if ((self.audio_3_index & (1 << 22)) != 0):
-                sample = (sample >> 0) & 0x0F
-            else:
-                sample = (sample >> 4) & 0x0F
-            sample = int(((sample - 8) << 1) >> self.audio_level)
-            if (output_terminal & 0x40) != 0:
-                buffer[index + 0] += sample
-            if (output_terminal & 0x04) != 0:
-                buffer[index + 1] += sample
+                self.enabled = False
+
+    def mix_audio(self, buffer, start, count, output_terminal):
+        shift = self.get_volume_shift()
+        volume = get_output_volume(output_terminal, 0x40, 0x04, 1)
+        frequency = self.audio_3_frequency
+        index = self.audio_3_index
+        if shift < 0 or volume == 0 or frequency == 0:
+            self.audio_3_index = (index + frequency * count) & 0x7FFFFFF
+            return
+        mask = len(buffer) - 1
+        left = volume >> 8
+        right = volume & 0xFF
+        position = start
+        for i in range(0, count):
+            index += frequency
+            sample = self.audio_wave_samples[(index >> 22) & 0x1F] >> shift
+            buffer[position] += sample * left
+            buffer[position + 1] += sample * right
+            position = (position + 2) & mask
+        self.audio_3_index = index & 0x7FFFFFF
     
-    def get_current_wave_pattern(self):
-        wave_pattern = 2
-        if (self.audio_level & 0x60) == 0x00:
-            wave_pattern = 8
-        elif (self.audio_level & 0x60) == 0x40:
-            wave_pattern = 0
-        elif (self.audio_level & 0x60) == 0x80:
-            wave_pattern = 1
-        return wave_pattern
+    def get_volume_shift(self):
+        # -1 for a muted channel
+        level = self.audio_level & 0x60
+        if level == 0x00:
+            return -1
+        elif level == 0x20:
+            return 0
+        elif level == 0x40:
+            return 1
+        return 2
             
     
+def create_noise_table(bits):
+    # the output bits of the polynomial counter of the given width, 32 steps
+    # per entry
+    steps = (1 << bits) - 1
+    table = [0] * ((steps + 31) >> 5)
+    polynomial = steps
+    for index in range(0, steps):
+        polynomial = (((polynomial << (bits - 1)) ^ \
+                       (polynomial << (bits - 2))) & (1 << (bits - 1))) | \
+                     (polynomial >> 1)
+        table[index >> 5] |= (polynomial & 1) << (index & 31)
+    return table
+
+NOISE_STEP_7_TABLE  = create_noise_table(7)
+NOISE_STEP_15_TABLE = create_noise_table(15)
+
+
 class NoiseGenerator(Channel):
         
     def __init__(self, sample_rate, frequency_table):
@@ -386,49 +472,40 @@ class NoiseGenerator(Channel):
         self.audio_4_frequency       = 0
         self.generate_noise_frequency_ratio_table()
         self.generate_noise_tables()
+
+    def save_state(self, state):
+        state.write_int(self.audio_4_index)
+        state.write_int(self.audio_4_length)
+        state.write_int(self.audio_volume)
+        state.write_int(self.audio_4_envelope_length)
+        state.write_int(self.audio_4_frequency)
+
+    def load_state(self, state):
+        self.audio_4_index           = state.read_int()
+        self.audio_4_length          = state.read_int()
+        self.audio_volume            = state.read_int()
+        self.audio_4_envelope_length = state.read_int()
+        self.audio_4_frequency       = state.read_int()
     
     def generate_noise_frequency_ratio_table(self):
          # Polynomial Noise Frequency Ratios
          # 4194304 Hz * 1 / 2^3 * 2 4194304 Hz * 1 / 2^3 * 1 4194304 Hz * 1 / 2^3 *
          # 1 / 2 4194304 Hz * 1 / 2^3 * 1 / 3 4194304 Hz * 1 / 2^3 * 1 / 4 4194304 Hz *
          # 1 / 2^3 * 1 / 5 4194304 Hz * 1 / 2^3 * 1 / 6 4194304 Hz * 1 / 2^3 * 1 / 7
+         # The table holds the noise index step per sample, the index
+         # advances one polynomial step per 1 << 16.
         self.noiseFreqRatioTable = [0] * 8
-        sampleFactor = ((1 << 16) / self.sample_rate)
         for ratio in range(0, 8):
             divider = 1
             if ratio != 0:
                 divider = 2 * ratio
-            self.noiseFreqRatioTable[ratio] = (constants.GAMEBOY_CLOCK / \
-                                             divider) *sampleFactor
+            self.noiseFreqRatioTable[ratio] = ((constants.GAMEBOY_CLOCK / \
+                                        divider) << 16) / self.sample_rate
 
     def generate_noise_tables(self):
-        self.create_7_step_noise_table()
-        self.create_15_step_noise_table()
-        
-    def create_7_step_noise_table(self):
-         # Noise Tables
-        self. noise_step_7_table = [0]*4
-        polynomial = 0x7F
-        #  7 steps
-        for  index in range(0, 0x7F):
-            polynomial = (((polynomial << 6) ^ (polynomial << 5)) & 0x40) | \
-                         (polynomial >> 1)
-            if (index & 31) == 0:
-                self.noise_step_7_table[index >> 5] = 0
-            self.noise_step_7_table[index >> 5] |= (polynomial & 1) << \
-                                                (index & 31)
-            
-    def create_15_step_noise_table(self):
-        #  15 steps&
-        self.noise_step_15_table = [0]*1024
-        polynomial = 0x7FFF
-        for index in range(0, 0x7FFF):
-            polynomial = (((polynomial << 14) ^ (polynomial << 13)) & \
-                         0x4000) | (polynomial >> 1)
-            if (index & 31) == 0:
-                self.noise_step_15_table[index >> 5] = 0
-            self.noise_step_15_table[index >> 5] |= (polynomial & 1) << \
-                                                 (index & 31)
+        # the tables are the same for every channel
+        self.noise_step_7_table  = NOISE_STEP_7_TABLE
+        self.noise_step_15_table = NOISE_STEP_15_TABLE
     
      # Audio Channel 4
     def get_audio_length(self):
@@ -486,7 +563,7 @@ class NoiseGenerator(Channel):
         if (self.audio_playback & 0x40) != 0 and self.audio_4_length > 0:
             self.audio_4_length-=1
             if self.audio_4_length <= 0:
-                self.output_enable &= ~0x08
+                self.enabled = False
         
     def update_envelope_and_volume(self):
         if self.audio_4_envelope_length <= 0:
@@ -502,46 +579,72 @@ class NoiseGenerator(Channel):
         self.audio_4_envelope_length += (constants.SOUND_CLOCK / 64) *\
                                      (self.audio_envelope & 0x07)
                                          
-    def mix_audio(self, buffer, length, output_terminal):
-        for index in range(0, length, 2):
-            self.audio_4_index += self.audio_4_frequency
-            #polynomial
-            if (self.audio_polynomial & 0x08) != 0:
-                #  7 steps
-                self.audio_4_index &= 0x7FFFFF
-                polynomial = self.noise_step_7_table[self.audio_4_index >> 21] >>\
-                             ((self.audio_4_index >> 16) & 31)
-            else:
-                #  15 steps
-                self.audio_4_index &= 0x7FFFFFFF
-                polynomial = self.noise_step_15_table[self.audio_4_index >> 21] >> \
-                             ((self.audio_4_index >> 16) & 31)
+    def mix_audio(self, buffer, start, count, output_terminal):
+        volume = get_output_volume(output_terminal, 0x80, 0x08,
+                                   self.audio_volume)
+        frequency = self.audio_4_frequency
+        if volume == 0 or frequency == 0:
+            self.audio_4_index = (self.audio_4_index + frequency * count) & \
+                                 0x7FFFFFFF
+            return
+        if (self.audio_polynomial & 0x08) != 0:
+            #  7 steps
+            table = self.noise_step_7_table
+            index_mask = 0x7FFFFF
+        else:
+            #  15 steps
+            table = self.noise_step_15_table
+            index_mask = 0x7FFFFFFF
+        mask = len(buffer) - 1
+        left = volume >> 8
+        right = volume & 0xFF
+        index = self.audio_4_index & index_mask
+        position = start
+        for i in range(0, count):
+            index = (index + frequency) & index_mask
+            polynomial = table[index >> 21] >> ((index >> 16) & 31)
             if (polynomial & 1) != 0:
-                if (output_terminal & 0x80) != 0:
-                    buffer[index + 0] -= self.audio_volume
-                if (output_terminal & 0x08) != 0:
-                    buffer[index + 1] -= self.audio_volume
+                buffer[position] -= left
+                buffer[position + 1] -= right
             else:
-                if (output_terminal & 0x80) != 0:
-                    buffer[index + 0] += self.audio_volume
-                if (output_terminal & 0x08) != 0:
-                    buffer[index + 1] += self.audio_volume
+                buffer[position] += left
+                buffer[position + 1] += right
+            position = (position + 2) & mask
+        self.audio_4_index = index
 
     
     
 # ------------------------------------------------------------------------------
 
+# the frequency tables per sample rate, shared by all channels
+FREQUENCY_TABLES = {}
+
+def get_frequency_table(sample_rate):
+    table = FREQUENCY_TABLES.get(sample_rate, None)
+    if table is not None:
+        return table
+    table = [0] * 2048
+    # frequency = (4194304 / 32) / (2048 - period) Hz
+    for period in range(0, 2048):
+        # wave index step per sample, 32 << 22 per wave
+        skip = ((constants.GAMEBOY_CLOCK << 24) / sample_rate) / \
+               (2048 - period)
+        if skip < (32 << 22):
+            table[period] = skip
+    FREQUENCY_TABLES[sample_rate] = table
+    return table
+
         
 class Sound(iMemory):
 
     def __init__(self, sound_driver):
-        self.buffer          = [0] * 512
         self.outputLevel     = 0
         self.output_terminal = 0
         self.output_enable   = 0
         
         self.driver          = sound_driver
         self.sample_rate     =  self.driver.get_sample_rate()
+        self.ring            = self.driver.get_ring()
         
         self.generate_frequency_table()
         self.create_audio_channels()
@@ -556,15 +659,7 @@ class Sound(iMemory):
         
         
     def generate_frequency_table(self):
-        self.frequency_table = [0] * 2048
-         # frequency = (4194304 / 32) / (2048 - period) Hz
-        for period in range(0, 2048):
-            skip = (((constants.GAMEBOY_CLOCK << 10) / \
-                   self.sample_rate) << 16) / (2048 - period)
-            if skip >= (32 << 22):
-                self.frequency_table[period] = 0
-            else:
-                self.frequency_table[period] = skip
+        self.frequency_table = get_frequency_table(self.sample_rate)
 
     def reset(self):
         self.cycles = int(constants.GAMEBOY_CLOCK / constants.SOUND_CLOCK)
@@ -621,151 +716,131 @@ class Sound(iMemory):
         return self.cycles
 
     def emulate(self, ticks):
+        # the samples are mixed in blocks up to the next update of the
+        # channel lengths, envelopes and sweep or up to a register access
         ticks        = int(ticks)
-        self.cycles -= ticks
-        while (self.cycles <= 0):
-            self.update_audio()
-            if self.driver.is_enabled():
-                self.mix_down_audio()
-            self.cycles += constants.GAMEBOY_CLOCK / constants.SOUND_CLOCK
+        while ticks > 0:
+            block = min(ticks, self.cycles)
+            self.mix_down_audio(block)
+            self.cycles -= block
+            ticks -= block
+            if self.cycles <= 0:
+                self.update_audio()
+                self.cycles += constants.GAMEBOY_CLOCK / constants.SOUND_CLOCK
             
-    def mix_down_audio(self):
-        self.frames += self.driver.get_sample_rate()
-        length      = (self.frames / constants.SOUND_CLOCK) << 1
-        self.mix_audio(self.buffer, length)
-        self.driver.write(self.buffer, length)
-        self.frames %= constants.SOUND_CLOCK
+    def mix_down_audio(self, ticks):
+        # frames holds the fraction of a sample left from the last block
+        self.frames += ticks * self.sample_rate
+        count        = self.frames / constants.GAMEBOY_CLOCK
+        self.frames %= constants.GAMEBOY_CLOCK
+        if count == 0 or not self.driver.is_enabled():
+            return
+        ring   = self.ring
+        length = count << 1
+        if ring.get_free() < length:
+            # the sink does not keep up, drop the block
+            ring.overruns += 1
+            return
+        start = ring.write_position & ring.mask
+        for index in range(0, length):
+            ring.buffer[(start + index) & ring.mask] = 0
+        self.mix_audio(ring.buffer, start, count)
+        ring.commit(length)
+        self.driver.update()
         
     def read(self, address):
-        address = int(address)
-        if address==constants.NR10:
-            return self.channel1.get_audio_sweep()
-        elif address == constants.NR11:
-            return self.channel1.get_audio_length()
-        elif address == constants.NR12:
-            return self.channel1.get_audio_envelope()
-        elif address == constants.NR13:
-            return self.channel1.get_audio_frequency()
-        elif address == constants.NR14:
-            return self.channel1.get_audio_playback()
-
-        elif address == constants.NR21:
-            return self.channel2.get_audio_length()
-        elif address == constants.NR22:
-            return self.channel2.get_audio_envelope()
-        elif address==constants.NR23:
-            return self.channel2.get_audio_frequency()
-        elif address==constants.NR24:
-            return self.channel2.get_audio_playback()
-
-        elif address==constants.NR30:
-            return self.channel3.get_audio_enable()
-        elif address==constants.NR31:
-            return self.channel3.get_audio_length()
-        elif address==constants.NR32:
-            return self.channel3.get_audio_level()
-        elif address==constants.NR33:
-            return self.channel4.get_audio_frequency()
-        elif address==constants.NR34:
-            return self.channel3.get_audio_playback()
-
-        elif address==constants.NR41:
-            return self.channel4.get_audio_length()
-        elif address==constants.NR42:
-            return self.channel4.get_audio_envelope()
-        elif address==constants.NR43:
-            return self.channel4.get_audio_polynomial()
-        elif address==constants.NR44:
-            return self.channel4.get_audio_playback()
-
-        elif address==constants.NR50:
-            return self.get_output_level()
-        elif address==constants.NR51:
-            return self.get_output_terminal()
-        elif address==constants.NR52:
-            return self.get_output_enable()
-
-        elif address >= constants.AUD3WAVERAM and \
-             address <= constants.AUD3WAVERAM + 0x3F:
-            return self.channel3.get_audio_wave_pattern(address)
-        return 0xFF
+        index = int(address) - constants.NR10
+        if index < 0 or index >= constants.SOUND_REGISTER_COUNT:
+            return 0xFF
+        return SOUND_REGISTER_READERS[index](self, address) | \
+               SOUND_REGISTER_READ_MASKS[index]
 
     def write(self, address, data):
-        address = int(address)
-        if address==constants.NR10:
-            self.channel1.set_audio_sweep(data)
-        elif address == constants.NR11:
-            self.channel1.set_audio_length(data)
-        elif address == constants.NR12:
-            self.channel1.set_audio_envelope(data)
-        elif address == constants.NR13:
-            self.channel1.set_audio_frequency(data)
-        elif address == constants.NR14:
-            self.channel1.set_audio_playback(data)
-        
-        elif address == constants.NR21:
-            self.channel2.set_audio_length(data)
-        elif address == constants.NR22:
-            self.channel2.set_audio_envelope(data)
-        elif address == constants.NR23:
-            self.channel2.set_audio_frequency(data)
-        elif address == constants.NR24:
-            self.channel2.set_audio_playback(data)
-        
-        elif address == constants.NR30:
-            self.channel3.set_audio_enable(data)
-        elif address == constants.NR31:
-            self.channel3.set_audio_length(data)
-        elif address == constants.NR32:
-            self.channel3.set_audio_level(data)
-        elif address == constants.NR33:
-            self.channel3.set_audio_frequency(data)
-        elif address == constants.NR34:
-            self.channel3.set_audio_playback(data)
-        
-        elif address == constants.NR41:
-            self.channel4.set_audio_length(data)
-        elif address == constants.NR42:
-            self.channel4.set_audio_envelope(data)
-        elif address == constants.NR43:
-            self.channel4.set_audio_polynomial(data)
-        elif address == constants.NR44:
-            self.channel4.set_audio_playback(data)
-        
-        elif address == constants.NR50:
-            self.set_output_level(data)
-        elif address == constants.NR51:
-            self.set_output_terminal(data)
-        elif address == constants.NR52:
-            self.set_output_enable(data)
-        
-        elif address >= constants.AUD3WAVERAM and \
-             address <= constants.AUD3WAVERAM + 0x3F:
-            self.channel3.set_audio_wave_pattern(address, data)
+        index = int(address) - constants.NR10
+        if index < 0 or index >= constants.SOUND_REGISTER_COUNT:
+            return
+        SOUND_REGISTER_WRITERS[index](self, address, data)
+
+    def get_registers(self):
+        # the stored values of FF10-FF3F, without the read masks
+        registers = [0] * constants.SOUND_REGISTER_COUNT
+        for index in range(0, constants.SOUND_REGISTER_COUNT):
+            registers[index] = SOUND_REGISTER_READERS[index](self,
+                                                    constants.NR10 + index)
+        return registers
+
+    def set_registers(self, registers):
+        # restores the registers of get_registers without triggering the
+        # channels, which are enabled as given by NR52
+        self.write(constants.NR52, registers[constants.NR52 - constants.NR10])
+        for index in range(0, constants.SOUND_REGISTER_COUNT):
+            address = constants.NR10 + index
+            data = registers[index]
+            if address == constants.NR52:
+                continue
+            if address == constants.NR14 or address == constants.NR24 or \
+               address == constants.NR34 or address == constants.NR44:
+                data &= 0x7F
+            self.write(address, data)
+        # the stored playback registers keep their trigger bit
+        self.channel1.audio_playback = registers[constants.NR14 - \
+                                                 constants.NR10]
+        self.channel2.audio_playback = registers[constants.NR24 - \
+                                                 constants.NR10]
+        self.channel3.audio_playback = registers[constants.NR34 - \
+                                                 constants.NR10]
+        self.channel4.audio_playback = registers[constants.NR44 - \
+                                                 constants.NR10]
+        enable = registers[constants.NR52 - constants.NR10]
+        self.channel1.enabled = (enable & 0x01) != 0
+        self.channel2.enabled = (enable & 0x02) != 0
+        self.channel3.enabled = (enable & 0x04) != 0
+        self.channel4.enabled = (enable & 0x08) != 0
+
+    def save_state(self, state):
+        state.write_int(self.cycles)
+        state.write_int(self.frames)
+        state.write_ints(self.get_registers())
+        self.channel1.save_state(state)
+        self.channel2.save_state(state)
+        self.channel3.save_state(state)
+        self.channel4.save_state(state)
+
+    def load_state(self, state):
+        self.cycles = state.read_int()
+        self.frames = state.read_int()
+        registers = [0] * constants.SOUND_REGISTER_COUNT
+        state.read_ints(registers)
+        self.set_registers(registers)
+        # the register writes reload the counters
+        self.channel1.load_state(state)
+        self.channel2.load_state(state)
+        self.channel3.load_state(state)
+        self.channel4.load_state(state)
 
     def update_audio(self):
         if (self.output_enable & 0x80) == 0:
             return
-        if (self.output_enable & 0x01) != 0:
+        if self.channel1.enabled:
             self.channel1.update_audio()
-        if (self.output_enable & 0x02) != 0:
+        if self.channel2.enabled:
             self.channel2.update_audio()
-        if (self.output_enable & 0x04) != 0:
+        if self.channel3.enabled:
             self.channel3.update_audio()
-        if (self.output_enable & 0x08) != 0:
+        if self.channel4.enabled:
             self.channel4.update_audio()
 
-    def mix_audio(self, buffer, length):
+    def mix_audio(self, buffer, start, count):
         if (self.output_enable & 0x80) == 0:
             return
-        if (self.output_enable & 0x01) != 0:
-            self.channel1.mix_audio(buffer, length, self.output_terminal)
-        if (self.output_enable & 0x02) != 0:
-            self.channel2.mix_audio(buffer, length, self.output_terminal)
-        if (self.output_enable & 0x04) != 0:
-            self.channel3.mix_audio(buffer, length, self.output_terminal)
-        if (self.output_enable & 0x08) != 0:
-            self.channel4.mix_audio(buffer, length, self.output_terminal)
+        if self.channel1.enabled:
+            self.channel1.mix_audio(buffer, start, count, self.output_terminal)
+        if self.channel2.enabled:
+            self.channel2.mix_audio(buffer, start, count, self.output_terminal)
+        if self.channel3.enabled:
+            self.channel3.mix_audio(buffer, start, count, self.output_terminal)
+        if self.channel4.enabled:
+            self.channel4.mix_audio(buffer, start, count, self.output_terminal)
 
      # Output Control
     def get_output_level(self):
@@ -775,7 +850,16 @@ class Sound(iMemory):
         return self.output_terminal
 
     def get_output_enable(self):
-        return self.output_enable
+        enable = self.output_enable & 0x80
+        if self.channel1.enabled:
+            enable |= 0x01
+        if self.channel2.enabled:
+            enable |= 0x02
+        if self.channel3.enabled:
+            enable |= 0x04
+        if self.channel4.enabled:
+            enable |= 0x08
+        return enable
 
     def set_output_level(self, data):
         self.outputLevel = data
@@ -784,9 +868,91 @@ class Sound(iMemory):
         self.output_terminal = data
 
     def set_output_enable(self, data):
-        self.output_enable = (self.output_enable & 0x7F) | (data & 0x80)
+        self.output_enable = data & 0x80
         if (self.output_enable & 0x80) == 0x00:
-            self.output_enable &= 0xF0
+            self.channel1.enabled = False
+            self.channel2.enabled = False
+            self.channel3.enabled = False
+            self.channel4.enabled = False
+
+
+# SOUND REGISTER TABLE ---------------------------------------------------------
+
+def read_unused(sound, address):
+    return 0xFF
+
+def write_unused(sound, address, data):
+    pass
+
+def read_wave_pattern(sound, address):
+    return sound.channel3.get_audio_wave_pattern(address)
+
+def write_wave_pattern(sound, address, data):
+    sound.channel3.set_audio_wave_pattern(address, data)
+
+# (address, reader, writer, read mask), the bits of the read mask read as 1
+SOUND_REGISTERS = [
+    (constants.NR10, lambda s, a: s.channel1.get_audio_sweep(),
+                     lambda s, a, d: s.channel1.set_audio_sweep(d), 0x80),
+    (constants.NR11, lambda s, a: s.channel1.get_audio_length(),
+                     lambda s, a, d: s.channel1.set_audio_length(d), 0x3F),
+    (constants.NR12, lambda s, a: s.channel1.get_audio_envelope(),
+                     lambda s, a, d: s.channel1.set_audio_envelope(d), 0x00),
+    (constants.NR13, lambda s, a: s.channel1.get_audio_frequency(),
+                     lambda s, a, d: s.channel1.set_audio_frequency(d), 0xFF),
+    (constants.NR14, lambda s, a: s.channel1.get_audio_playback(),
+                     lambda s, a, d: s.channel1.set_audio_playback(d), 0xBF),
+    (constants.NR21, lambda s, a: s.channel2.get_audio_length(),
+                     lambda s, a, d: s.channel2.set_audio_length(d), 0x3F),
+    (constants.NR22, lambda s, a: s.channel2.get_audio_envelope(),
+                     lambda s, a, d: s.channel2.set_audio_envelope(d), 0x00),
+    (constants.NR23, lambda s, a: s.channel2.get_audio_frequency(),
+                     lambda s, a, d: s.channel2.set_audio_frequency(d), 0xFF),
+    (constants.NR24, lambda s, a: s.channel2.get_audio_playback(),
+                     lambda s, a, d: s.channel2.set_audio_playback(d), 0xBF),
+    (constants.NR30, lambda s, a: s.channel3.get_audio_enable(),
+                     lambda s, a, d: s.channel3.set_audio_enable(d), 0x7F),
+    (constants.NR31, lambda s, a: s.channel3.get_audio_length(),
+                     lambda s, a, d: s.channel3.set_audio_length(d), 0xFF),
+    (constants.NR32, lambda s, a: s.channel3.get_audio_level(),
+                     lambda s, a, d: s.channel3.set_audio_level(d), 0x9F),
+    (constants.NR33, lambda s, a: s.channel3.get_audio_frequency(),
+                     lambda s, a, d: s.channel3.set_audio_frequency(d), 0xFF),
+    (constants.NR34, lambda s, a: s.channel3.get_audio_playback(),
+                     lambda s, a, d: s.channel3.set_audio_playback(d), 0xBF),
+    (constants.NR41, lambda s, a: s.channel4.get_audio_length(),
+                     lambda s, a, d: s.channel4.set_audio_length(d), 0xFF),
+    (constants.NR42, lambda s, a: s.channel4.get_audio_envelope(),
+                     lambda s, a, d: s.channel4.set_audio_envelope(d), 0x00),
+    (constants.NR43, lambda s, a: s.channel4.get_audio_polynomial(),
+                     lambda s, a, d: s.channel4.set_audio_polynomial(d), 0x00),
+    (constants.NR44, lambda s, a: s.channel4.get_audio_playback(),
+                     lambda s, a, d: s.channel4.set_audio_playback(d), 0xBF),
+    (constants.NR50, lambda s, a: s.get_output_level(),
+                     lambda s, a, d: s.set_output_level(d), 0x00),
+    (constants.NR51, lambda s, a: s.get_output_terminal(),
+                     lambda s, a, d: s.set_output_terminal(d), 0x00),
+    (constants.NR52, lambda s, a: s.get_output_enable(),
+                     lambda s, a, d: s.set_output_enable(d), 0x70),
+]
+
+def create_sound_register_tables():
+    readers = [read_unused] * constants.SOUND_REGISTER_COUNT
+    writers = [write_unused] * constants.SOUND_REGISTER_COUNT
+    masks = [0xFF] * constants.SOUND_REGISTER_COUNT
+    for index in range(constants.AUD3WAVERAM - constants.NR10,
+                       constants.SOUND_REGISTER_COUNT):
+        readers[index] = read_wave_pattern
+        writers[index] = write_wave_pattern
+        masks[index] = 0x00
+    for address, reader, writer, mask in SOUND_REGISTERS:
+        readers[address - constants.NR10] = reader
+        writers[address - constants.NR10] = writer
+        masks[address - constants.NR10] = mask
+    return readers, writers, masks
+
+SOUND_REGISTER_READERS, SOUND_REGISTER_WRITERS, SOUND_REGISTER_READ_MASKS = \
+    create_sound_register_tables()
 
 
 class BogusSound(iMemory):
@@ -796,14 +962,11 @@ class BogusSound(iMemory):
     def __init__(self):
         pass
     
-    def get_cycles(self):
-        return 
-    
     def reset(self):
         pass
     
     def get_cycles(self):
-        return 0xFF
+        return constants.GAMEBOY_CLOCK
     
     def emulate(self, ticks):
         pass
@@ -811,14 +974,76 @@ class BogusSound(iMemory):
     
 # SOUND DRIVER -----------------------------------------------------------------
 
+class SoundRing(object):
+    """
+    Ring buffer of interleaved left and right samples between the APU and
+    the sound driver. The APU is the only writer and only moves
+    write_position, the driver only moves read_position. Both run on the
+    emulation thread, a sink feeding an audio device from another thread
+    has to copy the samples out on this one. The positions count samples
+    and are masked on access.
+    """
+    def __init__(self, size):
+        assert size > 0 and (size & (size - 1)) == 0
+        self.buffer         = [0] * size
+        self.mask           = size - 1
+        self.write_position = 0
+        self.read_position  = 0
+        self.overruns       = 0
+
+    def get_size(self):
+        return len(self.buffer)
+
+    def get_available(self):
+        return self.write_position - self.read_position
+
+    def get_free(self):
+        return len(self.buffer) - self.get_available()
+
+    def commit(self, length):
+        self.write_position += length
+
+    def read(self, target, length):
+        # copies up to length samples into target, returns their number
+        length = min(length, self.get_available())
+        position = self.read_position
+        for index in range(0, length):
+            target[index] = self.buffer[(position + index) & self.mask]
+        self.read_position = position + length
+        return length
+
+    def skip(self, length):
+        self.read_position += min(length, self.get_available())
+
+
+def get_ring_size(sample_rate, latency):
+    # samples for latency milliseconds of stereo sound, at least two blocks
+    # of a SOUND_CLOCK tick, rounded up to a power of 2
+    samples = max(sample_rate * latency / 1000,
+                  2 * sample_rate / constants.SOUND_CLOCK + 2) << 1
+    size = 1
+    while size < samples:
+        size <<= 1
+    return size
+
 
 class SoundDriver(object):
-    
-    def __init__(self):
+    """
+    The sink of the mixed samples. update is called after every block
+    written to the ring, the base driver drops the samples. Sinks read the
+    ring with read_samples, which decimates to the output rate, and
+    convert them with encode_samples.
+    """
+    def __init__(self, sample_rate=44100, latency=100, bits_per_sample=8):
+        assert bits_per_sample == 8 or bits_per_sample == 16
         self.enabled = True
-        self.sample_rate = 44100
+        self.sample_rate = sample_rate
         self.channel_count = 2
-        self.bits_per_sample = 8
+        self.bits_per_sample = bits_per_sample
+        self.latency = latency
+        self.ring = SoundRing(get_ring_size(sample_rate, latency))
+        self.samples = [0] * self.ring.get_size()
+        self.set_output_rate(sample_rate)
     
     def is_enabled(self):
         return self.enabled
@@ -831,6 +1056,18 @@ class SoundDriver(object):
     
     def get_bits_per_sample(self):
         return self.bits_per_sample
+
+    def get_ring(self):
+        return self.ring
+
+    def get_output_rate(self):
+        return self.output_rate
+
+    def set_output_rate(self, output_rate):
+        # downsampling by an integer factor, e.g. when the emulation runs
+        # faster than real time
+        self.decimation = max(self.sample_rate / output_rate, 1)
+        self.output_rate = self.sample_rate / self.decimation
     
     def start(self):
         pass
@@ -838,5 +1075,87 @@ class SoundDriver(object):
     def stop(self):
         pass
     
-    def write(self, buffer, length):
+    def clone(self):
+        # the mixing advances the channels, forks mix with the same rate
+        # but drop the samples
+        return SoundDriver(self.sample_rate, self.latency,
+                           self.bits_per_sample)
+
+    def update(self):
+        self.ring.skip(self.ring.get_available())
+
+    def read_samples(self, length):
+        # reads up to length samples of the output rate into self.samples,
+        # returns their number
+        factor = self.decimation
+        length = self.ring.read(self.samples, (length / 2) * factor * 2)
+        if factor == 1:
+            return length
+        # average factor stereo samples into one
+        count = 0
+        for index in range(0, length - (factor << 1) + 1, factor << 1):
+            left = 0
+            right = 0
+            for offset in range(0, factor << 1, 2):
+                left += self.samples[index + offset]
+                right += self.samples[index + offset + 1]
+            self.samples[count] = left / factor
+            self.samples[count + 1] = right / factor
+            count += 2
+        return count
+
+    def encode_samples(self, length):
+        # the first length samples of self.samples in the sample format,
+        # 8 bit unsigned or 16 bit signed little endian. The mixed samples
+        # of the 4 channels are within -64..63.
+        if self.bits_per_sample == 8:
+            data = ["\x00"] * length
+            for index in range(0, length):
+                sample = self.samples[index] * 2 + 128
+                data[index] = chr(max(0, min(255, sample)))
+        else:
+            data = ["\x00"] * (length * 2)
+            for index in range(0, length):
+                sample = max(-32768, min(32767, self.samples[index] * 512))
+                data[index * 2] = chr(sample & 0xFF)
+                data[index * 2 + 1] = chr((sample >> 8) & 0xFF)
+        return "".join(data)
+
+
+class PullSoundDriver(SoundDriver):
+    """
+    Keeps the samples in the ring until the front end pulls them with
+    read_audio, the ring holds latency milliseconds of sound.
+    """
+    def __init__(self, sample_rate=44100, latency=100, bits_per_sample=8):
+        SoundDriver.__init__(self, sample_rate, latency, bits_per_sample)
+        self.underruns = 0
+
+    def update(self):
         pass
+
+    def read_audio(self, length):
+        # length bytes in the sample format, padded with silence when the
+        # ring runs dry
+        bytes_per_sample = self.bits_per_sample / 8
+        data = self.encode_samples(self.read_samples(length /
+                                                     bytes_per_sample))
+        if len(data) < length:
+            self.underruns += 1
+            silence = "\x80"
+            if bytes_per_sample == 2:
+                silence = "\x00"
+            data += silence * (length - len(data))
+        return data
+
+
+class NullSoundDriver(SoundDriver):
+    """
+    Mixes no samples at all.
+    """
+    def __init__(self, sample_rate=44100):
+        SoundDriver.__init__(self, sample_rate)
+        self.enabled = False
+
+    def clone(self):
+        return NullSoundDriver(self.sample_rate)
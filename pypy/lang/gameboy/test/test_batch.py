@@ -0,0 +1,111 @@
+import py
+from pypy.lang.gameboy.batch import *
+from pypy.lang.gameboy import constants
+from pypy.tool.udir import udir
+
+ROM_PATH = str(py.magic.autopath().dirpath().dirpath())+"/rom"
+
+
+def get_runner(instances=2):
+    return BatchRunner(ROM_PATH+"/rom4/rom4.gb", instances)
+
+def test_init():
+    runner = get_runner()
+    assert len(runner.gameboys) == 2
+    assert runner.gameboys[0].cpu.rom is runner.gameboys[1].cpu.rom
+    assert runner.get_frames() == 0
+    assert runner.get_instructions() == 0
+
+def test_emulate_frames():
+    runner = get_runner()
+    runner.emulate_frames(3)
+    assert runner.cycles == 3 * constants.FRAME_TICKS
+    assert runner.get_frames() == 6
+    assert runner.get_instructions() > 0
+    assert runner.time > 0.0
+    assert "6 frames" in runner.get_report()
+
+def test_digest():
+    runner = get_runner()
+    runner.emulate(1000)
+    digest = runner.gameboys[0].get_digest()
+    assert len(digest) == 32
+    assert digest == runner.gameboys[1].get_digest()
+    runner.gameboys[1].cpu.registers[0] += 1
+    assert digest != runner.gameboys[1].get_digest()
+
+def test_write_digests():
+    runner = get_runner()
+    runner.emulate(100)
+    path = udir.join("gameboy_batch_digests")
+    runner.write_digests(str(path))
+    lines = path.read().splitlines()
+    assert lines == [gameboy.get_digest() for gameboy in runner.gameboys]
+
+def test_frame_hash():
+    gameboy = BatchGameBoy()
+    hash = gameboy.get_frame_hash()
+    gameboy.video_driver.get_pixels()[100] = constants.COLOR_MAP[1]
+    assert gameboy.get_frame_hash() != hash
+
+def test_video_discard():
+    gameboy = BatchGameBoy(HeadlessVideoDriver(VIDEO_DISCARD))
+    gameboy.load_cartridge_file(ROM_PATH+"/rom3/rom3.gb")
+    pixels = gameboy.video_driver.get_pixels()
+    gameboy.emulate(3 * constants.FRAME_TICKS)
+    assert not gameboy.video.display
+    assert gameboy.video.get_changed_lines() == []
+    assert gameboy.video_driver.get_pixels() is pixels
+
+def test_video_hash_interval():
+    runner = BatchRunner(ROM_PATH+"/rom3/rom3.gb", 1, VIDEO_HASH, 3)
+    runner.emulate_frames(8)
+    driver = runner.gameboys[0].video_driver
+    assert [frame for frame, hash in driver.frame_hashes] == [0, 3, 6]
+    assert driver.frame_hashes[-1][1] == driver.get_frame_hash()
+
+def test_video_dump_ppm():
+    path = udir.join("gameboy_frame_%d.ppm")
+    driver = HeadlessVideoDriver(VIDEO_DUMP, 2, str(path))
+    gameboy = BatchGameBoy(driver)
+    gameboy.load_cartridge_file(ROM_PATH+"/rom3/rom3.gb")
+    gameboy.emulate(3 * constants.FRAME_TICKS)
+    data = udir.join("gameboy_frame_2.ppm").read()
+    assert data.startswith("P6\n160 144\n255\n")
+    assert len(data) == len("P6\n160 144\n255\n") + 160 * 144 * 3
+    assert not udir.join("gameboy_frame_1.ppm").check()
+
+def test_video_dump_raw():
+    path = udir.join("gameboy_frames.raw")
+    driver = HeadlessVideoDriver(VIDEO_DUMP, 1, str(path), DUMP_RAW)
+    driver.get_pixels()[0] = 0x123456
+    driver.update_display_lines([])
+    driver.update_display_lines([(0, 1)])
+    data = path.read()
+    assert len(data) == 2 * 160 * 144 * 3
+    assert data[:3] == "\x12\x34\x56"
+
+def test_wave_sound_driver():
+    path = udir.join("gameboy_sound.wav")
+    driver = WaveSoundDriver(str(path), 44100, 16, 11025)
+    gameboy = BatchGameBoy(sound_driver=driver)
+    gameboy.load_cartridge_file(ROM_PATH+"/rom3/rom3.gb")
+    gameboy.emulate(constants.GAMEBOY_CLOCK / 4)
+    driver.stop()
+    data = path.read()
+    assert data[:4] == "RIFF" and data[8:16] == "WAVEfmt "
+    assert data[24:28] == pack_int(11025, 4)
+    # a quarter of a second of 16 bit stereo samples
+    assert abs(driver.data_size - 11025) < 64 * 4
+    assert data[40:44] == pack_int(driver.data_size, 4)
+    assert len(data) == 44 + driver.data_size
+
+def test_dot_accurate_runner():
+    runners = [BatchRunner(ROM_PATH+"/rom3/rom3.gb", 1, VIDEO_HASH, 1,
+                           dot_accurate) for dot_accurate in (False, True)]
+    assert runners[1].gameboys[0].video.is_dot_accurate()
+    for runner in runners:
+        runner.emulate_frames(3)
+    # without writes during the transfer both modes draw the same frames
+    assert runners[0].gameboys[0].video_driver.frame_hashes == \
+           runners[1].gameboys[0].video_driver.frame_hashes
@@ -101,4 +101,55 @@ def test_cartridge_remove_write_read_Battery():
     
     
     
-    
\ No newline at end of file
+        
+    
+def test_cartridge_rom_cache():
+    cache = RomCache()
+    romFilePath = ROM_PATH + "/rom1/rom1.raw"
+    cartridge1 = get_cartridge()
+    cartridge1.load(romFilePath, cache)
+    cartridge2 = get_cartridge()
+    cartridge2.load(romFilePath, cache)
+    assert cache.read(romFilePath) is cache.read(romFilePath)
+    assert cartridge1.read() == open(romFilePath, "rb").read()
+    # the read-only image is shared by all loads of the path
+    assert cartridge1.read() is cartridge2.read()
+    assert cartridge1.read() is cache.read(romFilePath)
+
+def test_cartridge_default_rom_cache():
+    romFilePath = ROM_PATH + "/rom1/rom1.raw"
+    cartridge1 = Cartridge(romFilePath)
+    cartridge2 = Cartridge(romFilePath)
+    assert cartridge1.read() is cartridge2.read()
+    assert ROM_CACHE.contains(romFilePath)
+
+def test_rom_cache_change():
+    from pypy.tool.udir import udir
+    path = str(udir.join("gameboy_rom_cache.gb"))
+    open(path, "wb").write("abcd")
+    os.utime(path, (1000.25, 1000.25))
+    cache = RomCache()
+    assert cache.read(path) == "abcd"
+    # rewritten within the same second
+    open(path, "wb").write("efgh")
+    os.utime(path, (1000.5, 1000.5))
+    assert cache.read(path) == "efgh"
+    open(path, "wb").write("ijklm")
+    os.utime(path, (1000.5, 1000.5))
+    assert cache.read(path) == "ijklm"
+
+def test_rom_cache_size():
+    cache = RomCache(2)
+    paths = [ROM_PATH + "/rom%d/rom%d.gb" % (index, index)
+             for index in (3, 4, 5)]
+    for path in paths:
+        cache.read(path)
+    assert not cache.contains(paths[0])
+    assert cache.contains(paths[1])
+    # reading an entry keeps it
+    cache.read(paths[1])
+    cache.read(paths[0])
+    assert cache.contains(paths[1])
+    assert not cache.contains(paths[2])
+    cache.clear()
+    assert not cache.contains(paths[1])
@@ -0,0 +1,118 @@
+import py
+import os
+import signal
+from pypy.lang.gameboy.farm import *
+from pypy.lang.gameboy.savestate import StateWriter, StateReader
+from pypy.lang.gameboy import constants
+
+ROM_PATH = str(py.magic.autopath().dirpath().dirpath())+"/rom"
+
+
+def get_jobs():
+    return [FarmJob(ROM_PATH+"/rom3/rom3.gb", 2 * constants.FRAME_TICKS),
+            FarmJob(ROM_PATH+"/rom4/rom4.gb", 1000),
+            FarmJob(ROM_PATH+"/rom6/rom6.gb", 3 * constants.FRAME_TICKS,
+                    [(1, 0x81), (2, 0x00)]),
+            FarmJob(ROM_PATH+"/rom3/rom3.gb", 2 * constants.FRAME_TICKS),
+            FarmJob(ROM_PATH+"/missing.gb", 1000)]
+
+def get_fields(result):
+    return (result.index, result.error, result.registers, result.flags,
+            result.stack_pointer, result.program_counter, result.frame_hash,
+            result.serial, result.cycles, result.instructions)
+
+def test_job_state():
+    job = FarmJob("rom.gb", 1234, [(1, 0x10), (5, 0x00)])
+    state = StateWriter()
+    job.save_state(state)
+    copy = FarmJob("", 0)
+    copy.load_state(StateReader(state.get_data()))
+    assert copy.path == "rom.gb"
+    assert copy.cycles == 1234
+    assert copy.script == [(1, 0x10), (5, 0x00)]
+
+def test_result_state():
+    result = FarmResult(3, 1)
+    result.registers[2] = 0x12
+    result.frame_hash = 0xFFFFFFFF
+    result.serial = "Passed\n"
+    result.time = 12345
+    state = StateWriter()
+    result.save_state(state)
+    copy = FarmResult()
+    copy.load_state(StateReader(state.get_data()))
+    assert get_fields(copy) == get_fields(result)
+    assert copy.worker == 1
+    assert copy.time == 12345
+
+def test_run_in_process():
+    farm = Farm()
+    jobs = get_jobs()
+    results = farm.run(jobs)
+    assert len(results) == 5
+    for result in results[:4]:
+        assert not result.is_failed()
+        assert result.instructions > 0
+    assert results[0].cycles >= 2 * constants.FRAME_TICKS
+    assert results[1].program_counter != 0
+    assert results[4].is_failed()
+    # the same ROM gives the same result on a fork of the same GameBoy
+    assert get_fields(results[3])[1:] == get_fields(results[0])[1:]
+    report = farm.get_report(jobs, results)
+    assert "5 jobs, 1 failed" in report
+    assert "FAILED" in report
+
+def test_run_workers():
+    jobs = get_jobs()
+    expected = Farm().run(jobs)
+    farm = Farm(2)
+    try:
+        results = farm.run(jobs)
+        assert farm.is_started()
+        assert [get_fields(result) for result in results] == \
+               [get_fields(result) for result in expected]
+        # the pool is reused
+        results = farm.run(jobs[:2])
+        assert len(results) == 2
+        assert get_fields(results[1]) == get_fields(expected[1])
+    finally:
+        farm.stop()
+    assert not farm.is_started()
+
+def test_script():
+    path = ROM_PATH+"/rom6/rom6.gb"
+    worker = FarmWorker(0)
+    plain = worker.run_job(0, FarmJob(path, 3 * constants.FRAME_TICKS))
+    result = worker.run_job(0, FarmJob(path, 3 * constants.FRAME_TICKS,
+                                       [(1, 0x81), (2, 0x00)]))
+    assert not result.is_failed()
+    assert result.cycles == plain.cycles
+
+def test_dead_worker():
+    jobs = get_jobs()
+    farm = Farm(2)
+    try:
+        farm.start()
+        os.kill(farm.pids[0], signal.SIGKILL)
+        results = farm.run(jobs)
+        assert not farm.is_alive(0)
+        assert farm.is_alive(1)
+        assert results[0].is_failed()
+        assert results[0].error == "worker 0 died"
+        # the other worker runs the remaining jobs
+        assert [result.worker for result in results[1:]] == [1] * 4
+        assert not results[1].is_failed()
+        assert results[4].is_failed()
+    finally:
+        farm.stop()
+
+def test_all_workers_dead():
+    farm = Farm(2)
+    try:
+        farm.start()
+        for pid in farm.pids:
+            os.kill(pid, signal.SIGKILL)
+        py.test.raises(FarmError, farm.run, get_jobs())
+    finally:
+        farm.stop()
+    assert not farm.is_started()
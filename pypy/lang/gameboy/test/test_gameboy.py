@@ -11,4 +11,309 @@ def get_gameboy():
 
 
 def test_init():
-    gameboy = get_gameboy()
\ No newline at end of file
+    gameboy = get_gameboy()
+
+# MEMORY MAP -------------------------------------------------------------------
+
+def get_mbc1_gameboy():
+    gameboy = get_gameboy()
+    # the first byte of every bank is its number
+    rom = "".join([chr(bank) + "\x00" * (constants.ROM_BANK_SIZE - 1)
+                   for bank in range(0, 4)])
+    mbc = MBC1(rom, ByteBuffer(constants.RAM_BANK_SIZE, 0xFF), gameboy.clock)
+    gameboy.cartridge_manager.mbc = mbc
+    gameboy.create_memory_map()
+    return gameboy
+
+def test_memory_map_work_ram():
+    gameboy = get_gameboy()
+    gameboy.write(0xC000, 0x12)
+    assert gameboy.read(0xC000) == 0x12
+    assert gameboy.ram.read(0xC000) == 0x12
+    # echo ram
+    assert gameboy.read(0xE000) == 0x12
+    gameboy.write(0xFDFF, 0x1234)
+    assert gameboy.read(0xDDFF) == 0x34
+    
+def test_memory_map_video_ram():
+    gameboy = get_gameboy()
+    gameboy.video.get_tile_row(0x0010)
+    gameboy.write(0x8012, 0x80)
+    assert gameboy.read(0x8012) == 0x80
+    assert gameboy.video.vram.get(0x0012) == 0x80
+    assert not gameboy.video.tile_valid[1]
+
+def test_memory_map_high_ram():
+    gameboy = get_gameboy()
+    gameboy.write(0xFF80, 0x12)
+    gameboy.write(0xFFFE, 0x13)
+    assert gameboy.read(0xFF80) == 0x12
+    assert gameboy.read(0xFFFE) == 0x13
+    assert gameboy.ram.read(0xFFFE) == 0x13
+    
+def test_memory_map_video():
+    gameboy = get_gameboy()
+    gameboy.write(0x8000, 0x12)
+    gameboy.write(0x9FFF, 0x13)
+    gameboy.write(0xFE9F, 0x14)
+    assert gameboy.video.read(0x8000) == 0x12
+    assert gameboy.read(0x9FFF) == 0x13
+    assert gameboy.read(0xFE9F) == 0x14
+    assert gameboy.read(0xFEA0) == 0xFF
+    gameboy.write(constants.SCX, 0x15)
+    assert gameboy.read(constants.SCX) == 0x15
+    
+def test_memory_map_io():
+    gameboy = get_gameboy()
+    gameboy.write(constants.TMA, 0x12)
+    assert gameboy.timer.get_timer_modulo() == 0x12
+    gameboy.write(constants.IE, 0x01)
+    assert gameboy.read(constants.IE) == 0x01
+    py.test.raises(Exception, gameboy.read, 0xFF4C)
+    py.test.raises(Exception, gameboy.write, 0xFF03, 0x00)
+    
+def test_memory_map_rom_bank_switch():
+    gameboy = get_mbc1_gameboy()
+    assert gameboy.read(0x0000) == 0
+    assert gameboy.read(0x4000) == 1
+    gameboy.write(0x2000, 0x03)
+    assert gameboy.read(0x4000) == 3
+    assert gameboy.read(0x0000) == 0
+    gameboy.write(0x2000, 0x02)
+    assert gameboy.read(0x4000) == 2
+    # rom is read only
+    gameboy.write(0x4000, 0x12)
+    assert gameboy.read(0x4000) == 2
+
+def test_ram_code_invalidation():
+    gameboy = get_gameboy()
+    cpu = gameboy.cpu
+    # inc A; jp 0xC000
+    for index, data in enumerate([0x3C, 0xC3, 0x00, 0xC0]):
+        gameboy.write(0xC000 + index, data)
+    cpu.pc.set(0xC000)
+    cpu.a.set(0)
+    cpu.cycles = 0
+    cpu.emulate(10)
+    assert cpu.a.get() == 2
+    assert cpu.ram_blocks[0xC000] is not None
+    assert cpu.code_map[0xC000] == 1
+    assert cpu.code_map[0xE003] == 1
+    # inc B, written through the echo RAM
+    gameboy.write(0xE000, 0x04)
+    assert cpu.ram_blocks[0xC000] is None
+    assert cpu.code_map[0xC000] == 0
+    cpu.b.set(0)
+    cpu.pc.set(0xC000)
+    cpu.cycles = 0
+    cpu.emulate(10)
+    assert cpu.a.get() == 2
+    assert cpu.b.get() == 2
+    # high RAM
+    for index, data in enumerate([0x0C, 0xC3, 0x80, 0xFF]):
+        gameboy.write(0xFF80 + index, data)
+    cpu.c.set(0)
+    cpu.pc.set(0xFF80)
+    cpu.cycles = 0
+    cpu.emulate(10)
+    assert cpu.c.get() == 2
+    gameboy.write(0xFF80, 0x00)
+    assert cpu.ram_blocks[0xFF80] is None
+
+# SCHEDULER --------------------------------------------------------------------
+
+def test_scheduler():
+    gameboy = get_gameboy()
+    cpu = gameboy.cpu
+    # jr -2
+    gameboy.write(0xC000, 0x18)
+    gameboy.write(0xC001, 0xFE)
+    cpu.pc.set(0xC000)
+    cpu.cycles = 0
+    timer = gameboy.components.index(gameboy.timer)
+    joypad = gameboy.components.index(gameboy.joypad)
+    event = gameboy.next_event
+    assert event == min(gameboy.event_cycles)
+    gameboy.emulate(1)
+    assert gameboy.cycles == event
+    # only the due components are emulated
+    for index in range(len(gameboy.components)):
+        if gameboy.event_cycles[index] - gameboy.cycles == \
+           gameboy.components[index].get_cycles():
+            continue
+        assert gameboy.component_cycles[index] == 0
+    assert gameboy.component_cycles[joypad] == 0
+    # register access catches up
+    gameboy.read(constants.DIV)
+    assert gameboy.component_cycles[timer] == gameboy.get_current_cycles()
+    # a timing change reschedules the event
+    gameboy.write(constants.TIMA, 0xFF)
+    gameboy.write(constants.TAC, 0x05)
+    cycles = gameboy.get_current_cycles()
+    assert gameboy.event_cycles[timer] == cycles + 4
+    assert gameboy.next_event == cycles + 4
+    gameboy.emulate(1)
+    assert gameboy.cycles == cycles + 4
+    assert gameboy.component_cycles[timer] == gameboy.cycles
+    assert gameboy.interrupt.timer.is_pending()
+
+def test_scheduler_reschedule_running_slice():
+    gameboy = get_gameboy()
+    cpu = gameboy.cpu
+    gameboy.write(constants.TIMA, 0xFF)
+    # ld A,0x05; ldh (TAC),A; jr -2
+    for index, data in enumerate([0x3E, 0x05, 0xE0, 0x07, 0x18, 0xFE]):
+        gameboy.write(0xC000 + index, data)
+    cpu.pc.set(0xC000)
+    cpu.cycles = 0
+    event = gameboy.next_event
+    gameboy.emulate(1)
+    # the slice ended at the overflow of the timer started by the CPU
+    assert gameboy.cycles < event
+    assert gameboy.interrupt.timer.is_pending()
+    assert gameboy.timer.tima == gameboy.timer.tma
+
+def test_shared_rom():
+    path = str(py.magic.autopath().dirpath().dirpath())+"/rom/rom4/rom4.gb"
+    cartridge = Cartridge(path)
+    gameboy1 = get_gameboy()
+    gameboy1.load_cartridge(cartridge)
+    gameboy2 = get_gameboy()
+    gameboy2.load_cartridge(cartridge)
+    assert gameboy1.cpu.rom is gameboy2.cpu.rom
+    assert gameboy1.read_pages[0x40] is gameboy2.read_pages[0x40]
+
+# DMA --------------------------------------------------------------------------
+
+def test_read_block():
+    gameboy = get_mbc1_gameboy()
+    buffer = ByteBuffer(4)
+    # ROM bank 1
+    gameboy.read_block(0x4000, buffer, 0, 2)
+    assert buffer.get(0) == 1
+    gameboy.write(0xC101, 0x12)
+    gameboy.read_block(0xE100, buffer, 1, 3)
+    assert [buffer.get(i) for i in range(4)] == [1, 0, 0x12, 0]
+    # enabled cartridge RAM
+    gameboy.write(0x0000, 0x0A)
+    gameboy.write(0xA002, 0x34)
+    gameboy.read_block(0xA000, buffer, 0, 4)
+    assert [buffer.get(i) for i in range(4)] == [0xFF, 0xFF, 0x34, 0xFF]
+
+def test_dma():
+    gameboy = get_gameboy()
+    for index in range(constants.OAM_SIZE):
+        gameboy.write(0xC000 + index, index)
+    gameboy.write(constants.DMA, 0xC0)
+    for index in range(constants.OAM_SIZE):
+        assert gameboy.read(constants.OAM_ADDR + index) == index
+    assert gameboy.dma_end == -1
+
+def test_dma_timing():
+    gameboy = get_gameboy()
+    gameboy.set_dma_timing(True)
+    gameboy.write(0xC000, 0x12)
+    gameboy.write(constants.DMA, 0xC0)
+    assert gameboy.video.oam.get(0) == 0x12
+    # only HRAM and the IO registers can be accessed
+    assert gameboy.read(0xC000) == 0xFF
+    gameboy.write(0xC000, 0x34)
+    gameboy.write(0xFF80, 0x56)
+    assert gameboy.read(0xFF80) == 0x56
+    assert gameboy.read(constants.DMA) == 0xC0
+    gameboy.slice_end += constants.DMA_TICKS
+    assert gameboy.read(0xC000) == 0x12
+    assert gameboy.dma_end == -1
+
+def test_dma_timing_rom_bank_code():
+    gameboy = get_gameboy()
+    gameboy.set_dma_timing(True)
+    # in bank 1: ld A,0xC0; ldh (DMA),A; ld B,0x10; 8 times inc B; jp 0x400E
+    code = [0x3E, 0xC0, 0xE0, 0x46, 0x06, 0x10] + [0x04] * 8 + [0xC3, 0x0E, 0x40]
+    rom = "\x00" * constants.ROM_BANK_SIZE + "".join([chr(op) for op in code])
+    rom += "\x00" * (constants.ROM_BANK_SIZE * 4 - len(rom))
+    gameboy.cpu.set_rom(rom)
+    mbc = MBC1(rom, ByteBuffer(constants.RAM_BANK_SIZE, 0xFF), gameboy.clock)
+    gameboy.cartridge_manager.mbc = mbc
+    gameboy.create_memory_map()
+    gameboy.cpu.ime = False
+    gameboy.cpu.pc.set(0x4000, use_cycles=False)
+    gameboy.emulate(40)
+    # the code in ROM still runs while the transfer locks out the memory
+    assert gameboy.is_dma_running()
+    assert gameboy.read(0x4004) == 0xFF
+    assert gameboy.cpu.b.get() == 0x18
+    assert gameboy.cpu.program_counter == 0x400E
+    block = gameboy.cpu.get_block(0x4004)
+    assert block.op_codes[0] is OP_CODES[0x06]
+    gameboy.emulate(constants.DMA_TICKS)
+    assert not gameboy.is_dma_running()
+    assert gameboy.cpu.b.get() == 0x18
+    assert gameboy.cpu.get_block(0x4004) is block
+
+# FORKS ------------------------------------------------------------------------
+
+def get_forked_gameboy():
+    # MBC1 with 32KB RAM
+    path = str(py.magic.autopath().dirpath().dirpath())+"/rom/rom6/rom6.gb"
+    gameboy = get_gameboy()
+    gameboy.load_cartridge_file(path)
+    gameboy.emulate(constants.FRAME_TICKS)
+    return gameboy
+
+def test_fork():
+    gameboy = get_forked_gameboy()
+    gameboy.write(0xC000, 0x12)
+    gameboy.write(0x0000, 0x0A)
+    gameboy.write(0xA000, 0x34)
+    child = gameboy.fork()
+    assert isinstance(child, ForkedGameBoy)
+    assert child.save_state() == gameboy.save_state()
+    assert child.cartridge_manager.get_memory_bank().rom is \
+           gameboy.cartridge_manager.get_memory_bank().rom
+    assert child.cpu.rom_blocks is gameboy.cpu.rom_blocks
+    # the memories are copied on write
+    assert child.ram.w_ram.pages[0] is gameboy.ram.w_ram.pages[0]
+    child.write(0xC000, 0x56)
+    child.write(0xA000, 0x78)
+    assert gameboy.read(0xC000) == 0x12
+    assert gameboy.read(0xA000) == 0x34
+    gameboy.write(0xC001, 0x9A)
+    assert child.read(0xC000) == 0x56
+    assert child.read(0xC001) == 0x00
+    assert child.read(0xA000) == 0x78
+    assert child.ram.w_ram.pages[1] is gameboy.ram.w_ram.pages[1]
+
+def test_fork_tables():
+    gameboy = get_forked_gameboy()
+    child = gameboy.fork()
+    # the fork shares the tables it never writes and allocates the RAM
+    # code tables with its first RAM block
+    assert child.io_components is gameboy.io_components
+    assert child.sound.frequency_table is gameboy.sound.frequency_table
+    assert child.cpu.code_map is EMPTY_CODE_MAP
+    child.write(0xC000, 0x00)
+    child.cpu.add_ram_block(child.cpu.decode_block(0xC000, 0xE000))
+    assert child.cpu.code_map is not EMPTY_CODE_MAP
+    assert EMPTY_CODE_MAP[0xC000] == 0
+    assert gameboy.cpu.code_map[0xC000] == 0
+
+def test_fork_emulate():
+    gameboy = get_forked_gameboy()
+    child = gameboy.fork()
+    gameboy.emulate(2 * constants.FRAME_TICKS)
+    child.emulate(2 * constants.FRAME_TICKS)
+    assert child.save_state() == gameboy.save_state()
+    assert child.video_driver.get_pixels() == gameboy.video_driver.get_pixels()
+
+def test_fork_drivers():
+    gameboy = get_forked_gameboy()
+    gameboy.joypad_driver.button_a()
+    gameboy.video_driver.get_pixels()[0] = 0x123456
+    child = gameboy.fork()
+    assert child.joypad_driver is not gameboy.joypad_driver
+    assert child.joypad_driver.get_button_code() == \
+           gameboy.joypad_driver.get_button_code()
+    assert child.video_driver.get_pixels()[0] == 0x123456
+    assert child.sound_driver.get_sample_rate() == \
+           gameboy.sound_driver.get_sample_rate()
@@ -193,6 +193,26 @@ def toggle_multiple_test(driver, codeGetter, buttons):
             assert buttons[j][1].is_pressed() == toggled[j]
         assert codeGetter() == code
                 
+def test_button_mask():
+    driver = get_driver()
+    assert driver.get_button_mask() == 0
+    driver.button_a()
+    driver.button_left()
+    assert driver.is_raised()
+    assert driver.get_button_mask() == (constants.BUTTON_A << 4) | \
+                                       constants.BUTTON_LEFT
+    mask = (constants.BUTTON_START << 4) | constants.BUTTON_UP
+    driver.set_button_mask(mask)
+    assert driver.is_raised()
+    assert driver.start.is_pressed()
+    assert driver.up.is_pressed()
+    assert not driver.a.is_pressed()
+    assert not driver.left.is_pressed()
+    assert driver.get_button_mask() == mask
+    # an unchanged mask raises nothing
+    driver.set_button_mask(mask)
+    assert not driver.is_raised()
+
 
 
 # TEST JOYPAD ------------------------------------------------------------------
@@ -0,0 +1,100 @@
+import py
+from pypy.lang.gameboy.movie import *
+from pypy.lang.gameboy.batch import BatchGameBoy
+from pypy.lang.gameboy.joypad import JoypadDriver
+from pypy.lang.gameboy.savestate import InvalidStateError
+from pypy.lang.gameboy import constants
+
+ROM_PATH = str(py.magic.autopath().dirpath().dirpath())+"/rom"
+
+# (frame, mask) of the source driver while recording
+INPUT = [(2, 0x81), (3, 0x81), (4, 0x02), (7, 0x00)]
+
+
+def get_gameboy(rom="rom6"):
+    gameboy = BatchGameBoy()
+    gameboy.load_cartridge_file("%s/%s/%s.gb" % (ROM_PATH, rom, rom))
+    return gameboy
+
+def record(gameboy, frames=10):
+    source = JoypadDriver()
+    recorder = MovieRecorder(gameboy, source)
+    for frame in range(frames):
+        for input_frame, mask in INPUT:
+            if input_frame == frame:
+                source.set_button_mask(mask)
+        recorder.emulate_frame()
+    return recorder.get_movie()
+
+def test_stream():
+    movie = InputMovie(0x1234, 0x56, "state")
+    movie.add_change(0, 0x10)
+    movie.add_change(300, 0x00)
+    movie.frames = 400
+    copy = load_movie(movie.get_data())
+    assert copy.checksum == 0x1234
+    assert copy.header_checksum == 0x56
+    assert copy.start_state == "state"
+    assert copy.frames == 400
+    assert copy.changes == [(0, 0x10), (300, 0x00)]
+    assert not copy.is_power_on()
+    # the changes take a few bytes each
+    assert len(movie.get_data()) < 30
+
+def test_broken_stream():
+    data = InputMovie().get_data()
+    load_movie(data)
+    py.test.raises(InvalidStateError, load_movie, data[:-1])
+    py.test.raises(InvalidStateError, load_movie, data + "\x00")
+    py.test.raises(InvalidStateError, load_movie, "GBSS" + data[4:])
+    movie = InputMovie()
+    movie.add_change(5, 0x01)
+    movie.frames = 2
+    py.test.raises(InvalidStateError, load_movie, movie.get_data())
+
+def test_record():
+    gameboy = get_gameboy()
+    movie = record(gameboy)
+    assert movie.is_power_on()
+    assert movie.frames == 10
+    assert movie.changes == [(2, 0x81), (4, 0x02), (7, 0x00)]
+    assert gameboy.cycles >= 10 * constants.FRAME_TICKS
+    assert gameboy.cycles < 11 * constants.FRAME_TICKS
+
+def test_replay():
+    gameboy = get_gameboy()
+    movie = load_movie(record(gameboy).get_data())
+    replay = get_gameboy()
+    player = MoviePlayer(replay, movie)
+    assert player.play() == 10
+    assert player.is_finished()
+    assert replay.cycles == gameboy.cycles
+    assert replay.save_state() == gameboy.save_state()
+    assert replay.joypad_driver.get_button_mask() == 0
+
+def test_replay_from_state():
+    gameboy = get_gameboy()
+    gameboy.joypad_driver.button_start()
+    gameboy.emulate(3 * constants.FRAME_TICKS)
+    movie = record(gameboy)
+    assert not movie.is_power_on()
+    assert movie.changes[0] == (0, constants.BUTTON_START << 4)
+    replay = get_gameboy()
+    replay.emulate(5 * constants.FRAME_TICKS)
+    MoviePlayer(replay, movie).play()
+    assert replay.save_state() == gameboy.save_state()
+
+def test_replay_checks():
+    movie = record(get_gameboy())
+    py.test.raises(InvalidStateError, MoviePlayer, get_gameboy("rom3"), movie)
+    gameboy = get_gameboy()
+    gameboy.emulate(100)
+    py.test.raises(InvalidStateError, MoviePlayer, gameboy, movie)
+
+def test_paced_replay():
+    gameboy = get_gameboy()
+    movie = record(gameboy, 3)
+    player = MoviePlayer(get_gameboy(), movie, True)
+    start = time.time()
+    player.play()
+    assert time.time() - start >= 2 * FRAME_TIME
@@ -1,5 +1,5 @@
 from pypy.lang.gameboy import constants
-from pypy.lang.gameboy.ram import RAM
+from pypy.lang.gameboy.ram import RAM, ByteBuffer
 
 
 def get_ram():
@@ -17,36 +17,36 @@ def test_ram_read_write():
     except Exception:
         pass
         
-    assert value not in ram.w_ram
-    assert value not in ram.h_ram
+    assert chr(value) not in ram.w_ram.to_string()
+    assert chr(value) not in ram.h_ram.to_string()
     
     address = 0xC000
     ram.write(address, value)
     assert ram.read(address) == value
-    assert value in  ram.w_ram
-    assert value not in  ram.h_ram
+    assert chr(value) in ram.w_ram.to_string()
+    assert chr(value) not in ram.h_ram.to_string()
     
     address = 0xFDFF
     value += 1
     ram.write(address, value)
     assert ram.read(address) == value
-    assert value in  ram.w_ram
-    assert value not in  ram.h_ram
+    assert chr(value) in ram.w_ram.to_string()
+    assert chr(value) not in ram.h_ram.to_string()
     
     
     address = 0xFF80
     value += 1
     ram.write(address, value)
     assert ram.read(address) == value
-    assert value in  ram.h_ram
-    assert value not in  ram.w_ram
+    assert chr(value) in ram.h_ram.to_string()
+    assert chr(value) not in ram.w_ram.to_string()
     
     address = 0xFFFE
     value += 1
     ram.write(address, value)
     assert ram.read(address) == value
-    assert value in  ram.h_ram
-    assert value not in  ram.w_ram
+    assert chr(value) in ram.h_ram.to_string()
+    assert chr(value) not in ram.w_ram.to_string()
     
     address += 1
     value += 1
@@ -56,5 +56,79 @@ def test_ram_read_write():
         py.test.fail()
     except Exception:
         pass
-    assert value not in  ram.h_ram
-    assert value not in  ram.w_ram
\ No newline at end of file
+    assert chr(value) not in ram.h_ram.to_string()
+    assert chr(value) not in ram.w_ram.to_string()
+
+def test_byte_buffer():
+    buffer = ByteBuffer(4, 0xFF)
+    assert buffer.get_size() == 4
+    assert buffer.get(3) == 0xFF
+    buffer.set(1, 0x1FE)
+    assert buffer.get(1) == 0xFE
+    buffer.fill(0x12, 2)
+    assert buffer.to_string() == "\xFF\xFE\x12\x12"
+    buffer.fill(0)
+    assert buffer.to_string() == "\x00" * 4
+    buffer.load_string("\x01\x02", 1)
+    other = ByteBuffer(4)
+    other.copy_from(buffer, 1, 2, 2)
+    assert other.to_string() == "\x00\x00\x01\x02"
+
+def test_byte_buffer_pages():
+    buffer = ByteBuffer(600)
+    buffer.load_string("\x01" * 300, 100)
+    assert buffer.to_string() == "\x00" * 100 + "\x01" * 300 + "\x00" * 200
+    assert buffer.get(399) == 1
+    assert buffer.get(400) == 0
+
+def test_byte_buffer_fork():
+    buffer = ByteBuffer(600)
+    buffer.set(0, 1)
+    fork = buffer.fork()
+    assert fork.to_string() == buffer.to_string()
+    assert fork.pages[1] is buffer.pages[1]
+    fork.set(300, 2)
+    buffer.set(1, 3)
+    assert fork.get(300) == 2
+    assert buffer.get(300) == 0
+    assert fork.get(1) == 0
+    assert buffer.get(1) == 3
+    # only the written pages are copied
+    assert fork.pages[1] is not buffer.pages[1]
+    assert fork.pages[2] is buffer.pages[2]
+    buffer.fill(5)
+    assert fork.get(599) == 0
+
+def test_byte_buffer_block_pages():
+    source = ByteBuffer(600)
+    source.load_string("".join([chr(index & 0xFF) for index in range(600)]))
+    buffer = ByteBuffer(600)
+    fork = buffer.fork()
+    # unaligned across three pages of both buffers
+    fork.copy_from(source, 100, 200, 350)
+    assert fork.to_string() == "\x00" * 200 + source.to_string()[100:450] + \
+                               "\x00" * 50
+    assert buffer.to_string() == "\x00" * 600
+    fork.fill(7, 250, 300)
+    assert fork.to_string()[250:550] == "\x07" * 300
+    assert fork.get(249) == source.get(149)
+    assert buffer.to_string() == "\x00" * 600
+    # whole pages are replaced, not copied first
+    fork = buffer.fork()
+    fork.fill(1, 256, 256)
+    assert fork.pages[0] is buffer.pages[0]
+    assert fork.pages[1] is not buffer.pages[1]
+    assert buffer.get(300) == 0
+
+def test_byte_buffer_shared_fill():
+    buffer = ByteBuffer(600, 0xFF)
+    # the whole pages share one page until they are written
+    assert buffer.pages[0] is buffer.pages[1]
+    assert buffer.pages[2] is not buffer.pages[1]
+    buffer.set(256, 1)
+    assert buffer.get(256) == 1
+    assert buffer.get(0) == 0xFF
+    assert buffer.pages[0] is not buffer.pages[1]
+    buffer.fill(0)
+    buffer.set(0, 2)
+    assert buffer.to_string() == "\x02" + "\x00" * 599
@@ -19,7 +19,7 @@ TEST_CPU = None
 def get_cpu(new=False):
     if new:
         cpu = CPU(Interrupt(), Memory())
-        cpu.set_rom([0]*0xFFFF);
+        cpu.set_rom("\x00"*0xFFFF);
         return cpu
     global TEST_CPU
     if TEST_CPU is None:
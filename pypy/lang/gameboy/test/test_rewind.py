@@ -0,0 +1,85 @@
+import py
+from pypy.lang.gameboy.rewind import *
+from pypy.lang.gameboy.batch import BatchGameBoy
+from pypy.lang.gameboy import constants
+
+ROM_PATH = str(py.magic.autopath().dirpath().dirpath())+"/rom"
+
+
+def test_delta():
+    base = "".join([chr(index & 0xFF) for index in range(300)])
+    data = base[:40] + "\x00\x01" + base[42:290] + "xyz" + base[293:]
+    delta = encode_delta(data, base)
+    # two changed blocks
+    assert len(delta) < 2 * DELTA_BLOCK_SIZE + 10
+    assert decode_delta(delta, base) == data
+    assert decode_delta(encode_delta(base, base), base) == base
+    assert len(encode_delta(base, base)) == 3
+    other = "".join([chr(index & 0x7F) for index in range(300)])
+    assert decode_delta(encode_delta(other, base), base) == other
+
+
+def get_gameboy(interval=4, budget=1 << 30):
+    gameboy = BatchGameBoy()
+    gameboy.load_cartridge_file(ROM_PATH+"/rom3/rom3.gb")
+    gameboy.enable_rewind(interval, budget)
+    return gameboy
+
+def test_record():
+    gameboy = get_gameboy()
+    gameboy.emulate(10 * constants.FRAME_TICKS)
+    rewind = gameboy.rewind_buffer
+    # the slices end at the frame boundaries, 0 to 10 are recorded
+    assert rewind.get_frame_count() == 11
+    keyframes = [snapshot.is_keyframe() for snapshot in rewind.snapshots]
+    assert keyframes == [True, False, False, False] * 2 + \
+                        [True, False, False]
+    # deltas are smaller than the keyframes
+    assert rewind.snapshots[1].get_size() < rewind.snapshots[0].get_size()
+
+def test_rewind():
+    gameboy = get_gameboy()
+    gameboy.emulate(6 * constants.FRAME_TICKS)
+    state = gameboy.save_state()
+    gameboy.emulate(4 * constants.FRAME_TICKS)
+    assert gameboy.rewind(4) == 4
+    assert gameboy.rewind_buffer.get_frame_count() == 7
+    assert gameboy.save_state() == state
+    # replaying gives the same frames again
+    gameboy.emulate(4 * constants.FRAME_TICKS)
+    assert gameboy.rewind_buffer.get_frame_count() == 11
+    again = gameboy.save_state()
+    gameboy.rewind(4)
+    gameboy.emulate(4 * constants.FRAME_TICKS)
+    assert gameboy.save_state() == again
+
+def test_rewind_to_oldest():
+    gameboy = get_gameboy()
+    gameboy.emulate(3 * constants.FRAME_TICKS)
+    assert gameboy.rewind(10) == 3
+    assert gameboy.rewind_buffer.get_frame_count() == 1
+    assert gameboy.cycles < constants.FRAME_TICKS
+
+def test_budget():
+    gameboy = get_gameboy(4, 0)
+    gameboy.emulate(10 * constants.FRAME_TICKS)
+    rewind = gameboy.rewind_buffer
+    # only the states since the last keyframe are kept
+    assert rewind.get_frame_count() == 3
+    assert rewind.snapshots[0].is_keyframe()
+    size = 0
+    for snapshot in rewind.snapshots:
+        size += snapshot.get_size()
+    assert rewind.get_size() == size
+    assert gameboy.rewind(1) == 1
+
+def test_compress():
+    if rzlib is None:
+        py.test.skip("zlib is not available")
+    gameboy = get_gameboy()
+    gameboy.rewind_buffer = Rewind(gameboy, 4, 1 << 30, True)
+    gameboy.emulate(5 * constants.FRAME_TICKS)
+    state = gameboy.save_state()
+    gameboy.emulate(2 * constants.FRAME_TICKS)
+    assert gameboy.rewind(2) == 2
+    assert gameboy.save_state() == state
@@ -0,0 +1,102 @@
+import py
+from pypy.lang.gameboy.savestate import *
+from pypy.lang.gameboy.batch import BatchGameBoy
+from pypy.lang.gameboy.ram import ByteBuffer
+from pypy.lang.gameboy import constants
+
+ROM_PATH = str(py.magic.autopath().dirpath().dirpath())+"/rom"
+
+
+def test_ints():
+    writer = StateWriter()
+    values = [0, 1, -1, 63, -64, 64, 0x7F, 0x80, -0x81, 1 << 30, -(1 << 30)]
+    for value in values:
+        writer.write_int(value)
+    writer.write_bool(True)
+    writer.write_bool(False)
+    writer.write_ints([3, -2, 1])
+    reader = StateReader(writer.get_data())
+    for value in values:
+        assert reader.read_int() == value
+    assert reader.read_bool()
+    assert not reader.read_bool()
+    ints = [0] * 3
+    reader.read_ints(ints)
+    assert ints == [3, -2, 1]
+    reader.check_finished()
+
+def test_small_ints_take_one_byte():
+    writer = StateWriter()
+    size = len(writer.get_data())
+    writer.write_int(-64)
+    writer.write_int(63)
+    assert len(writer.get_data()) == size + 2
+
+def test_buffer():
+    buffer = ByteBuffer(16)
+    for index in range(16):
+        buffer.set(index, index * 3)
+    writer = StateWriter()
+    writer.write_buffer(buffer)
+    copy = ByteBuffer(16)
+    StateReader(writer.get_data()).read_buffer(copy)
+    assert copy.to_string() == buffer.to_string()
+    py.test.raises(InvalidStateError,
+                   StateReader(writer.get_data()).read_buffer, ByteBuffer(8))
+
+def test_invalid_states():
+    data = StateWriter().get_data()
+    py.test.raises(InvalidStateError, StateReader, "XXXX" + data[4:])
+    py.test.raises(InvalidStateError, StateReader, data[:4] + "\x04")
+    reader = StateReader(data)
+    py.test.raises(InvalidStateError, reader.read_int)
+    reader = StateReader(data + "\x00")
+    py.test.raises(InvalidStateError, reader.check_finished)
+
+
+# GAMEBOY ----------------------------------------------------------------------
+
+def get_gameboy():
+    gameboy = BatchGameBoy()
+    gameboy.load_cartridge_file(ROM_PATH+"/rom3/rom3.gb")
+    return gameboy
+
+def test_restore():
+    gameboy = get_gameboy()
+    gameboy.emulate(20 * constants.FRAME_TICKS + 1234)
+    state = gameboy.save_state()
+    gameboy.emulate(3 * constants.FRAME_TICKS)
+    restored = get_gameboy()
+    restored.load_state(state)
+    assert restored.save_state() == state
+    restored.emulate(3 * constants.FRAME_TICKS)
+    assert restored.save_state() == gameboy.save_state()
+    assert restored.get_digest() == gameboy.get_digest()
+    assert restored.video_driver.frame_hashes[-1] == \
+           gameboy.video_driver.frame_hashes[-1]
+
+def test_restore_drops_ram_code():
+    gameboy = get_gameboy()
+    gameboy.emulate(1000)
+    state = gameboy.save_state()
+    cpu = gameboy.cpu
+    gameboy.write(0xC000, 0x00)
+    cpu.add_ram_block(cpu.decode_block(0xC000, 0xE000))
+    assert cpu.code_map[0xC000] == 1
+    ram_blocks = cpu.ram_blocks
+    gameboy.load_state(state)
+    assert cpu.ram_blocks[0xC000] is None
+    assert cpu.code_map[0xC000] == 0
+    assert cpu.code_map[0xE000] == 0
+    # the blocks are removed, the tables are kept
+    assert cpu.ram_blocks is ram_blocks
+
+def test_other_cartridge():
+    gameboy = get_gameboy()
+    state = gameboy.save_state()
+    other = BatchGameBoy()
+    other.load_cartridge_file(ROM_PATH+"/rom4/rom4.gb")
+    program_counter = other.cpu.program_counter
+    py.test.raises(InvalidStateError, other.load_state, state)
+    assert other.cpu.program_counter == program_counter
+    py.test.raises(InvalidStateError, gameboy.load_state, state[:-1])
@@ -0,0 +1,32 @@
+from pypy.lang.gameboy.scaledrow import ScaledRow
+
+
+def test_convert():
+    row = ScaledRow(4, 1)
+    try:
+        assert row.size == 16
+        pixels = [0, 0, 0, 0, 0x112233, 0xFFFFFF, 0x000001, 0x808080]
+        row.convert(pixels, 4)
+        assert [row.get(x) for x in range(4)] == pixels[4:]
+        row.convert(pixels, 0)
+        assert [row.get(x) for x in range(4)] == [0] * 4
+    finally:
+        row.free()
+
+def test_convert_scaled():
+    row = ScaledRow(3, 3)
+    try:
+        assert row.length == 9
+        assert row.size == 36
+        row.convert([0x10, 0x20, 0xFFFFFFFF], 0)
+        assert [row.get(x) for x in range(9)] == [0x10] * 3 + [0x20] * 3 + \
+                                                 [0xFFFFFFFF] * 3
+    finally:
+        row.free()
+
+def test_free():
+    row = ScaledRow(2, 2)
+    row.free()
+    assert not row.data
+    # freeing twice is harmless
+    row.free()
@@ -68,4 +68,16 @@ def test_read_write():
     assert serial.sc == value
     
     assert serial.read(0) == 0xFF
-    
\ No newline at end of file
+
+def test_record_transfers():
+    serial = get_serial()
+    serial.write(constants.SB, ord("x"))
+    serial.write(constants.SC, 0x81)
+    assert serial.get_transfers() == ""
+    serial.record_transfers()
+    for char in "ok":
+        serial.write(constants.SB, ord(char))
+        serial.write(constants.SC, 0x81)
+    # no transfer started
+    serial.write(constants.SC, 0x80)
+    assert serial.get_transfers() == "ok"
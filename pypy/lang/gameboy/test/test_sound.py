@@ -0,0 +1,212 @@
+from pypy.lang.gameboy import constants
+from pypy.lang.gameboy.sound import *
+
+
+class RecordingSoundDriver(SoundDriver):
+    def __init__(self):
+        SoundDriver.__init__(self)
+        self.blocks = []
+
+    def update(self):
+        length = self.ring.read(self.samples, self.ring.get_available())
+        self.blocks.append(self.samples[:length])
+
+
+def get_sound():
+    return Sound(RecordingSoundDriver())
+
+def get_samples(sound):
+    samples = []
+    for block in sound.driver.blocks:
+        samples += block
+    return samples
+
+
+def test_duty_table():
+    assert len(DUTY_TABLE) == 4 * 32
+    for duty in range(4):
+        high = DUTY_TABLE[duty << 5:(duty + 1) << 5].count(1)
+        assert high == 32 - [4, 8, 16, 24][duty]
+
+def test_reset():
+    sound = get_sound()
+    assert sound.get_output_enable() == 0x80 | 0x01 | 0x02 | 0x08
+    sound.write(constants.NR52, 0x00)
+    assert sound.get_output_enable() == 0x00
+
+def test_mix_block_sample_count():
+    sound = get_sound()
+    sound.emulate(constants.GAMEBOY_CLOCK / 64)
+    samples = get_samples(sound)
+    assert len(samples) == 2 * (sound.sample_rate / 64)
+    # blocks end at the updates of the channels
+    assert len(sound.driver.blocks) == 4
+    # all channels are silent after the reset
+    assert samples == [0] * len(samples)
+
+def test_mix_square_wave():
+    sound = get_sound()
+    sound.write(constants.NR51, 0x01)
+    sound.write(constants.NR11, 0x80)
+    sound.write(constants.NR12, 0xF0)
+    sound.write(constants.NR13, 0x00)
+    sound.write(constants.NR14, 0x87)
+    assert sound.channel1.audio_1_frequency > 0
+    sound.emulate(constants.GAMEBOY_CLOCK / 256)
+    samples = get_samples(sound)
+    # only the right terminal is enabled, 50% duty
+    assert samples[0::2] == [0] * (len(samples) / 2)
+    right = samples[1::2]
+    assert right.count(15) + right.count(-15) == len(right)
+    assert abs(right.count(15) - right.count(-15)) < len(right) / 8
+
+def test_mix_wave_pattern():
+    sound = get_sound()
+    for address in range(constants.AUD3WAVERAM, constants.AUD3WAVERAM + 16):
+        sound.write(address, 0xF0)
+    assert sound.channel3.audio_wave_samples[0:2] == [14, -16]
+    sound.write(constants.NR51, 0x40)
+    sound.write(constants.NR30, 0x80)
+    sound.write(constants.NR32, 0x40)
+    sound.write(constants.NR33, 0x00)
+    sound.write(constants.NR34, 0x87)
+    sound.emulate(constants.GAMEBOY_CLOCK / 256)
+    samples = get_samples(sound)
+    assert samples[1::2] == [0] * (len(samples) / 2)
+    left = samples[0::2]
+    assert left.count(7) + left.count(-8) == len(left)
+    assert left.count(7) > 0
+
+def test_mix_noise():
+    sound = get_sound()
+    sound.write(constants.NR51, 0x88)
+    sound.write(constants.NR42, 0x80)
+    sound.write(constants.NR43, 0x00)
+    sound.write(constants.NR44, 0x80)
+    sound.emulate(constants.GAMEBOY_CLOCK / 256)
+    samples = get_samples(sound)
+    assert samples[0::2] == samples[1::2]
+    assert samples.count(8) > 0
+    assert samples.count(-8) > 0
+
+def test_disabled_driver():
+    sound = get_sound()
+    sound.driver.enabled = False
+    sound.emulate(constants.GAMEBOY_CLOCK / 64)
+    assert sound.driver.blocks == []
+    assert sound.ring.write_position == 0
+
+
+# SOUND DRIVER -----------------------------------------------------------------
+
+def test_ring_size():
+    assert get_ring_size(44100, 100) == 16384
+    assert get_ring_size(44100, 0) == 1024
+
+def test_ring():
+    ring = SoundRing(8)
+    target = [0] * 8
+    assert ring.get_free() == 8
+    for index in range(6):
+        ring.buffer[index] = index
+    ring.commit(6)
+    assert ring.read(target, 4) == 4
+    assert target[:4] == [0, 1, 2, 3]
+    assert ring.get_free() == 6
+    # wrap around
+    ring.buffer[6] = 6
+    ring.buffer[7] = 7
+    ring.buffer[0] = 8
+    ring.commit(3)
+    assert ring.read(target, 8) == 5
+    assert target[:5] == [4, 5, 6, 7, 8]
+    assert ring.get_available() == 0
+
+def test_ring_overrun():
+    driver = RecordingSoundDriver()
+    driver.update = lambda : None
+    sound = Sound(driver)
+    sound.emulate(constants.GAMEBOY_CLOCK)
+    assert sound.ring.overruns > 0
+    assert sound.ring.get_available() <= sound.ring.get_size()
+
+def test_read_samples_decimation():
+    driver = SoundDriver(44100)
+    driver.set_output_rate(22050)
+    assert driver.get_output_rate() == 22050
+    for index in range(8):
+        driver.ring.buffer[index] = index
+    driver.ring.commit(8)
+    assert driver.read_samples(4) == 4
+    assert driver.samples[:4] == [1, 2, 5, 6]
+    assert driver.ring.get_available() == 0
+
+def test_encode_samples():
+    driver = SoundDriver(bits_per_sample=8)
+    driver.samples[:3] = [0, 10, -100]
+    assert driver.encode_samples(3) == "\x80\x94\x00"
+    driver = SoundDriver(bits_per_sample=16)
+    driver.samples[:2] = [1, -1]
+    assert driver.encode_samples(2) == "\x00\x02\x00\xfe"
+
+def test_pull_sound_driver():
+    driver = PullSoundDriver(bits_per_sample=8)
+    sound = Sound(driver)
+    sound.emulate(constants.GAMEBOY_CLOCK / 64)
+    available = driver.ring.get_available()
+    assert available > 0
+    assert len(driver.read_audio(2)) == 2
+    assert driver.ring.get_available() == available - 2
+    assert driver.underruns == 0
+    data = driver.read_audio(available)
+    assert len(data) == available
+    assert data[-2:] == "\x80\x80"
+    assert driver.underruns == 1
+    driver = PullSoundDriver(bits_per_sample=16)
+    assert driver.read_audio(4) == "\x00" * 4
+
+def test_null_sound_driver():
+    sound = Sound(NullSoundDriver())
+    sound.emulate(constants.GAMEBOY_CLOCK / 64)
+    assert sound.ring.write_position == 0
+
+
+# REGISTERS --------------------------------------------------------------------
+
+def test_register_tables():
+    assert len(SOUND_REGISTER_READERS) == constants.SOUND_REGISTER_COUNT
+    assert len(SOUND_REGISTER_WRITERS) == constants.SOUND_REGISTER_COUNT
+    sound = get_sound()
+    # unused registers
+    sound.write(0xFF15, 0x12)
+    assert sound.read(0xFF15) == 0xFF
+    assert sound.read(0xFF27) == 0xFF
+    assert sound.read(0xFF40) == 0xFF
+
+def test_read_masks():
+    sound = get_sound()
+    sound.write(constants.NR11, 0x80)
+    assert sound.read(constants.NR11) == 0xBF
+    sound.write(constants.NR33, 0x12)
+    assert sound.read(constants.NR33) == 0xFF
+    assert sound.channel3.get_audio_frequency() == 0x12
+    sound.write(constants.NR50, 0x77)
+    assert sound.read(constants.NR50) == 0x77
+    sound.write(constants.AUD3WAVERAM + 15, 0x5A)
+    assert sound.read(constants.AUD3WAVERAM + 15) == 0x5A
+
+def test_register_snapshot():
+    sound = get_sound()
+    sound.write(constants.NR43, 0x21)
+    sound.write(constants.NR33, 0x34)
+    sound.write(constants.AUD3WAVERAM + 3, 0x56)
+    sound.write(constants.NR30, 0x00)
+    registers = sound.get_registers()
+    assert len(registers) == constants.SOUND_REGISTER_COUNT
+    assert registers[constants.NR33 - constants.NR10] == 0x34
+    copy = get_sound()
+    copy.set_registers(registers)
+    assert copy.get_registers() == registers
+    assert not copy.channel3.enabled
+    assert copy.channel1.enabled
+    assert copy.channel4.audio_4_frequency == sound.channel4.audio_4_frequency
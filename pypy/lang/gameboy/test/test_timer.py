@@ -79,11 +79,14 @@ def test_cycles():
     timer = get_timer()
     value = 10
     timer.divider_cycles = value
-    assert timer.get_cycles() == timer.divider_cycles
+    # the divider has no events
+    assert timer.get_cycles() == constants.GAMEBOY_CLOCK
     timer.tac = 0x04
-    timer.timer_cycles = value-1
     timer.timer_cycles = value
+    timer.tima = 0xFF
     assert timer.get_cycles() == timer.timer_cycles
+    timer.tima = 0xFE
+    assert timer.get_cycles() == timer.timer_cycles + timer.timer_clock
     
 def test_emulateDivider_normal():
     timer = get_timer()
@@ -133,4 +136,27 @@ def test_emulate_timer_interrupt():
     assert timer.tima == timer.tma
     assert timer.interrupt.timer.is_pending()
     
-    
\ No newline at end of file
+    
+def test_emulate_divider_zero():
+    timer = get_timer()
+    timer.divider_cycles = 0
+    timer.emulate_divider(0)
+    assert timer.div == 1
+    assert timer.divider_cycles == constants.DIV_CLOCK
+    
+def test_emulate_lazy():
+    timer = get_timer()
+    timer.set_timer_control(0x05)
+    timer.tma = 0xF0
+    timer.tima = 0xFE
+    cycles = timer.get_cycles()
+    assert cycles == 2 * timer.timer_clock
+    timer.emulate(cycles - 1)
+    assert timer.tima == 0xFF
+    assert not timer.interrupt.timer.is_pending()
+    # 1 tick to the overflow, then 2 periods of 16 ticks and 3 ticks more
+    timer.emulate(1 + 35 * timer.timer_clock)
+    assert timer.tima == 0xF3
+    assert timer.interrupt.timer.is_pending()
+    assert timer.timer_cycles == timer.timer_clock
+    assert timer.div == (cycles + 35 * timer.timer_clock) // constants.DIV_CLOCK
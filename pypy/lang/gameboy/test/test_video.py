@@ -0,0 +1,340 @@
+from pypy.lang.gameboy import constants
+from pypy.lang.gameboy.video import Video, VideoDriver
+from pypy.lang.gameboy.interrupt import Interrupt
+
+
+class Memory(object):
+    def __init__(self):
+        self.memory = [0xFF] * 0xFFFF
+
+    def write(self, address, data):
+        self.memory[address] = data
+
+    def read(self, address):
+        return self.memory[address]
+
+    def read_block(self, address, target, index, length):
+        for i in range(length):
+            target.set(index + i, self.memory[address + i])
+
+
+def get_video():
+    return Video(VideoDriver(), Interrupt(), Memory())
+
+
+def write_tile_row(video, tile, row, pattern):
+    address = constants.VRAM_ADDR + (tile << 4) + (row << 1)
+    video.write(address, pattern & 0xFF)
+    video.write(address + 1, pattern >> 8)
+
+
+# TILE CACHE -------------------------------------------------------------------
+
+def test_reset_tiles():
+    video = get_video()
+    assert video.vram.get_size() == constants.VRAM_SIZE
+    assert video.tile_valid == [False] * constants.TILE_COUNT
+    offset = video.get_tile_row(0x0000)
+    assert video.tile_valid[0]
+    assert video.tile_rows[offset:offset + 8] == [0] * 8
+
+def test_decode_tile():
+    video = get_video()
+    # plane 0 = 0b10000001, plane 1 = 0b11000000
+    write_tile_row(video, 3, 2, 0xC081)
+    offset = video.get_tile_row((3 << 4) + (2 << 1))
+    assert offset == (3 << 6) + (2 << 3)
+    assert video.tile_rows[offset:offset + 8] == \
+           [0x0101, 0x0100, 0, 0, 0, 0, 0, 0x0001]
+    assert video.tile_rows_flipped[offset:offset + 8] == \
+           [0x0001, 0, 0, 0, 0, 0, 0x0100, 0x0101]
+    # the second byte of the row uses the same cached row
+    assert video.get_tile_row((3 << 4) + (2 << 1) + 1) == offset
+
+def test_invalidate_tile():
+    video = get_video()
+    video.get_tile_row(0x17F0)
+    video.get_tile_row(0x0010)
+    assert video.tile_valid[383]
+    write_tile_row(video, 383, 7, 0x0080)
+    assert not video.tile_valid[383]
+    assert video.tile_valid[1]
+    offset = video.get_tile_row(0x17FE)
+    assert video.tile_rows[offset] == 0x0001
+    # tile maps are not cached
+    video.write(constants.VRAM_ADDR + constants.VRAM_MAP_A, 0x12)
+    assert video.tile_valid[1]
+
+def test_draw_tile():
+    video = get_video()
+    write_tile_row(video, 1, 0, 0x0FF0)
+    video.draw_tile(8, 0x0010)
+    assert video.line[8:16] == [0x0001] * 4 + [0x0100] * 4
+
+def test_draw_object_tile():
+    video = get_video()
+    write_tile_row(video, 1, 0, 0x00C0)
+    video.line[8] = 0x0100
+    # palette 1 and behind the background
+    video.draw_object_tile(8, 0x0010, 0x90)
+    assert video.line[8:11] == [0x010E, 0x000E, 0]
+    # X flip
+    video.draw_overlapped_object_tile(8, 0x0010, 0x20)
+    assert video.line[8:11] == [0x010E, 0x000E, 0]
+    assert video.line[14:16] == [0x0002, 0x0002]
+
+
+# DIRTY LINES ------------------------------------------------------------------
+
+def draw_lines(video, first, last):
+    video.wline_y = 0
+    for line_y in range(first, last):
+        video.line_y = line_y
+        video.draw_line()
+
+def test_generation():
+    video = get_video()
+    generation = video.generation
+    video.write(constants.VRAM_ADDR, 0x00)
+    video.write(constants.OAM_ADDR, 0x00)
+    assert video.generation == generation
+    assert video.oam_generation == 0
+    video.write(constants.VRAM_ADDR + constants.VRAM_MAP_A + 0x21, 0x01)
+    assert video.map_row_generation[1] == generation + 1
+    assert video.map_row_generation[0] == 0
+    video.write(constants.VRAM_ADDR + 0x13, 0x01)
+    assert video.tile_row_generation[9] == generation + 2
+    video.write(constants.OAM_ADDR + 5, 0x01)
+    assert video.object_generation[1] == generation + 3
+    assert video.object_generation[0] == 0
+    assert video.oam_generation == 1
+    # a DMA transfer counts as one write of the changed objects
+    video.memory.memory[0:constants.OAM_SIZE] = [0] * constants.OAM_SIZE
+    video.set_dma(0x00)
+    assert video.oam_generation == 2
+    assert video.object_generation[1] == generation + 4
+    assert video.object_generation[0] == 0
+    video.set_dma(0x00)
+    assert video.oam_generation == 2
+
+def test_skip_unchanged_lines():
+    video = get_video()
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == [(0, 144)]
+    video.driver.get_pixels()[0] = 0x123456
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == []
+    assert video.driver.get_pixels()[0] == 0x123456
+    # row 2 of tile 0 is shown in every 8th line
+    write_tile_row(video, 0, 2, 0x0080)
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == [(y, y + 1) for y in range(2, 144, 8)]
+    # an unused tile and the other tile map
+    write_tile_row(video, 5, 2, 0x0080)
+    video.write(constants.VRAM_ADDR + constants.VRAM_MAP_B, 0x01)
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == []
+    # a tile map entry of the lines 8-15
+    video.write(constants.VRAM_ADDR + constants.VRAM_MAP_A + 0x20 + 3, 0x05)
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == [(8, 16)]
+    draw_lines(video, 0, 20)
+    video.set_scroll_x(1)
+    draw_lines(video, 20, 144)
+    assert video.get_changed_lines() == [(20, 144)]
+
+def test_skip_unchanged_window_lines():
+    video = get_video()
+    video.set_control(0x91 | 0x20)
+    video.set_window_y(100)
+    draw_lines(video, 0, 144)
+    assert video.wline_y == 44
+    assert video.get_changed_lines() == [(0, 144)]
+    draw_lines(video, 0, 144)
+    assert video.wline_y == 44
+    assert video.get_changed_lines() == []
+    video.set_window_y(101)
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == [(100, 144)]
+
+def test_clear_frame_invalidates_lines():
+    video = get_video()
+    draw_lines(video, 0, 144)
+    video.clear_frame()
+    assert video.get_changed_lines() == []
+    draw_lines(video, 0, 10)
+    assert video.get_changed_lines() == [(0, 10)]
+
+
+# FRAME SKIP -------------------------------------------------------------------
+
+class CountingVideoDriver(VideoDriver):
+    def __init__(self):
+        VideoDriver.__init__(self)
+        self.frames = []
+
+    def is_frame_needed(self, frame):
+        return frame % 2 == 0
+
+    def update_display_lines(self, changed_lines):
+        self.frames.append(changed_lines)
+
+def test_skipped_frames_draw_no_lines():
+    video = Video(CountingVideoDriver(), Interrupt(), Memory())
+    video.set_control(0x91)
+    for frame in range(4):
+        video.emulate(constants.FRAME_TICKS)
+    assert video.frame_count == 4
+    assert video.driver.frames == [[(0, 144)], []]
+
+
+# OBJECT INDEX -----------------------------------------------------------------
+
+def write_object(video, number, y, x, tile=0, flags=0):
+    address = constants.OAM_ADDR + (number << 2)
+    video.write(address + 0, y)
+    video.write(address + 1, x)
+    video.write(address + 2, tile)
+    video.write(address + 3, flags)
+
+def get_line_objects(video, line):
+    video.update_object_index()
+    first = line * constants.OBJECTS_PER_LINE
+    return video.line_objects[first:first + video.line_object_count[line]]
+
+def test_object_index():
+    video = get_video()
+    write_object(video, 0, 16, 20)
+    write_object(video, 1, 20, 10)
+    write_object(video, 2, 20, 20)
+    # hidden
+    write_object(video, 3, 0, 20)
+    assert get_line_objects(video, 0) == [(20 << 6) + 0]
+    assert get_line_objects(video, 4) == [(20 << 6) + 2, (20 << 6) + 0,
+                                          (10 << 6) + 1]
+    assert get_line_objects(video, 8) == [(20 << 6) + 2, (10 << 6) + 1]
+    assert get_line_objects(video, 12) == []
+    # 8x16 objects
+    video.set_control(video.control | 0x04)
+    assert get_line_objects(video, 19) == [(20 << 6) + 2, (10 << 6) + 1]
+    assert len(get_line_objects(video, 12)) == 3
+
+def test_object_index_limit():
+    video = get_video()
+    for number in range(12):
+        write_object(video, number, 16, 100 - number)
+    objects = get_line_objects(video, 0)
+    assert len(objects) == constants.OBJECTS_PER_LINE
+    assert objects[-1] == ((100 - 9) << 6) + 9
+
+def test_object_index_dma():
+    video = get_video()
+    write_object(video, 0, 16, 8)
+    assert len(get_line_objects(video, 0)) == 1
+    video.set_dma(0x00)
+    assert get_line_objects(video, 0) == []
+
+def test_skip_unchanged_object_lines():
+    video = get_video()
+    video.set_control(0x91 | 0x02)
+    write_object(video, 0, 16, 8, 1)
+    write_object(video, 1, 40, 8, 2)
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == [(0, 144)]
+    # the tile of object 0
+    write_tile_row(video, 1, 3, 0x0080)
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == [(3, 4)]
+    # object 1 moves down, its old and its new lines change
+    write_object(video, 1, 44, 8, 2)
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == [(24, 36)]
+    # object 0 changes its flags
+    write_object(video, 0, 16, 8, 1, 0x20)
+    draw_lines(video, 0, 144)
+    assert video.get_changed_lines() == [(0, 8)]
+
+def test_draw_objects():
+    video = get_video()
+    write_tile_row(video, 1, 0, 0x0080)
+    write_tile_row(video, 1, 7, 0x8000)
+    write_object(video, 0, 16, 8, 1)
+    write_object(video, 1, 16, 20, 1, 0x40)
+    video.line_y = 0
+    video.draw_objects()
+    assert video.line[8] == 0x0002
+    assert video.line[20] == 0x0200
+
+
+# DOT ACCURATE MODE ------------------------------------------------------------
+
+def draw_line_with_palette_write(video, cycles, palette):
+    # starts the transfer of line 0 and writes the palette after cycles
+    video.set_control(0x91)
+    video.write(constants.BGP, 0x00)
+    video.line_y = 0
+    video.stat = (video.stat & 0xFC) | 0x02
+    video.cycles = 0
+    video.emulate_oam()
+    video.emulate(cycles)
+    video.write(constants.BGP, palette)
+    video.emulate(constants.MODE_3_BEGIN_TICKS + constants.MODE_3_END_TICKS
+                  - cycles)
+    assert video.stat & 0x03 == 0x00
+    return video.driver.get_pixels()[0:constants.GAMEBOY_SCREEN_WIDTH]
+
+def test_line_dot_x():
+    video = get_video()
+    video.set_control(0x91)
+    video.stat = (video.stat & 0xFC) | 0x02
+    video.cycles = 0
+    video.emulate_oam()
+    assert video.get_line_dot_x() == 0
+    video.emulate(6)
+    assert video.get_line_dot_x() == 8
+    video.emulate(constants.MODE_3_BEGIN_TICKS - 6)
+    assert video.get_line_dot_x() == 32
+    video.emulate(constants.MODE_3_END_TICKS - 5)
+    assert video.get_line_dot_x() == 140
+    video.emulate(4)
+    assert video.get_line_dot_x() == 156
+
+def test_mid_line_palette_write():
+    video = get_video()
+    video.set_dot_accurate(True)
+    pixels = draw_line_with_palette_write(video, 6, 0xFF)
+    assert pixels[0:8] == [pixels[0]] * 8
+    assert pixels[8:] == [pixels[8]] * (constants.GAMEBOY_SCREEN_WIDTH - 8)
+    assert pixels[0] != pixels[8]
+    assert video.get_changed_lines() == [(0, 1)]
+
+def test_scanline_palette_write():
+    video = get_video()
+    assert not video.is_dot_accurate()
+    pixels = draw_line_with_palette_write(video, 6, 0xFF)
+    # the line is drawn with the palette at the end of the transfer
+    assert pixels == [pixels[0]] * constants.GAMEBOY_SCREEN_WIDTH
+    video.set_dot_accurate(True)
+    assert draw_line_with_palette_write(video, 6, 0xFF)[0] != pixels[0]
+
+def test_mid_line_scroll_write():
+    video = get_video()
+    video.set_dot_accurate(True)
+    # tile 1 is the third tile of the first map row
+    write_tile_row(video, 1, 0, 0x00FF)
+    video.write(constants.VRAM_ADDR + constants.VRAM_MAP_A + 2, 0x01)
+    video.set_control(0x91)
+    video.write(constants.BGP, 0xE4)
+    video.line_y = 0
+    video.stat = (video.stat & 0xFC) | 0x02
+    video.cycles = 0
+    video.emulate_oam()
+    video.emulate(6)
+    # the pixels from 8 on are drawn scrolled by 8 pixels
+    video.write(constants.SCX, 8)
+    video.emulate(constants.MODE_3_BEGIN_TICKS + constants.MODE_3_END_TICKS
+                  - 6)
+    pixels = video.driver.get_pixels()
+    assert pixels[8:16] == [pixels[8]] * 8
+    assert pixels[8] != pixels[0]
+    assert pixels[16:32] == [pixels[0]] * 16
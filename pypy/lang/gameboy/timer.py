@@ -6,7 +6,6 @@ Timer and Divider
 
 from pypy.lang.gameboy import constants
 from pypy.lang.gameboy.interrupt import *
-from math import ceil
 from pypy.lang.gameboy.ram import iMemory
 import time
 
@@ -27,6 +26,24 @@ class Timer(iMemory):
         self.timer_cycles   = constants.TIMER_CLOCK[0]
         self.timer_clock    = constants.TIMER_CLOCK[0]
 
+    def save_state(self, state):
+        state.write_int(self.div)
+        state.write_int(self.divider_cycles)
+        state.write_int(self.tima)
+        state.write_int(self.tma)
+        state.write_int(self.tac)
+        state.write_int(self.timer_cycles)
+        state.write_int(self.timer_clock)
+
+    def load_state(self, state):
+        self.div            = state.read_int()
+        self.divider_cycles = state.read_int()
+        self.tima           = state.read_int()
+        self.tma            = state.read_int()
+        self.tac            = state.read_int()
+        self.timer_cycles   = state.read_int()
+        self.timer_clock    = state.read_int()
+
     def write(self,  address, data):
         address = int(address)
         if address == constants.DIV:
@@ -77,9 +94,12 @@ class Timer(iMemory):
         self.tac = data
 
     def get_cycles(self):
-        if (self.tac & 0x04) != 0 and self.timer_cycles < self.divider_cycles:
-                return self.timer_cycles
-        return self.divider_cycles
+        # DIV and TIMA are caught up when they are accessed, the only event
+        # is the overflow of TIMA
+        if (self.tac & 0x04) == 0:
+            return constants.GAMEBOY_CLOCK
+        return self.timer_cycles + \
+               (0xFF - (self.tima & 0xFF)) * self.timer_clock
 
     def emulate(self,  ticks):
         ticks = int(ticks)
@@ -91,7 +111,7 @@ class Timer(iMemory):
         self.divider_cycles -= ticks
         if self.divider_cycles > 0:
             return
-        count = int(ceil(-1.0*self.divider_cycles / constants.DIV_CLOCK))
+        count = -self.divider_cycles // constants.DIV_CLOCK + 1
         self.div = (self.div + count) & 0xFF
         self.divider_cycles += constants.DIV_CLOCK*count
             
@@ -102,16 +122,17 @@ class Timer(iMemory):
         self.timer_cycles -= ticks
         if self.timer_cycles > 0:
             return
-        count = int(ceil(-1.0*self.timer_cycles / self.timer_clock))
-        self.tima_zero_pass_check(count)
-        self.tima = (self.tima + count) & 0xFF
+        count = -self.timer_cycles // self.timer_clock + 1
         self.timer_cycles += self.timer_clock * count
+        self.add_timer_counter(count)
 
-    def tima_zero_pass_check(self, count):
-        if (self.tima < 0) and (self.tima + count >= 0):
-            self.tima = self.tma - count
+    def add_timer_counter(self, count):
+        tima = (self.tima & 0xFF) + count
+        if tima > 0xFF:
+            # overflow, TIMA is reloaded with TMA
+            tima = self.tma + (tima - 0x100) % (0x100 - self.tma)
             self.interrupt.raise_interrupt(constants.TIMER)
-            #print self.interrupt.timer.is_pending(), self.interrupt.is_pending(constants.TIMER)
+        self.tima = tima
         
 # CLOCK DRIVER -----------------------------------------------------------------
 
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Records and replays input movies headlessly.
+
+    movietool.py record rom movie frames [frame:mask ...]
+    movietool.py play rom movie [paced]
+
+record runs the ROM from power on for frames frames, pressing the buttons
+of the given hex masks from the given frames on. play replays the movie
+as fast as possible, or paced to the frame rate, and prints the speed and
+the digest of the final state.
+"""
+
+import autopath
+import sys
+import os
+import time
+from pypy.lang.gameboy.batch import BatchGameBoy
+from pypy.lang.gameboy.joypad import JoypadDriver
+from pypy.lang.gameboy.movie import MovieRecorder, MoviePlayer, load_movie
+
+
+def read_file(path):
+    fd = os.open(path, os.O_RDONLY, 0)
+    try:
+        chunks = []
+        while True:
+            data = os.read(fd, 65536)
+            if data == "":
+                return "".join(chunks)
+            chunks.append(data)
+    finally:
+        os.close(fd)
+
+def write_file(path, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def record(rom, path, frames, events):
+    gameboy = BatchGameBoy()
+    gameboy.load_cartridge_file(rom)
+    source = JoypadDriver()
+    recorder = MovieRecorder(gameboy, source)
+    script = []
+    for event in events:
+        frame, mask = event.split(":")
+        script.append((int(frame), int(mask, 16)))
+    for frame in range(frames):
+        for event_frame, mask in script:
+            if event_frame == frame:
+                source.set_button_mask(mask)
+        recorder.emulate_frame()
+    data = recorder.get_movie().get_data()
+    write_file(path, data)
+    print "%d frames, %d bytes, %s" % (frames, len(data), gameboy.get_digest())
+
+def play(rom, path, paced):
+    gameboy = BatchGameBoy()
+    gameboy.load_cartridge_file(rom)
+    player = MoviePlayer(gameboy, load_movie(read_file(path)), paced)
+    start = time.time()
+    frames = player.play()
+    seconds = time.time() - start
+    speed = 0.0
+    if seconds > 0.0:
+        speed = frames / seconds
+    print "%d frames in %f s, %f frames/s, %s" % (frames, seconds, speed,
+                                                  gameboy.get_digest())
+
+
+def main(argv):
+    if len(argv) >= 5 and argv[1] == "record":
+        record(argv[2], argv[3], int(argv[4]), argv[5:])
+    elif len(argv) >= 4 and argv[1] == "play":
+        play(argv[2], argv[3], len(argv) > 4 and argv[4] == "paced")
+    else:
+        print __doc__
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Runs the ROM jobs of a job file on a pool of worker processes and prints
+the report.
+
+    romfarm.py [workers] jobfile
+
+Every line of the job file is a ROM path, a cycle budget and optionally
+the input script as frame:mask pairs, the masks in hex:
+
+    rom/rom6/rom6.gb 70224 1:81 2:00
+
+Without a job file the bundled ROMs run for 64 cycles each.
+"""
+
+import autopath
+import sys
+import os
+from pypy.lang.gameboy.farm import Farm, FarmJob
+
+ROM_PATH = os.path.join(os.path.dirname(os.path.dirname(
+                        os.path.abspath(__file__))), "rom")
+ROMS = ["rom3", "rom4", "rom5", "rom6", "rom7", "rom8", "rom9"]
+EMULATION_CYCLES = 64
+
+
+def parse_job(line):
+    fields = line.split()
+    script = []
+    for event in fields[2:]:
+        frame, mask = event.split(":")
+        script.append((int(frame), int(mask, 16)))
+    return FarmJob(fields[0], int(fields[1]), script)
+
+def read_jobs(path):
+    jobs = []
+    for line in open(path).read().splitlines():
+        line = line.strip()
+        if line != "" and not line.startswith("#"):
+            jobs.append(parse_job(line))
+    return jobs
+
+
+def main(argv):
+    workers = 4
+    if len(argv) > 1 and argv[1].isdigit():
+        workers = int(argv[1])
+        argv = argv[1:]
+    if len(argv) > 1:
+        jobs = read_jobs(argv[1])
+    else:
+        jobs = [FarmJob("%s/%s/%s.gb" % (ROM_PATH, rom, rom),
+                        EMULATION_CYCLES) for rom in ROMS]
+    farm = Farm(workers)
+    try:
+        results = farm.run(jobs)
+    finally:
+        farm.stop()
+    sys.stdout.write(farm.get_report(jobs, results))
+    for result in results:
+        if result.is_failed():
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Compares the speed of the scanline and the dot accurate video mode on the
+bundled ROMs.
+
+    videobench.py [frames] [rom ...]
+"""
+
+import autopath
+import sys
+import os
+from pypy.lang.gameboy.batch import BatchRunner, VIDEO_HASH
+
+ROM_PATH = os.path.join(os.path.dirname(os.path.dirname(
+                        os.path.abspath(__file__))), "rom")
+ROMS = ["rom3", "rom6", "rom7", "rom8"]
+
+
+def run(rom, frames, dot_accurate):
+    runner = BatchRunner("%s/%s/%s.gb" % (ROM_PATH, rom, rom), 1, VIDEO_HASH,
+                         1, dot_accurate)
+    runner.emulate_frames(frames)
+    return runner
+
+
+def main(argv):
+    frames = 600
+    roms = ROMS
+    if len(argv) > 1:
+        frames = int(argv[1])
+    if len(argv) > 2:
+        roms = argv[2:]
+    print "%-6s %12s %12s %8s %s" % ("rom", "scanline/s", "dot/s", "ratio",
+                                     "frames")
+    for rom in roms:
+        scanline = run(rom, frames, False)
+        dot = run(rom, frames, True)
+        ratio = 0.0
+        if dot.time > 0.0:
+            ratio = scanline.time / dot.time
+        same = scanline.gameboys[0].video_driver.frame_hashes == \
+               dot.gameboys[0].video_driver.frame_hashes
+        print "%-6s %12.1f %12.1f %8.2f %s" % (rom,
+            scanline.get_frames_per_second(), dot.get_frames_per_second(),
+            ratio, ["differ", "equal"][same])
+
+
+if __name__ == "__main__":
+    main(sys.argv)
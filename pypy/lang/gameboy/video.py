@@ -4,38 +4,15 @@
 """
 
 from pypy.lang.gameboy import constants
-from pypy.lang.gameboy.ram import iMemory
+from pypy.lang.gameboy.ram import iMemory, ByteBuffer
 
 
-
-class VideoCallWraper(object):
-    def call(self, pos, color, mask):
-        pass
-    
-
-class set_overlapped_object_line_call_wrapper(VideoCallWraper):
-    def __init__(self, video):
-        self.video = video
-    
-    def call(self, pos, color, mask):
-        self.video. set_overlapped_object_line(pos, color, mask)
-
-
-class set_tile_line_call_wrapper(VideoCallWraper):
-    def __init__(self, video):
-        self.video = video
-    
-    def call(self, pos, color, mask):
-        self.video.set_tile_line(pos, color, mask)
-    
-
 class Video(iMemory):
     #frames = 0
     #frame_skip = 0
 
      # Line Buffer, constants.OAM Cache and Color Palette
     #line = []#= new int[8 + 160 + 8]
-    #objects = []#= new int[OBJECTS_PER_LINE]
     #palette = []#= new int[1024]
 
     def __init__(self, video_driver, interrupt, memory):
@@ -43,8 +20,45 @@ class Video(iMemory):
         self.driver = video_driver
         self.interrupt = interrupt
         self.memory = memory
+        self.vram       = ByteBuffer(constants.VRAM_SIZE)
+        self.oam        = ByteBuffer(constants.OAM_SIZE)
+        self.dma_buffer = ByteBuffer(constants.OAM_SIZE)
+        # decoded tile rows, 8 pixels per row with the color bits at
+        # 0x0101, normal and horizontally flipped
+        self.tile_rows         = [0] * (constants.TILE_COUNT * 8 * 8)
+        self.tile_rows_flipped = [0] * (constants.TILE_COUNT * 8 * 8)
+        self.tile_valid        = [False] * constants.TILE_COUNT
+        # state each visible line was drawn with, see update_line_state
+        self.line_state   = [0] * (constants.GAMEBOY_SCREEN_HEIGHT * \
+                                   constants.LINE_STATE_SIZE)
+        self.line_valid   = [False] * constants.GAMEBOY_SCREEN_HEIGHT
+        self.line_changed = [False] * constants.GAMEBOY_SCREEN_HEIGHT
+        # generation of the last write to every tile row, tile map row and
+        # object, and of the contents each line was drawn with, see
+        # get_line_generation. The generation only grows.
+        self.generation = 0
+        self.tile_row_generation = [0] * (constants.TILE_DATA_SIZE >> 1)
+        self.map_row_generation  = [0] * ((constants.VRAM_SIZE - \
+                                           constants.TILE_DATA_SIZE) >> 5)
+        self.object_generation   = [0] * 40
+        self.line_object_generation = [0] * constants.GAMEBOY_SCREEN_HEIGHT
+        self.line_generation     = [0] * constants.GAMEBOY_SCREEN_HEIGHT
+        # objects shown in every line, see build_object_index
+        self.line_objects      = [0] * (constants.GAMEBOY_SCREEN_HEIGHT * \
+                                        constants.OBJECTS_PER_LINE)
+        self.line_object_count = [0] * constants.GAMEBOY_SCREEN_HEIGHT
+        self.dot_accurate = False
         self.reset()
 
+    def is_dot_accurate(self):
+        return self.dot_accurate
+
+    def set_dot_accurate(self, dot_accurate):
+        # the dot accurate mode draws a line in segments and applies
+        # register writes during the transfer at the pixel the LCD is at
+        self.dot_accurate = dot_accurate
+        self.invalidate_lines()
+
     def get_frame_skip(self):
         return self.frame_skip
 
@@ -67,23 +81,92 @@ class Video(iMemory):
         self.object_palette_1   = 0xFF
 
         self.transfer   = True
-        self.display    = True
+        self.display    = self.driver.is_frame_needed(0)
         self.vblank     = True
         self.dirty      = True
 
-        self.vram       = [0]*constants.VRAM_SIZE
-        self.oam        = [0]*constants.OAM_SIZE
+        self.vram.fill(0)
+        self.oam.fill(0)
+        self.oam_generation  = 0
+        self.invalidate_tiles()
+        self.invalidate_lines()
+        self.object_index_generation = -1
+        self.object_index_size = 0
         
         self.line       = [0]* (8+160+8)
-        self.objects    = [0] * constants.OBJECTS_PER_LINE
         self.palette    = [0] * 1024
         
         self.frames     = 0
         self.frame_skip = 0
+        self.frame_count = 0
+        # pixels of the current line drawn in the dot accurate mode
+        self.line_x     = 0
+        self.line_wline_y = 0
+
+    def save_state(self, state):
+        # the frame skip and the dot accurate mode are settings, the caches
+        # are rebuilt
+        state.write_buffer(self.vram)
+        state.write_buffer(self.oam)
+        state.write_int(self.cycles)
+        state.write_int(self.control)
+        state.write_int(self.stat)
+        state.write_int(self.line_y)
+        state.write_int(self.line_y_compare)
+        state.write_int(self.dma)
+        state.write_int(self.scroll_y)
+        state.write_int(self.scroll_x)
+        state.write_int(self.window_y)
+        state.write_int(self.wline_y)
+        state.write_int(self.window_x)
+        state.write_int(self.background_palette)
+        state.write_int(self.object_palette_0)
+        state.write_int(self.object_palette_1)
+        state.write_bool(self.transfer)
+        state.write_bool(self.display)
+        state.write_bool(self.vblank)
+        state.write_int(self.frames)
+        state.write_int(self.frame_count)
+        state.write_int(self.line_x)
+        state.write_int(self.line_wline_y)
+
+    def load_state(self, state):
+        state.read_buffer(self.vram)
+        state.read_buffer(self.oam)
+        self.cycles         = state.read_int()
+        self.control        = state.read_int()
+        self.stat           = state.read_int()
+        self.line_y         = state.read_int()
+        self.line_y_compare = state.read_int()
+        self.dma            = state.read_int()
+        self.scroll_y       = state.read_int()
+        self.scroll_x       = state.read_int()
+        self.window_y       = state.read_int()
+        self.wline_y        = state.read_int()
+        self.window_x       = state.read_int()
+        self.background_palette = state.read_int()
+        self.object_palette_0   = state.read_int()
+        self.object_palette_1   = state.read_int()
+        self.transfer       = state.read_bool()
+        self.display        = state.read_bool()
+        self.vblank         = state.read_bool()
+        self.frames         = state.read_int()
+        self.frame_count    = state.read_int()
+        self.line_x         = state.read_int()
+        self.line_wline_y   = state.read_int()
+        self.dirty = True
+        self.oam_generation  += 1
+        self.invalidate_tiles()
+        # the frame buffer is not stored, the next frame is drawn in full
+        self.invalidate_lines()
 
     def write(self, address, data):
         address = int(address)
         # assert data >= 0x00 and data <= 0xFF
+        if self.dot_accurate and (self.stat & 0x03) == 0x03 and \
+           self.display and self.is_line_register(address):
+            # draw the pixels up to the write with the old registers
+            self.draw_line_to(self.get_line_dot_x())
         if address == constants.LCDC :
             self.set_control(data)
         elif address == constants.STAT:
@@ -115,11 +198,35 @@ class Video(iMemory):
     def write_oam(self, address, data):
         if address >= constants.OAM_ADDR and \
            address < constants.OAM_ADDR + constants.OAM_SIZE:
-            self.oam[address - constants.OAM_ADDR] = data & 0xFF
+            self.write_oam_byte(address - constants.OAM_ADDR, data)
         elif address >= constants.VRAM_ADDR and \
              address < constants.VRAM_ADDR + constants.VRAM_SIZE:
-              self.vram[address - constants.VRAM_ADDR] = data & 0xFF
-            
+            self.write_vram(address, data)
+
+    def write_oam_byte(self, index, data):
+        if self.oam.get(index) != (data & 0xFF):
+            self.oam.set(index, data)
+            self.oam_generation += 1
+            self.generation += 1
+            self.object_generation[index >> 2] = self.generation
+
+    def write_vram(self, address, data):
+        address -= constants.VRAM_ADDR
+        if self.vram.get(address) == (data & 0xFF):
+            return
+        self.vram.set(address, data)
+        self.generation += 1
+        if address < constants.TILE_DATA_SIZE:
+            self.tile_valid[address >> 4] = False
+            self.tile_row_generation[address >> 1] = self.generation
+        else:
+            self.map_row_generation[(address - constants.VRAM_MAP_A) >> 5] = \
+                self.generation
+
+    def invalidate_tiles(self):
+        for tile in range(0, constants.TILE_COUNT):
+            self.tile_valid[tile] = False
+
     def read(self, address):
         address = int(address)
         if address == constants.LCDC:
@@ -152,13 +259,15 @@ class Video(iMemory):
     def read_oam(self, address):
         if (address >= constants.OAM_ADDR and \
             address < constants.OAM_ADDR + constants.OAM_SIZE):
-             return self.oam[address - constants.OAM_ADDR]
+             return self.oam.get(address - constants.OAM_ADDR)
         elif (address >= constants.VRAM_ADDR and \
             address < constants.VRAM_ADDR + constants.VRAM_SIZE):
-             return self.vram[address - constants.VRAM_ADDR]
+             return self.vram.get(address - constants.VRAM_ADDR)
         return 0xFF
 
     def get_cycles(self):
+        if (self.control & 0x80) == 0:
+            return constants.GAMEBOY_CLOCK
         return self.cycles
 
     def emulate(self, ticks):
@@ -169,11 +278,12 @@ class Video(iMemory):
             
     def consume_cycles(self):
         while self.cycles <= 0:
-            if self.stat == 0:
+            mode = self.stat & 0x03
+            if mode == 0:
                 self.emulate_hblank()
-            elif self.stat == 1:
+            elif mode == 1:
                 self.emulate_vblank()
-            elif self.stat == 2:
+            elif mode == 2:
                 self.emulate_oam()
             else:
                 self.emulate_transfer()
@@ -250,8 +360,18 @@ class Video(iMemory):
 
     def set_dma(self, data):
         self.dma = data
+        self.memory.read_block(self.dma << 8, self.dma_buffer, 0,
+                               constants.OAM_SIZE)
+        changed = False
         for index in range(0, constants.OAM_SIZE):
-            self.oam[index] = self.memory.read((self.dma << 8) + index)
+            if self.oam.get(index) != self.dma_buffer.get(index):
+                if not changed:
+                    self.generation += 1
+                    changed = True
+                self.object_generation[index >> 2] = self.generation
+        if changed:
+            self.oam.copy_from(self.dma_buffer, 0, 0, constants.OAM_SIZE)
+            self.oam_generation += 1
 
     def get_background_palette(self):
         return self.background_palette
@@ -293,15 +413,19 @@ class Video(iMemory):
         self.stat = (self.stat & 0xFC) | 0x03
         self.cycles += constants.MODE_3_BEGIN_TICKS
         self.transfer = True
+        if self.dot_accurate and self.display:
+            self.begin_line()
 
     def emulate_transfer(self):
         if self.transfer:
-            if self.display:
+            if self.display and not self.dot_accurate:
                 self.draw_line()
             self.stat = (self.stat & 0xFC) | 0x03
             self.cycles += constants.MODE_3_END_TICKS
             self.transfer = False
         else:
+            if self.display and self.dot_accurate:
+                self.draw_line_to(constants.GAMEBOY_SCREEN_WIDTH)
             self.stat = (self.stat & 0xFC)
             self.cycles += constants.MODE_0_TICKS
             # H-Blank interrupt
@@ -335,8 +459,11 @@ class Video(iMemory):
     def emulate_hblank_part_2(self):
         if self.display:
             self.draw_frame()
+        self.frame_count += 1
         self.frames += 1
-        if self.frames >= self.frame_skip:
+        # skipped frames draw no lines at all
+        if self.frames >= self.frame_skip and \
+           self.driver.is_frame_needed(self.frame_count):
             self.display = True
             self.frames = 0
         else:
@@ -392,13 +519,178 @@ class Video(iMemory):
             self.stat &= 0xFB
     
     def draw_frame(self):
-        self.driver.update_display()
+        self.driver.update_display_lines(self.get_changed_lines())
 
     def clear_frame(self):
         self.clear_pixels()
+        self.invalidate_lines()
         self.driver.update_display()
 
+    def invalidate_lines(self):
+        for y in range(0, constants.GAMEBOY_SCREEN_HEIGHT):
+            self.line_valid[y] = False
+            self.line_changed[y] = False
+
+    def get_changed_lines(self):
+        # (first, last + 1) ranges of the lines drawn since the last frame
+        changed_lines = []
+        first = -1
+        for y in range(0, constants.GAMEBOY_SCREEN_HEIGHT):
+            if self.line_changed[y]:
+                self.line_changed[y] = False
+                if first < 0:
+                    first = y
+            elif first >= 0:
+                changed_lines.append((first, y))
+                first = -1
+        if first >= 0:
+            changed_lines.append((first, constants.GAMEBOY_SCREEN_HEIGHT))
+        return changed_lines
+
+    def store_line_state(self, offset, value):
+        if self.line_state[offset] == value:
+            return 0
+        self.line_state[offset] = value
+        return 1
+
+    def update_line_state(self, window_line):
+        # returns True if the line has to be drawn again, the drawn pixels
+        # only depend on the registers and the VRAM/OAM contents the line
+        # shows
+        if (self.control & 0x02) != 0:
+            # a rebuilt index gets a generation newer than the line
+            self.update_object_index()
+        offset = self.line_y * constants.LINE_STATE_SIZE
+        changes  = self.store_line_state(offset + 0, self.control)
+        changes += self.store_line_state(offset + 1, self.scroll_x)
+        changes += self.store_line_state(offset + 2, self.scroll_y)
+        changes += self.store_line_state(offset + 3, self.window_x)
+        changes += self.store_line_state(offset + 4, window_line)
+        changes += self.store_line_state(offset + 5, self.background_palette)
+        changes += self.store_line_state(offset + 6, self.object_palette_0)
+        changes += self.store_line_state(offset + 7, self.object_palette_1)
+        if changes == 0 and self.line_valid[self.line_y] and \
+           self.get_line_generation(window_line) <= \
+           self.line_generation[self.line_y]:
+            return False
+        self.line_generation[self.line_y] = self.generation
+        self.line_valid[self.line_y] = True
+        self.line_changed[self.line_y] = True
+        return True
+
+    def get_line_generation(self, window_line):
+        # the newest generation of the tile rows, the tile map rows and
+        # the objects the current line shows
+        generation = 0
+        if (self.control & 0x01) != 0:
+            y = (self.scroll_y + self.line_y) & 0xFF
+            tile_map = constants.VRAM_MAP_A
+            if (self.control & 0x08) != 0:
+                tile_map = constants.VRAM_MAP_B
+            generation = self.get_tiles_generation(tile_map + ((y >> 3) << 5),
+                                (self.scroll_x >> 3) & 0x1F,
+                                (168 - 8 + (self.scroll_x & 7) + 7) >> 3,
+                                y & 7)
+        if window_line >= 0:
+            tile_map = constants.VRAM_MAP_A
+            if (self.control & 0x40) != 0:
+                tile_map = constants.VRAM_MAP_B
+            generation = max(generation, self.get_tiles_generation(
+                                tile_map + ((window_line >> 3) << 5), 0,
+                                (168 - self.window_x - 1 + 7) >> 3,
+                                window_line & 7))
+        if (self.control & 0x02) != 0:
+            generation = max(generation, self.get_objects_generation())
+        return generation
+
+    def get_tiles_generation(self, row_address, column, count, tile_y):
+        # count tiles of the tile map row at row_address from column on,
+        # like draw_tiles
+        generation = self.map_row_generation[(row_address - \
+                                              constants.VRAM_MAP_A) >> 5]
+        for i in range(0, count):
+            tile = self.vram.get(row_address + ((column + i) & 0x1F))
+            if (self.control & 0x10) != 0:
+                address = tile << 4
+            else:
+                address = constants.VRAM_DATA_B + ((tile ^ 0x80) << 4)
+            generation = max(generation, self.tile_row_generation[
+                                         (address >> 1) + tile_y])
+        return generation
+
+    def get_objects_generation(self):
+        self.update_object_index()
+        generation = self.line_object_generation[self.line_y]
+        first = self.line_y * constants.OBJECTS_PER_LINE
+        last = first + self.line_object_count[self.line_y]
+        for index in range(first, last):
+            number = self.line_objects[index] & 0x3F
+            offset = number << 2
+            address = self.get_object_tile_address(offset,
+                                                   self.oam.get(offset + 3))
+            generation = max(generation, self.object_generation[number],
+                             self.tile_row_generation[address >> 1])
+        return generation
+
+    def is_window_visible(self):
+        return (self.control & 0x20) != 0 and \
+               self.line_y >= self.window_y and self.window_x < 167 and \
+               self.wline_y < 144
+
     def draw_line(self):
+        window_line = -1
+        if self.is_window_visible():
+            window_line = self.wline_y
+        if not self.update_line_state(window_line):
+            # unchanged, only keep the window line counter going
+            if window_line >= 0:
+                self.wline_y += 1
+            return
+        self.compose_line()
+        self.draw_pixels()
+
+    # DOT ACCURATE MODE --------------------------------------------------------
+
+    def is_line_register(self, address):
+        return address == constants.LCDC or address == constants.SCY or \
+               address == constants.SCX or address == constants.BGP or \
+               address == constants.OBP0 or address == constants.OBP1 or \
+               address == constants.WY or address == constants.WX
+
+    def get_line_dot_x(self):
+        # the pixel the LCD is at during the transfer, the 44 transfer
+        # cycles are 176 dots of which the first 16 fetch the first tiles
+        if self.transfer:
+            elapsed = constants.MODE_3_BEGIN_TICKS - self.cycles
+        else:
+            elapsed = constants.MODE_3_BEGIN_TICKS + \
+                      constants.MODE_3_END_TICKS - self.cycles
+        return max(0, min(constants.GAMEBOY_SCREEN_WIDTH, elapsed * 4 - 16))
+
+    def begin_line(self):
+        self.line_x = 0
+        self.line_wline_y = self.wline_y
+
+    def draw_line_to(self, x):
+        # composes the line with the current registers and draws its
+        # pixels from line_x up to x
+        if x <= self.line_x:
+            return
+        self.wline_y = self.line_wline_y
+        self.compose_line()
+        self.update_palette()
+        pixels = self.driver.get_pixels()
+        offset = self.line_y * self.driver.get_width()
+        for index in range(self.line_x, x):
+            pixels[offset + index] = self.palette[self.line[8 + index]]
+        self.line_x = x
+        # the line cache does not know the segments
+        self.line_valid[self.line_y] = False
+        self.line_changed[self.line_y] = True
+
+    # LINE DRAWING -------------------------------------------------------------
+
+    def compose_line(self):
         if (self.control & 0x01) != 0:
             self.draw_background()
         else:
@@ -407,7 +699,6 @@ class Video(iMemory):
             self.draw_window()
         if (self.control & 0x02) != 0:
             self.draw_objects()
-        self.draw_pixels()
 
     def draw_clean_background(self):
         for x in range(0, 8+160+8):
@@ -427,8 +718,7 @@ class Video(iMemory):
         self.draw_tiles(8 - (x & 7), tileMap, tileData)
 
     def draw_window(self):
-        if self.line_y < self.window_y or self.window_x >= 167 or \
-           self.wline_y >= 144:
+        if not self.is_window_visible():
             return
         tileMap = constants.VRAM_MAP_A
         if (self.control & 0x40) != 0:
@@ -442,85 +732,131 @@ class Video(iMemory):
         self.wline_y+=1
 
     def draw_objects(self):
-        count = self.scan_objects()
+        self.update_object_index()
         lastx = 176
-        for index in range(176, count):
-            data = self.objects[index]
-            x = (data >> 24) & 0xFF
-            flags = (data >> 12) & 0xFF
-            address = data & 0xFFF
+        first = self.line_y * constants.OBJECTS_PER_LINE
+        last = first + self.line_object_count[self.line_y]
+        for index in range(first, last):
+            key = self.line_objects[index]
+            x = key >> 6
+            offset = (key & 0x3F) << 2
+            flags = self.oam.get(offset + 3)
+            address = self.get_object_tile_address(offset, flags)
             if (x + 8 <= lastx):
                 self.draw_object_tile(x, address, flags)
             else:
                 self.draw_overlapped_object_tile(x, address, flags)
             lastx = x
 
-    def scan_objects(self):
-        count = 0
-        # search active objects
-        for offset in range(0, 4*40, 4):
-            y = self.oam[offset + 0] & 0xFF
-            x = self.oam[offset + 1] & 0xFF
+    def get_object_tile_address(self, offset, flags):
+        # address of the tile row of the object shown in the current line
+        y = self.line_y - self.oam.get(offset + 0) + 16
+        tile = self.oam.get(offset + 2)
+        if (self.control & 0x04) != 0:
+            # 8x16 tile size
+            tile &= 0xFE
+            if (flags & 0x40) != 0:
+                y = 15 - y
+        elif (flags & 0x40) != 0:
+            # Y flip
+            y = 7 - y
+        return (tile << 4) + (y << 1)
+
+    def update_object_index(self):
+        size = self.control & 0x04
+        if self.object_index_generation == self.oam_generation and \
+           self.object_index_size == size:
+            return
+        self.object_index_generation = self.oam_generation
+        self.object_index_size = size
+        self.build_object_index()
+
+    def build_object_index(self):
+        # buckets the objects by the lines they cover, at most
+        # OBJECTS_PER_LINE in OAM order per line. Every line is sorted from
+        # lower to higher priority by the key (x << 6) + object number.
+        # The lines with other objects than before get a new generation.
+        old_objects = self.line_objects[:]
+        old_count = self.line_object_count[:]
+        for line in range(0, constants.GAMEBOY_SCREEN_HEIGHT):
+            self.line_object_count[line] = 0
+        height = 8
+        if self.object_index_size != 0:
+            height = 16
+        for number in range(0, 40):
+            y = self.oam.get((number << 2) + 0)
+            x = self.oam.get((number << 2) + 1)
             if (y <= 0 or y >= 144 + 16 or x <= 0 or x >= 168):
                 continue
-            tile = self.oam[offset + 2] & 0xFF
-            flags = self.oam[offset + 3] & 0xFF
-
-            y = self.line_y - y + 16
-
-            if ((self.control & 0x04) != 0):
-                # 8x16 tile size
-                if (y < 0 or y > 15):
-                    continue
-                # Y flip
-                if ((flags & 0x40) != 0):
-                    y = 15 - y
-                tile &= 0xFE
-            else:
-                # 8x8 tile size
-                if (y < 0 or y > 7):
-                    continue
-                # Y flip
-                if ((flags & 0x40) != 0):
-                    y = 7 - y
-            self.objects[count] = (x << 24) + (count << 20) + (flags << 12) + \
-                                  (tile << 4) + (y << 1)
-            count += 1
-            if count >= constants.OBJECTS_PER_LINE:
-                break
-        self.sort_scan_object(count)
-        return count
-
-    def sort_scan_object(self, count):
-        # sort objects from lower to higher priority
-        for index in range(0, count):
-            rightmost = index
-            for number in range(index+1, count):
-                if (self.objects[number] >> 20) > \
-                   (self.objects[rightmost] >> 20):
-                    rightmost = number
-            if rightmost != index:
-                data = self.objects[index]
-                self.objects[index] = self.objects[rightmost]
-                self.objects[rightmost] = data
+            first = max(y - 16, 0)
+            last = min(y - 16 + height, constants.GAMEBOY_SCREEN_HEIGHT)
+            for line in range(first, last):
+                self.insert_line_object(line, (x << 6) + number)
+        self.generation += 1
+        for line in range(0, constants.GAMEBOY_SCREEN_HEIGHT):
+            if not self.has_line_objects(line, old_objects, old_count[line]):
+                self.line_object_generation[line] = self.generation
+
+    def has_line_objects(self, line, objects, count):
+        if self.line_object_count[line] != count:
+            return False
+        offset = line * constants.OBJECTS_PER_LINE
+        for index in range(offset, offset + count):
+            if self.line_objects[index] != objects[index]:
+                return False
+        return True
+
+    def insert_line_object(self, line, key):
+        count = self.line_object_count[line]
+        if count >= constants.OBJECTS_PER_LINE:
+            return
+        offset = line * constants.OBJECTS_PER_LINE
+        index = offset + count
+        while index > offset and self.line_objects[index - 1] < key:
+            self.line_objects[index] = self.line_objects[index - 1]
+            index -= 1
+        self.line_objects[index] = key
+        self.line_object_count[line] = count + 1
 
     def draw_tiles(self, x, tileMap, tileData):
         while x < 168:
             if (self.control & 0x10) != 0:
-                tile = self.vram[tileMap] & 0xFF
+                tile = self.vram.get(tileMap)
             else:
-                tile = (self.vram[tileMap] ^ 0x80) & 0xFF
+                tile = self.vram.get(tileMap) ^ 0x80
             self.draw_tile(x, tileData + (tile << 4))
             tileMap = (tileMap & 0x1FE0) + ((tileMap + 1) & 0x001F)
             x += 8
             
     def get_pattern(self, address):
-        pattern  = self.vram[address]      & 0xFF
-        pattern += (self.vram[address + 1] & 0xFF) << 8
+        pattern  = self.vram.get(address)
+        pattern += self.vram.get(address + 1) << 8
         return pattern
 
-    def draw_object(self, caller, x, address, flags):
-        pattern = self.get_pattern(address)
+    def decode_tile(self, tile):
+        address = tile << 4
+        offset = tile << 6
+        for row in range(0, 8):
+            pattern = self.get_pattern(address + (row << 1))
+            for i in range(0, 8):
+                self.tile_rows[offset + i] = (pattern >> (7-i)) & 0x0101
+                self.tile_rows_flipped[offset + i] = (pattern >> i) & 0x0101
+            offset += 8
+        self.tile_valid[tile] = True
+
+    def get_tile_row(self, address):
+        # offset of the decoded row of the tile data at address
+        tile = address >> 4
+        if not self.tile_valid[tile]:
+            self.decode_tile(tile)
+        return (tile << 6) + ((address & 0x0E) << 2)
+
+    def get_object_rows(self, flags):
+        if (flags & 0x20) != 0:
+            return self.tile_rows_flipped
+        return self.tile_rows
+
+    def get_object_mask(self, flags):
         mask = 0
         # priority
         if (flags & 0x80) != 0:
@@ -528,47 +864,30 @@ class Video(iMemory):
         # palette
         if (flags & 0x10) != 0:
             mask |= 0x0004
-        if (flags & 0x20) != 0:
-            self.draw_object_normal(x, pattern, mask, caller)
-        else:
-            self.draw_object_flipped(x, pattern, mask, caller)
-            
-    def draw_object_normal(self, x, pattern, mask, caller):
-        for i in range(0, 7):
-            color = pattern >> (6-i)
-            if (color & 0x0202) != 0:
-                caller.call(x+1, color, mask)
-        color = pattern << 1
-        if (color & 0x0202) != 0:
-            caller.call(x+7, color, mask)
-        
-    def draw_object_flipped(self, x, pattern, mask, caller):
-        color = pattern << 1
-        if (color & 0x0202) != 0:
-            caller.call(x, color, mask)
-        for i in range(0, 7):
-            color = pattern >> i
-            if (color & 0x0202) != 0:
-                caller.call(x + i + 1, color, mask)
-            
+        return mask
+
     def draw_tile(self, x, address):
-        pattern =  self.get_pattern(address)
+        offset = self.get_tile_row(address)
         for i in range(0, 8):
-            self.line[x + i] = (pattern >> (7-i)) & 0x0101
+            self.line[x + i] = self.tile_rows[offset + i]
 
     def draw_object_tile(self, x, address, flags):
-        self.draw_object(set_tile_line_call_wrapper(self), x, address, \
-                         flags)
-        
-    def set_tile_line(self, pos, color, mask):
-        self.line[pos] |= color | mask
+        offset = self.get_tile_row(address)
+        rows = self.get_object_rows(flags)
+        mask = self.get_object_mask(flags)
+        for i in range(0, 8):
+            color = rows[offset + i] << 1
+            if color != 0:
+                self.line[x + i] |= color | mask
 
     def draw_overlapped_object_tile(self, x, address, flags):
-        self.draw_object(set_overlapped_object_line_call_wrapper(self), \
-                         x, address, flags)
-        
-    def set_overlapped_object_line(self, pos, color, mask):
-        self.line[pos] = (self.line[pos] & 0x0101) | color | mask
+        offset = self.get_tile_row(address)
+        rows = self.get_object_rows(flags)
+        mask = self.get_object_mask(flags)
+        for i in range(0, 8):
+            color = rows[offset + i] << 1
+            if color != 0:
+                self.line[x + i] = (self.line[x + i] & 0x0101) | color | mask
 
     def draw_pixels(self):
         self.update_palette()
@@ -615,20 +934,38 @@ class VideoDriver(object):
     def __init__(self):
         self.width = int(constants.GAMEBOY_SCREEN_WIDTH)
         self.height = int(constants.GAMEBOY_SCREEN_HEIGHT)
-        self.clear_pixels()
+        self.pixels = [0] * self.width * self.height
         
     def clear_pixels(self):
-        self.pixels = [0] * self.width * self.height
+        for index in range(0, self.width * self.height):
+            self.pixels[index] = 0
             
     def get_width(self):
         return self.width
     
     def get_height(self):
-        return selg.height
+        return self.height
     
     def get_pixels(self):
         return self.pixels
+
+    def clone(self):
+        # the driver of a fork, without a display
+        driver = VideoDriver()
+        driver.pixels = self.pixels[:]
+        return driver
     
+    def is_frame_needed(self, frame):
+        # frame counts the frames since the video reset, lines of frames
+        # which are not needed are not drawn
+        return True
+
     def update_display(self):
-        self.clear_pixels()
+        pass
+
+    def update_display_lines(self, changed_lines):
+        # changed_lines holds (first, last + 1) ranges of the lines which
+        # differ from the previous frame
+        if len(changed_lines) > 0:
+            self.update_display()
         
\ No newline at end of file
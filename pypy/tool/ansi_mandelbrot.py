@@ -1,6 +1,10 @@
 import sys
 
-from py.__.misc.terminal_helper import ansi_print, get_terminal_width
+try:
+    from py.__.misc.terminal_helper import ansi_print, get_terminal_width
+except ImportError:
+    # py 1.x moved the helpers to py.io
+    from py.io import ansi_print, get_terminal_width
 
 """
 Black       0;30     Dark Gray     1;30
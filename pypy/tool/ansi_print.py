@@ -4,7 +4,11 @@ A color print.
 
 import sys
 
-from py.__.misc.terminal_helper import ansi_print
+try:
+    from py.__.misc.terminal_helper import ansi_print
+except ImportError:
+    # py 1.x moved the helper to py.io
+    from py.io import ansi_print
 from pypy.tool.ansi_mandelbrot import Driver
 
 class AnsiLog:
@@ -0,0 +1,67 @@
+import os
+import py
+from pypy.lang.gameboy.batch import BatchRunner
+
+
+ROM_PATH = str(py.magic.autopath().dirpath().dirpath().dirpath())+"/lang/gameboy/rom"
+DEFAULT_FRAMES = 60
+
+USAGE = "usage: %s [-i instances] [-f frames | -c cycles] [-d digest_file] rom\n"
+
+# Headless batch runner: emulates a number of independent GameBoys on the
+# same cartridge and reports frames and instructions per second.
+
+
+def entry_point(argv):
+    instances = 1
+    frames = DEFAULT_FRAMES
+    cycles = 0
+    digest_path = ""
+    filename = ""
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "-i" or arg == "-f" or arg == "-c" or arg == "-d":
+            if i + 1 >= len(argv):
+                os.write(2, USAGE % argv[0])
+                return 1
+            value = argv[i + 1]
+            i += 2
+            if arg == "-d":
+                digest_path = value
+                continue
+            try:
+                number = int(value)
+            except ValueError:
+                os.write(2, '"%s" is not an integer\n' % value)
+                return 1
+            if arg == "-i":
+                instances = number
+            elif arg == "-f":
+                frames = number
+                cycles = 0
+            else:
+                cycles = number
+        else:
+            filename = arg
+            i += 1
+    if filename == "":
+        filename = ROM_PATH+"/rom4/rom4.gb"
+    runner = BatchRunner(filename, instances)
+    if cycles > 0:
+        runner.emulate(cycles)
+    else:
+        runner.emulate_frames(frames)
+    os.write(1, runner.get_report())
+    if digest_path != "":
+        runner.write_digests(digest_path)
+    return 0
+
+
+# _____ Define and setup target ___
+
+def target(*args):
+    return entry_point, None
+
+def test_target():
+    entry_point(["boe", "-i", "2", "-f", "2", ROM_PATH+"/rom4/rom4.gb"])
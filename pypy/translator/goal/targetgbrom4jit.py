@@ -0,0 +1,55 @@
+import py
+from pypy.lang.gameboy import constants
+from pypy.lang.gameboy.cpu import *
+from pypy.lang.gameboy.gameboy import *
+
+
+ROM_PATH = str(py.magic.autopath().dirpath().dirpath().dirpath())+"/lang/gameboy/rom"
+EMULATION_CYCLES = 64
+
+# Same as targetgbrom4 but the CPU runs through CPU.jit_portal, translate
+# with --jit to get a JIT-compiled emulator.
+
+
+def entry_point(argv=None):
+    if len(argv) > 1:
+        filename = argv[1]
+    else:
+        filename = ROM_PATH+"/rom4/rom4.gb"
+    gameBoy = GameBoy()
+    gameBoy.cpu.enable_jit_portal()
+    gameBoy.load_cartridge_file(str(filename))
+    return gameBoy.emulate(EMULATION_CYCLES)
+
+
+# _____ Define and setup target ___
+
+def target(driver, args):
+    return entry_point, None
+
+# ____________________________________________________________
+
+from pypy.jit.hintannotator.policy import HintAnnotatorPolicy
+
+class GameBoyHintAnnotatorPolicy(HintAnnotatorPolicy):
+    novirtualcontainer = True
+    oopspec = True
+
+    def look_inside_graph(self, graph):
+        # only the CPU is specialized, the memory map and the other
+        # components are called as they are
+        func = getattr(graph, 'func', None)
+        if func is None:
+            return True
+        mod = func.__module__ or '?'
+        if mod.startswith('pypy.lang.gameboy'):
+            return mod == 'pypy.lang.gameboy.cpu'
+        return True
+
+def portal(driver):
+    """Return the 'portal' function, and the hint-annotator policy.
+    """
+    return CPU.jit_portal.im_func, GameBoyHintAnnotatorPolicy()
+
+def test_target():
+    entry_point(["boe", ROM_PATH+"/rom4/rom4.gb"])